@@ -1,42 +1,21 @@
-import nltk
-# FIRST TIME, you'll need to run the following 3 lines.
-# nltk.download('punkt')
-# nltk.download('wordnet')
-# nltk.download('stopwords')
-
-from deep_translator import GoogleTranslator
-from joblib import load
-import numpy as np
+# NOTE: the heavy libraries (torch, transformers, ...) and the models are only loaded by initialize(),
+# which the bot runs in the background after connecting to discord; importing this module is cheap.
+import asyncio
+from collections import deque
+import csv
+from itertools import islice
+import json
+import math
 import openai
-import os
-import pandas as pd
-from scipy.special import softmax
-# from sklearn.linear_model import LogisticRegression
+import pathlib
+import random
+import threading
 import time
 from typing import List
+from ensemble_combiner import EnsembleCombiner
+from text_normalizer import normalize_text
+from verdict_cache import Verdict, VerdictCache, text_hash
 
-import torch
-from torch.utils.data import TensorDataset, DataLoader, RandomSampler, SequentialSampler
-# from sklearn.model_selection import train_test_split
-
-# download this library from https://pypi.org/project/tweet-preprocessor/
-import preprocessor as p
-
-from transformers import XLMModel, BertTokenizer, BertForSequenceClassification, RobertaTokenizerFast, RobertaForSequenceClassification
-from transformers import AdamW
-import nltk
-from nltk.stem import 	WordNetLemmatizer
-from nltk.stem.porter import PorterStemmer
-from nltk.corpus import stopwords
-stop_words = set(stopwords.words('english'))
-
-from tqdm import tqdm, trange
-import pandas as pd
-import io
-import numpy as np
-import matplotlib.pyplot as plt
-import json
-import pathlib
 curr_working_dir = pathlib.Path().resolve()
 path_to_data_and_models = "{}/../Data_And_Models/".format(curr_working_dir)
 # import ensemble_model.joblib
@@ -47,6 +26,23 @@ ENSEMBLE_MODEL_FILE = "../Data_And_Models/ensemble_model.joblib"  #"{}ensemble_m
 TRAIN_FILE = "{}full_train.csv".format(path_to_data_and_models) # contains examples that Chat-GPT uses to learn how to predict
 
 MAX_LEN = 128 # used for BERT model
+BERT_BATCH_SIZE = 32 # texts per BERT forward pass
+BERT_BACKEND = "torch" # "torch" (fp32), "quantized" (dynamic INT8) or "onnx" (ONNX Runtime); see bert_backends.py for a parity check
+BERT_ONNX_FILE = "../Data_And_Models/BERT_base_uncased_best_model.onnx" # exported from the checkpoint the first time the onnx backend is used
+
+CASCADE_ENABLED = True # answer clearly harmless messages with the cheap first-stage classifier in cascade.py
+CASCADE_ESCALATION_THRESHOLD = 0.1 # messages the first stage scores at or above this go on to the ensemble
+CASCADE_STATS_PRINT_INTERVAL = 1000 # print the share of traffic handled by each stage every this many messages
+
+TRANSLATION_CACHE_MAX_ENTRIES = 10000 # source text -> English translation pairs kept by each inference worker
+
+GPT_EARLY_EXIT_ENABLED = True # skip the Chat-GPT request when BERT is decisive; see early_exit.py for an offline report
+GPT_EARLY_EXIT_UNCERTAIN_LOW = 0.01 # Chat-GPT is only asked about messages with a BERT score inside this band, which passes early_exit.py's gate
+GPT_EARLY_EXIT_UNCERTAIN_HIGH = 1.0 # BERT-confident fakes still go to Chat-GPT, so their scores can reach the auto-removal threshold
+
+VERDICT_CACHE_MAX_ENTRIES = 10000 # verdicts kept in memory by each inference worker
+VERDICT_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+VERDICT_CACHE_DB_FILE = "verdict_cache.db" # persists verdicts across restarts; set to None to keep the cache in memory only
 
 MAXIMUM_NUM_CHAT_GPT_MESSAGES = 2048 # maximum number of messages
 NUM_REQUIRED_CHAT_GPT_MESSAGES = 2 # number of structuring messages we must include to Chat-GPT
@@ -59,86 +55,156 @@ ZERO_LABEL_KEYWORD = "real"
 ONE_LABEL_KEYWORD = "fake"
 
 NO_GPT_PRED_NUM_LABEL = -1
+
+GPT_MODEL = "gpt-3.5-turbo"
+GPT_MAX_CONCURRENT_REQUESTS = 8 # maximum number of Chat-GPT requests in flight at once
+GPT_REQUEST_TIMEOUT_SECONDS = 20 # a request that takes longer than this counts as a failed prediction
+GPT_MAX_RETRIES = 3 # number of times a rate limited or server-error (5xx) request is retried
+GPT_RETRY_BASE_DELAY_SECONDS = 1.0 # retries back off exponentially from this delay, with random jitter
+NON_GPT_STAGES_BUDGET_SECONDS = 30 # allowance for translation, BERT and the ensemble in worst_case_batch_seconds
+
+MAX_PENDING_STAGE_SECONDS = 10000 # stage latencies kept until drain_stage_seconds() collects them; older ones are dropped
+
 with open("tokens.json") as f:
     tokens = json.load(f)
     openai.organization = tokens["openai_organization"]
     openai.api_key = tokens["openai_api_key"]
-
-bert_model = BertForSequenceClassification.from_pretrained('bert-base-uncased', num_labels=2)
-bert_model.load_state_dict(torch.load(BERT_CHECKPOINT_FILE, map_location=torch.device('cpu')))
-bert_model.eval()
-ensemble_model = load(ENSEMBLE_MODEL_FILE)
-
-wordnet_lemmatizer = WordNetLemmatizer()
-porter_stemmer  = PorterStemmer()
-
-p.set_options(p.OPT.URL, p.OPT.EMOJI)
-
-def text_preprocess(text, lemmatizer, stemmer):
-    # text = text.strip('\xa0')
-    text = p.clean(text)
-    tokenization = nltk.word_tokenize(text)     
-    tokenization = [w for w in tokenization if not w in stop_words]
-    #   text = ' '.join([porter_stemmer.stem(w) for w in tokenization])
-    #   text = ' '.join([lemmatizer.lemmatize(w) for w in tokenization])
-    # text = re.sub(r'\([0-9]+\)', '', text).strip()    
-    return text
-
-tokenizer = BertTokenizer.from_pretrained('bert-base-uncased', do_lower_case=True)
-
-def Encode_TextWithAttention(sentence,tokenizer,maxlen,padding_type='max_length',attention_mask_flag=True):
-    encoded_dict = tokenizer.encode_plus(sentence, add_special_tokens=True, max_length=maxlen, truncation=True, padding=padding_type, return_attention_mask=attention_mask_flag)
-    return encoded_dict['input_ids'],encoded_dict['attention_mask']
-
-def Encode_TextWithoutAttention(sentence,tokenizer,maxlen,padding_type='max_length',attention_mask_flag=False):
-    encoded_dict = tokenizer.encode_plus(sentence, add_special_tokens=True, max_length=maxlen, truncation=True, padding=padding_type, return_attention_mask=attention_mask_flag)
-    return encoded_dict['input_ids']
-
-def get_TokenizedTextWithAttentionMask(sentenceList, tokenizer):
-    token_ids_list,attention_mask_list = [],[]
-    for sentence in sentenceList:
-        token_ids,attention_mask = Encode_TextWithAttention(sentence,tokenizer,MAX_LEN)
-        token_ids_list.append(token_ids)
-        attention_mask_list.append(attention_mask)
-    return token_ids_list,attention_mask_list
-
-def get_TokenizedText(sentenceList, tokenizer):
-    token_ids_list = []
-    for sentence in sentenceList:
-        token_ids = Encode_TextWithoutAttention(sentence,tokenizer,MAX_LEN)
-        token_ids_list.append(token_ids)
-    return token_ids_list
-
-def bert_preprocess(text_inputs: List, tokenizer = tokenizer, wordnet_lemmatizer = wordnet_lemmatizer, porter_stemmer = porter_stemmer):
-  preprocessed_texts = []
-  for text in text_inputs:
-    preprocessed_texts.append(text_preprocess(text, wordnet_lemmatizer, porter_stemmer))
-  
-  token_ids, attention_masks = torch.tensor(get_TokenizedTextWithAttentionMask(preprocessed_texts, tokenizer))
-
-  return token_ids, attention_masks
-
-def generate_bert_predictions(text_inputs: List, bert_model = bert_model):
-  # might need to shape into batches
-  token_ids, attention_masks = bert_preprocess(text_inputs)
-
-  output = bert_model(token_ids, token_type_ids=None, attention_mask=attention_masks)
-  logits = output[0]
-  
-  logits = logits.detach().cpu().numpy()
-  pred = np.argmax(logits, axis=1).flatten()
-
-  # check the dimensions to make sure we're doing the right thing
-  print(logits)
-  score = torch.sigmoid(torch.tensor(logits)).numpy()[:,1]
-  print(score)
-  return pred, score
-
-train_df = pd.read_csv(TRAIN_FILE)
-gpt_messages = [{"role": "system", "content": "You are a content moderation system. Classify input as either 'real' or 'fake'. Do not use more than one word."}]
-for index, row in train_df.head(MAX_TRAIN_ROWS).iterrows():
-  gpt_messages.append({"role": "user", "content": f"{row['text']}"})
-  gpt_messages.append({"role": "assistant", "content": f"{row['label']}"})
+    # optional, e.g. to point the classifier at a local fake chat-completions server when testing
+    if "openai_api_base" in tokens:
+        openai.api_base = tokens["openai_api_base"]
+
+# these are set by initialize()
+torch = None
+bert_model = None
+tokenizer = None
+bert_scoring_engine = None
+ensemble_model = None
+ensemble_combiner = None
+first_stage_classifier = None
+early_exit_policy = None
+gpt_messages = None
+translator = None
+
+initialization_lock = threading.Lock()
+stage_timings = None # stage name -> seconds, once initialize() has finished
+
+# (stage name, seconds) for every pipeline stage run since the last drain_stage_seconds(), for the bot's latency histograms
+pending_stage_seconds = deque(maxlen = MAX_PENDING_STAGE_SECONDS)
+
+def record_stage_seconds(stage_name, start_time):
+  pending_stage_seconds.append((stage_name, time.perf_counter() - start_time))
+
+def drain_stage_seconds():
+  drained = []
+  while pending_stage_seconds:
+    drained.append(pending_stage_seconds.popleft())
+  return drained
+
+def load_libraries():
+  global torch
+  import torch
+
+def load_tokenizer():
+  global tokenizer
+  # the rust-backed fast tokenizer produces the same token ids as BertTokenizer
+  from transformers import BertTokenizerFast
+  tokenizer = BertTokenizerFast.from_pretrained('bert-base-uncased', do_lower_case=True)
+
+def load_bert_model():
+  global bert_model
+  # an already exported ONNX graph is all the onnx backend needs, so the torch checkpoint isn't loaded at all
+  if BERT_BACKEND == "onnx" and pathlib.Path(BERT_ONNX_FILE).is_file():
+    return
+  from transformers import BertForSequenceClassification
+  bert_model = BertForSequenceClassification.from_pretrained('bert-base-uncased', num_labels=2)
+  bert_model.load_state_dict(torch.load(BERT_CHECKPOINT_FILE, map_location=torch.device('cpu')))
+  bert_model.eval()
+
+def load_bert_scoring_engine():
+  global bert_model, bert_scoring_engine
+  from bert_backends import create_bert_backend
+  from bert_engine import BertScoringEngine
+  backend = create_bert_backend(BERT_BACKEND, bert_model, onnx_file = BERT_ONNX_FILE)
+  # the backend holds whatever it needs (for the quantized and onnx backends, not the fp32 model), so the fp32 model is released
+  bert_model = None
+  bert_scoring_engine = BertScoringEngine(backend, tokenizer, preprocess_fn = preprocess_for_bert, batch_size = BERT_BATCH_SIZE, max_len = MAX_LEN)
+
+def load_ensemble_model():
+  global ensemble_model, ensemble_combiner
+  from joblib import load
+  ensemble_model = load(ENSEMBLE_MODEL_FILE)
+  ensemble_combiner = EnsembleCombiner(ensemble_model, NO_GPT_PRED_NUM_LABEL)
+
+def load_first_stage_classifier():
+  global first_stage_classifier
+  from cascade import FirstStageClassifier, load_first_stage_model
+  first_stage_classifier = FirstStageClassifier(load_first_stage_model(), CASCADE_ESCALATION_THRESHOLD)
+
+def load_translator():
+  global translator
+  from translation import GoogleTranslatorClient, Translator
+  translator = Translator(GoogleTranslatorClient(source='auto', target='en'), TRANSLATION_CACHE_MAX_ENTRIES)
+
+def load_early_exit_policy():
+  global early_exit_policy
+  from early_exit import EarlyExitPolicy
+  early_exit_policy = EarlyExitPolicy(GPT_EARLY_EXIT_UNCERTAIN_LOW, GPT_EARLY_EXIT_UNCERTAIN_HIGH)
+
+def load_gpt_messages():
+  global gpt_messages
+  gpt_messages = [{"role": "system", "content": "You are a content moderation system. Classify input as either 'real' or 'fake'. Do not use more than one word."}]
+  # only the few-shot rows are read, rather than the whole training file
+  with open(TRAIN_FILE, newline='') as f:
+    for row in islice(csv.DictReader(f), MAX_TRAIN_ROWS):
+      gpt_messages.append({"role": "user", "content": f"{row['text']}"})
+      gpt_messages.append({"role": "assistant", "content": f"{row['label']}"})
+
+def warm_up_bert_model():
+  # the first forward pass is much slower than the rest, so it is run before any real message is scored
+  generate_bert_predictions(["Warming up the classifier."])
+
+INITIALIZATION_STAGES = [
+  ("libraries", load_libraries),
+  ("tokenizer", load_tokenizer),
+  ("BERT model", load_bert_model),
+  ("BERT scoring engine", load_bert_scoring_engine),
+  ("ensemble model", load_ensemble_model),
+  ("first-stage classifier", load_first_stage_classifier),
+  ("Chat-GPT few-shot messages", load_gpt_messages),
+  ("Chat-GPT early exit policy", load_early_exit_policy),
+  ("translator", load_translator),
+  ("BERT warmup", warm_up_bert_model),
+]
+
+def initialize():
+  # loads every model in stages and returns how long each stage took; later calls return immediately
+  global stage_timings
+  with initialization_lock:
+    if stage_timings is not None:
+      return stage_timings
+
+    timings = {}
+    for stage_name, load_stage in INITIALIZATION_STAGES:
+      start_time = time.perf_counter()
+      load_stage()
+      timings[stage_name] = time.perf_counter() - start_time
+      print(f"Initialized {stage_name} in {timings[stage_name]:.2f}s")
+
+    stage_timings = timings
+    return stage_timings
+
+def text_preprocess(text, lemmatizer = None, stemmer = None):
+    # same output as tweet-preprocessor's clean() with the URL and EMOJI options, which the BERT model was fine-tuned on;
+    # the lemmatizer and stemmer were never applied, and the NLTK tokenization was never used
+    return normalize_text(text)
+
+def preprocess_for_bert(text):
+  return normalize_text(text)
+
+def generate_bert_predictions(text_inputs: List, scoring_engine = None):
+  # length-bucketed mini-batches under torch.inference_mode(), returned in input order
+  scoring_engine = scoring_engine or bert_scoring_engine
+  return scoring_engine.score(text_inputs)
 
 def clean_pred(pred):
   if pred == None:
@@ -158,52 +224,139 @@ def assign_label(pred):
   else:  # prediciton was None (gpt response was not correctly produced)
     return NO_GPT_PRED_NUM_LABEL
   
-def generate_gpt_predictions(text_inputs, prefix_messages = gpt_messages):
-  preds = []
-  for input in text_inputs:
-    messages = prefix_messages[:]
-    messages.append({"role": "user", "content": f"{row['text']}"})  
-
-    try:
-      response = openai.ChatCompletion.create(
-      model="gpt-3.5-turbo",
-      messages=messages
-      )
-      
-      preds.append(response['choices'][0]['message']['content'])
-
-    except:
-      preds.append(None)
+async def request_gpt_pred(text, prefix_messages, semaphore, timeout = GPT_REQUEST_TIMEOUT_SECONDS, max_retries = GPT_MAX_RETRIES):
+  messages = prefix_messages[:]
+  messages.append({"role": "user", "content": f"{text}"})
+
+  async with semaphore:
+    for attempt in range(max_retries + 1):
+      try:
+        response = await asyncio.wait_for(openai.ChatCompletion.acreate(
+          model=GPT_MODEL,
+          messages=messages,
+          request_timeout=timeout
+          ), timeout)
+        return response['choices'][0]['message']['content']
+
+      except (openai.error.RateLimitError, openai.error.ServiceUnavailableError, openai.error.APIError) as e:
+        # rate limits and server errors (5xx) are retried; any other API error would only fail again
+        retryable = not isinstance(e, openai.error.APIError) or (e.http_status or 0) >= 500
+        if attempt == max_retries or not retryable:
+          print(e)
+          return None
+        # full jitter so that requests throttled together don't all retry together
+        await asyncio.sleep(random.uniform(0, GPT_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+
+      except Exception as e:  # includes timeouts; the prediction is marked as missing
+        print(e)
+        return None
+
+async def generate_gpt_predictions_async(text_inputs, prefix_messages = None, max_concurrency = GPT_MAX_CONCURRENT_REQUESTS, timeout = GPT_REQUEST_TIMEOUT_SECONDS, max_retries = GPT_MAX_RETRIES):
+  prefix_messages = prefix_messages or gpt_messages
+
+  # all requests are issued concurrently (up to max_concurrency at a time); gather keeps them in input order
+  semaphore = asyncio.Semaphore(max_concurrency)
+  preds = await asyncio.gather(*[request_gpt_pred(text, prefix_messages, semaphore, timeout, max_retries) for text in text_inputs])
 
   num_preds = [assign_label(clean_pred(pred)) for pred in preds]
   return num_preds
 
+def worst_case_batch_seconds(num_texts):
+  # the longest a pipeline pass over num_texts can take: every Chat-GPT attempt is throttled until the last one times out,
+  # with each retry waiting out its full backoff, and the requests run in waves of GPT_MAX_CONCURRENT_REQUESTS
+  request_seconds = GPT_REQUEST_TIMEOUT_SECONDS * (GPT_MAX_RETRIES + 1) + sum(GPT_RETRY_BASE_DELAY_SECONDS * 2 ** attempt for attempt in range(GPT_MAX_RETRIES))
+  return math.ceil(num_texts / GPT_MAX_CONCURRENT_REQUESTS) * request_seconds + NON_GPT_STAGES_BUDGET_SECONDS
+
+def generate_gpt_predictions(text_inputs, prefix_messages = None):
+  # blocking wrapper for the pipeline, which runs in an inference worker rather than on the bot's event loop
+  if not len(text_inputs):
+    return []
+  return asyncio.run(generate_gpt_predictions_async(text_inputs, prefix_messages))
+
 def translate_msgs(text_inputs):
-  translated_inputs = []
-  for text in text_inputs:
-    try:
-      translated_text = GoogleTranslator(source='auto', target='en').translate(text)
-      translated_text = translated_text if translated_text else ""
-      translated_inputs.append(text)
-    except Exception as e:
-      print(e)
-      translated_inputs.append(text)
-  return translated_inputs
-
-def generate_ensemble_preds_and_scores(text_inputs, ensemble_model = ensemble_model):
+  # English (ASCII-only) messages skip translation; the rest are translated concurrently, one request each, and cached
+  return translator.translate(text_inputs)
+
+verdict_cache = VerdictCache(max_entries = VERDICT_CACHE_MAX_ENTRIES, ttl_seconds = VERDICT_CACHE_TTL_SECONDS, db_file = VERDICT_CACHE_DB_FILE)
+
+def generate_ensemble_verdicts(text_inputs, ensemble_model = None):
+  combiner = ensemble_combiner if ensemble_model is None else EnsembleCombiner(ensemble_model, NO_GPT_PRED_NUM_LABEL)
+
+  start_time = time.perf_counter()
   text_inputs = translate_msgs(text_inputs)
-  bert_preds, bert_scores = generate_bert_predictions(text_inputs)
-  gpt_preds = generate_gpt_predictions(text_inputs)
-
-  ensemble_preds = []
-  ensemble_scores = []
-  for idx in range(len(gpt_preds)):
-    if gpt_preds[idx] == NO_GPT_PRED_NUM_LABEL:
-      ensemble_preds.append(bert_preds[idx])
-      ensemble_scores.append(bert_scores[idx])
-    else:
-      ensemble_input = np.array([gpt_preds[idx], bert_preds[idx]])
-      ensemble_preds.append(ensemble_model.predict(X_test))
-      ensemble_preds.append(ensemble_model.predict_proba(X_test)[:, 1])
+  record_stage_seconds("translation", start_time)
 
+  start_time = time.perf_counter()
+  bert_preds, bert_scores = generate_bert_predictions(text_inputs)
+  record_stage_seconds("bert", start_time)
+
+  # when BERT is decisive the Chat-GPT request is never made (a failed request still falls back to BERT's score)
+  gpt_preds = [NO_GPT_PRED_NUM_LABEL] * len(text_inputs)
+  needs_gpt = early_exit_policy.needs_gpt(bert_scores) if GPT_EARLY_EXIT_ENABLED else [True] * len(text_inputs)
+  gpt_idxs = [idx for idx in range(len(text_inputs)) if needs_gpt[idx]]
+  if len(gpt_idxs):
+    start_time = time.perf_counter()
+    for idx, gpt_pred in zip(gpt_idxs, generate_gpt_predictions([text_inputs[idx] for idx in gpt_idxs])):
+      gpt_preds[idx] = gpt_pred
+    record_stage_seconds("gpt", start_time)
+
+  start_time = time.perf_counter()
+  ensemble_preds, ensemble_scores = combiner.combine(gpt_preds, bert_preds, bert_scores)
+  # messages that skipped Chat-GPT get the ensemble's expected score rather than BERT's much more confident raw score
+  early_exit_idxs = [idx for idx in range(len(text_inputs)) if not needs_gpt[idx]]
+  if len(early_exit_idxs):
+    ensemble_preds[early_exit_idxs], ensemble_scores[early_exit_idxs] = combiner.expected_preds_and_scores(
+      early_exit_policy.gpt_label_probs([bert_scores[idx] for idx in early_exit_idxs]), [bert_preds[idx] for idx in early_exit_idxs])
+  record_stage_seconds("ensemble", start_time)
+
+  verdicts = []
+  for idx in range(len(text_inputs)):
+    verdicts.append(Verdict(bert_pred = int(bert_preds[idx]), bert_score = float(bert_scores[idx]), gpt_pred = float(gpt_preds[idx]),
+                            ensemble_pred = int(ensemble_preds[idx]), ensemble_score = float(ensemble_scores[idx])))
+
+  return verdicts
+
+def generate_cascade_verdicts(text_inputs, ensemble_model = None):
+  if not CASCADE_ENABLED:
+    return generate_ensemble_verdicts(text_inputs, ensemble_model)
+
+  # the first stage answers for messages it is confident are harmless; only the rest pay for the ensemble
+  start_time = time.perf_counter()
+  first_stage_scores, escalate = first_stage_classifier.split(text_inputs)
+  record_stage_seconds("first_stage", start_time)
+  escalated_idxs = [idx for idx in range(len(text_inputs)) if escalate[idx]]
+  escalated_verdicts = generate_ensemble_verdicts([text_inputs[idx] for idx in escalated_idxs], ensemble_model) if len(escalated_idxs) else []
+
+  verdicts = [Verdict(bert_pred = None, bert_score = None, gpt_pred = NO_GPT_PRED_NUM_LABEL,
+                      ensemble_pred = int(score >= 0.5), ensemble_score = float(score)) for score in first_stage_scores]
+  for idx, verdict in zip(escalated_idxs, escalated_verdicts):
+    verdicts[idx] = verdict
+
+  previous_total = first_stage_classifier.stats.total() - len(text_inputs)
+  if previous_total // CASCADE_STATS_PRINT_INTERVAL != first_stage_classifier.stats.total() // CASCADE_STATS_PRINT_INTERVAL:
+    print(f"Share of messages handled by each classifier stage: {first_stage_classifier.stats.fractions()}")
+  return verdicts
+
+def generate_ensemble_preds_and_scores(text_inputs, ensemble_model = None, cache = verdict_cache):
+  initialize()
+
+  verdicts = [cache.get(text) if cache else None for text in text_inputs]
+
+  # only classify each distinct uncached text once, even if it appears several times in the batch
+  hash_to_missing_idxs = {}
+  for idx, verdict in enumerate(verdicts):
+    if verdict is None:
+      hash_to_missing_idxs.setdefault(text_hash(text_inputs[idx]), []).append(idx)
+
+  if len(hash_to_missing_idxs):
+    missing_idxs = list(hash_to_missing_idxs.values())
+    new_verdicts = generate_cascade_verdicts([text_inputs[idxs[0]] for idxs in missing_idxs], ensemble_model)
+    for idxs, verdict in zip(missing_idxs, new_verdicts):
+      for idx in idxs:
+        verdicts[idx] = verdict
+      if cache:
+        cache.put(text_inputs[idxs[0]], verdict)
+
+  ensemble_preds = [verdict.ensemble_pred for verdict in verdicts]
+  ensemble_scores = [verdict.ensemble_score for verdict in verdicts]
   return ensemble_preds, ensemble_scores
@@ -0,0 +1,147 @@
+# file for re-scoring a whole CSV corpus with the pipeline in automated.py, as a resumable multi-process batch job
+# e.g. python batch_score.py ../Data_And_Models/full_test.csv --output-dir scores/ --workers 4
+# writes bert_preds.csv, bert_scores.csv, gpt_preds.csv, ensemble_preds.csv and ensemble_scores.csv in the same one-column
+# format as the notebooks in Classifier/; if the job is interrupted, running the same command again picks up where it stopped
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import csv
+import json
+import multiprocessing
+import numpy as np
+import os
+import shutil
+
+from inference_executor import default_torch_num_threads, init_inference_worker
+
+DEFAULT_CHUNK_SIZE = 256
+DEFAULT_NUM_WORKERS = 2
+TEXT_COLUMNS = ["text", "tweet"] # checked in this order when --text-column isn't given (full_*.csv use "text", Constraint_*.csv use "tweet")
+
+# one output file per column of the per-chunk result arrays
+OUTPUT_FILES = ["bert_preds.csv", "bert_scores.csv", "gpt_preds.csv", "ensemble_preds.csv", "ensemble_scores.csv"]
+
+CHUNKS_DIR_NAME = ".chunks"
+PROGRESS_FILE_NAME = "progress.json"
+
+
+def init_batch_worker(torch_num_threads, cascade_enabled, early_exit_enabled):
+    import automated
+    automated.CASCADE_ENABLED = cascade_enabled
+    automated.GPT_EARLY_EXIT_ENABLED = early_exit_enabled
+    init_inference_worker(torch_num_threads)
+
+
+def score_chunk(chunk_idx, texts, chunk_file):
+    import automated
+    # the verdict cache is skipped: a batch job should reflect the current models, not earlier verdicts
+    verdicts = automated.generate_cascade_verdicts(texts)
+    results = np.array([[np.nan if value is None else value for value in verdict.as_row()] for verdict in verdicts], dtype=float).reshape(-1, len(OUTPUT_FILES))
+
+    # write then rename, so a chunk file only exists once it's complete
+    tmp_file = chunk_file + ".tmp.npy"
+    np.save(tmp_file, results)
+    os.replace(tmp_file, chunk_file)
+    return chunk_idx
+
+
+def read_chunks(input_file, text_column, chunk_size):
+    # streams the CSV, so memory use doesn't depend on the size of the corpus
+    with open(input_file, newline='') as f:
+        reader = csv.DictReader(f)
+        if text_column is None:
+            text_column = next((column for column in TEXT_COLUMNS if column in reader.fieldnames), None)
+        if text_column not in reader.fieldnames:
+            raise Exception(f"{input_file} has no text column, pass one of {reader.fieldnames} with --text-column.")
+
+        chunk = []
+        for row in reader:
+            chunk.append(row[text_column])
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+
+def chunk_file_path(chunks_dir, chunk_idx):
+    return os.path.join(chunks_dir, f"chunk_{chunk_idx:06d}.npy")
+
+
+def load_progress(output_dir, config):
+    progress_file = os.path.join(output_dir, PROGRESS_FILE_NAME)
+    if os.path.isfile(progress_file):
+        with open(progress_file) as f:
+            previous_config = json.load(f)
+        if previous_config != config:
+            raise Exception(f"{output_dir} holds an unfinished job with different settings ({previous_config}); use another --output-dir or delete it.")
+    else:
+        with open(progress_file, "w") as f:
+            json.dump(config, f)
+
+
+def write_outputs(output_dir, chunks_dir, num_chunks):
+    output_files = [open(os.path.join(output_dir, output_file), "w") for output_file in OUTPUT_FILES]
+    try:
+        for chunk_idx in range(num_chunks):
+            results = np.load(chunk_file_path(chunks_dir, chunk_idx))
+            for column, output_file in enumerate(output_files):
+                np.savetxt(output_file, results[:, column], delimiter=",")
+    finally:
+        for output_file in output_files:
+            output_file.close()
+
+
+def run_batch_job(input_file, output_dir, text_column = None, chunk_size = DEFAULT_CHUNK_SIZE, num_workers = DEFAULT_NUM_WORKERS,
+                  torch_num_threads = None, cascade_enabled = False, early_exit_enabled = False):
+    chunks_dir = os.path.join(output_dir, CHUNKS_DIR_NAME)
+    os.makedirs(chunks_dir, exist_ok = True)
+    load_progress(output_dir, {"input_file": os.path.abspath(input_file), "text_column": text_column, "chunk_size": chunk_size,
+                               "cascade_enabled": cascade_enabled, "early_exit_enabled": early_exit_enabled})
+
+    torch_num_threads = torch_num_threads if torch_num_threads else default_torch_num_threads(num_workers)
+    executor = ProcessPoolExecutor(max_workers = num_workers, mp_context = multiprocessing.get_context("spawn"),
+                                   initializer = init_batch_worker, initargs = (torch_num_threads, cascade_enabled, early_exit_enabled))
+
+    num_chunks = 0
+    num_skipped = 0
+    pending = set()
+    with executor:
+        for chunk_idx, texts in enumerate(read_chunks(input_file, text_column, chunk_size)):
+            num_chunks += 1
+            chunk_file = chunk_file_path(chunks_dir, chunk_idx)
+            if os.path.isfile(chunk_file):
+                num_skipped += 1
+                continue
+
+            # keep only a couple of chunks queued per worker so the corpus is never all in memory
+            if len(pending) >= 2 * num_workers:
+                done, pending = wait(pending, return_when = FIRST_COMPLETED)
+                for future in done:
+                    print(f"Scored chunk {future.result()}")
+            pending.add(executor.submit(score_chunk, chunk_idx, texts, chunk_file))
+
+        for future in wait(pending).done:
+            print(f"Scored chunk {future.result()}")
+
+    if num_skipped:
+        print(f"Resumed: {num_skipped} of {num_chunks} chunks had already been scored")
+
+    write_outputs(output_dir, chunks_dir, num_chunks)
+    shutil.rmtree(chunks_dir)
+    os.remove(os.path.join(output_dir, PROGRESS_FILE_NAME))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Score every row of a CSV file with the moderation pipeline, resumably and across worker processes.")
+    parser.add_argument("input_file")
+    parser.add_argument("--output-dir", default = ".")
+    parser.add_argument("--text-column", default = None, help = f"defaults to the first of {TEXT_COLUMNS} in the file")
+    parser.add_argument("--chunk-size", type = int, default = DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--workers", type = int, default = DEFAULT_NUM_WORKERS)
+    parser.add_argument("--torch-threads", type = int, default = None, help = "torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--cascade", action = "store_true", help = "let the first-stage classifier answer for clearly harmless rows")
+    parser.add_argument("--early-exit", action = "store_true", help = "skip Chat-GPT for rows where BERT is decisive")
+    args = parser.parse_args()
+
+    run_batch_job(args.input_file, args.output_dir, args.text_column, args.chunk_size, args.workers,
+                  args.torch_threads, args.cascade, args.early_exit)
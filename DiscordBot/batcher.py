@@ -0,0 +1,93 @@
+# file for batching classifier requests coming from the bot into a single pass through the pipeline in automated.py
+import asyncio
+import logging
+
+logger = logging.getLogger('discord')
+
+DEFAULT_MAX_BATCH_SIZE = 16 # maximum number of messages scored in a single pipeline pass
+DEFAULT_MAX_WAIT_SECONDS = 0.05 # how long the first message of a batch waits for others to join it
+DEFAULT_MAX_CONCURRENT_BATCHES = 1 # how many batches may be scored at once (e.g. one per inference worker)
+
+
+class InferenceBatcher:
+    '''
+    Collects the texts that concurrent coroutines ask to be scored and sends them through score_fn together.
+    score_fn takes a list of texts and returns a (preds, scores) pair of sequences aligned with that list;
+    it may either be a regular function or a coroutine function.
+    '''
+
+    def __init__(self, score_fn, max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS,
+                 max_concurrent_batches: int = DEFAULT_MAX_CONCURRENT_BATCHES):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.max_concurrent_batches = max_concurrent_batches
+        self.queue = None # created lazily so that it binds to the running event loop
+        self.batch_slots = None
+        self.worker_task = None
+        self.batch_tasks = set() # batches currently being scored
+        self.num_pending = 0 # texts waiting to join a batch or being scored
+
+    def start(self):
+        if self.worker_task is None or self.worker_task.done():
+            self.queue = asyncio.Queue()
+            self.batch_slots = asyncio.Semaphore(self.max_concurrent_batches)
+            self.worker_task = asyncio.get_running_loop().create_task(self.run())
+
+    async def score(self, text):
+        # returns the (pred, score) pair for a single text once the batch it was placed in has been scored
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.num_pending += 1
+        try:
+            await self.queue.put((text, future))
+            return await future
+        finally:
+            self.num_pending -= 1
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # block until there is at least one text to score, then keep collecting until the window closes or the batch is full
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # wait for a free slot, then score the batch in the background while the next one is collected
+            await self.batch_slots.acquire()
+            batch_task = loop.create_task(self.score_batch(batch))
+            self.batch_tasks.add(batch_task)
+            batch_task.add_done_callback(self.finish_batch)
+
+    def finish_batch(self, batch_task):
+        self.batch_tasks.discard(batch_task)
+        self.batch_slots.release()
+
+    async def score_batch(self, batch):
+        texts = [text for text, _ in batch]
+        logger.debug(f"Scoring a batch of {len(texts)} messages")
+        try:
+            result = self.score_fn(texts)
+            if asyncio.iscoroutine(result):
+                result = await result
+            preds, scores = result
+            # a short result can't be matched up with the texts, and would leave the callers past its end waiting forever
+            if len(preds) != len(texts) or len(scores) != len(texts):
+                raise Exception(f"score_fn returned {len(preds)} preds and {len(scores)} scores for {len(texts)} texts")
+        except Exception as e:
+            # every caller waiting on this batch sees the failure rather than hanging forever
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), pred, score in zip(batch, preds, scores):
+            if not future.done():
+                future.set_result((pred, score))
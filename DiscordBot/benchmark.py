@@ -0,0 +1,237 @@
+# file for benchmarking each stage of the moderation pipeline in automated.py, and the whole pipeline at several batch sizes
+# e.g. python benchmark.py --output benchmarks/$(git rev-parse --short HEAD).json
+# python benchmark.py --report-memory instead measures the memory kept per filed report (see report_memory_benchmark)
+# Chat-GPT requests go to a local fake chat-completions server and translation to a local stub, each with injected latency,
+# so the results only depend on this machine and can be compared between versions
+import argparse
+import csv
+import json
+import numpy as np
+import os
+import platform
+import random
+import resource
+import time
+import tracemalloc
+from fake_chat_completions import FakeChatCompletionsServer
+
+TEST_FILE = "../Data_And_Models/full_test.csv"
+
+DEFAULT_NUM_MESSAGES = 256 # messages sampled from TEST_FILE
+DEFAULT_BATCH_SIZES = [1, 8, 32, 128]
+DEFAULT_REPEATS = 5 # passes over the sampled messages per stage and batch size
+DEFAULT_GPT_LATENCY_MS = 300.0
+DEFAULT_TRANSLATION_LATENCY_MS = 100.0
+DEFAULT_SEED = 152
+DEFAULT_NUM_REPORTS = 100000
+DEFAULT_REPORT_CONTENT_LENGTH = 500 # characters in each reported message
+
+
+class StubTranslatorClient:
+    # returns its input unchanged after the injected latency, once per text, since Google Translate takes one text per request
+    def __init__(self, latency_seconds: float):
+        self.latency_seconds = latency_seconds
+
+    def translate(self, text):
+        time.sleep(self.latency_seconds)
+        return text
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sample_messages(num_messages, seed):
+    with open(TEST_FILE, newline='') as f:
+        texts = [row['text'] for row in csv.DictReader(f)]
+    return random.Random(seed).sample(texts, min(num_messages, len(texts)))
+
+
+def time_stage(stage_fn, messages, batch_size, repeats):
+    # calls stage_fn on consecutive batches of the messages and summarizes the per-call latency
+    batches = [messages[start:start + batch_size] for start in range(0, len(messages), batch_size)]
+    latencies = []
+    num_messages = 0
+    total_seconds = 0.0
+    for _ in range(repeats):
+        for batch in batches:
+            start_time = time.perf_counter()
+            stage_fn(batch)
+            elapsed = time.perf_counter() - start_time
+            latencies.append(elapsed)
+            total_seconds += elapsed
+            num_messages += len(batch)
+
+    latencies_ms = 1000 * np.array(latencies)
+    return {
+        "batch_size": batch_size,
+        "calls": len(latencies),
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "messages_per_second": num_messages / total_seconds if total_seconds else None,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def run_benchmarks(num_messages = DEFAULT_NUM_MESSAGES, batch_sizes = DEFAULT_BATCH_SIZES, repeats = DEFAULT_REPEATS,
+                   gpt_latency_ms = DEFAULT_GPT_LATENCY_MS, translation_latency_ms = DEFAULT_TRANSLATION_LATENCY_MS, seed = DEFAULT_SEED):
+    import automated
+    from text_normalizer import normalize_texts
+    import openai
+    import torch
+    from translation import Translator
+
+    messages = sample_messages(num_messages, seed)
+
+    with FakeChatCompletionsServer(gpt_latency_ms / 1000) as gpt_server:
+        openai.api_base = gpt_server.api_base
+
+        start_time = time.perf_counter()
+        automated.initialize()
+        initialize_seconds = time.perf_counter() - start_time
+
+        # a fresh, empty translation cache for every call, so repeats measure the translator rather than its cache
+        stub_translator_client = StubTranslatorClient(translation_latency_ms / 1000)
+        def reset_translator():
+            automated.translator = Translator(stub_translator_client, automated.TRANSLATION_CACHE_MAX_ENTRIES)
+
+        def translate(batch):
+            reset_translator()
+            automated.translate_msgs(batch)
+
+        def end_to_end(batch):
+            reset_translator()
+            # the verdict cache is bypassed so every repeat pays for the full pipeline
+            automated.generate_ensemble_preds_and_scores(batch, cache = None)
+
+        preprocessed_messages = normalize_texts(messages)
+        bert_preds, bert_scores = automated.generate_bert_predictions(messages)
+        rng = random.Random(seed)
+        gpt_preds = [rng.choice([0, 0.5, 1, automated.NO_GPT_PRED_NUM_LABEL]) for _ in messages]
+        message_to_idx = {message: idx for idx, message in enumerate(messages)}
+
+        stages = {
+            "translate_msgs": (messages, translate),
+            "text_preprocess": (messages, normalize_texts),
+            "tokenization": (preprocessed_messages, automated.bert_scoring_engine.tokenize),
+            "bert_forward": (messages, automated.generate_bert_predictions),
+            "gpt": (messages, automated.generate_gpt_predictions),
+            "ensemble_combine": (messages, lambda batch: automated.ensemble_combiner.combine(
+                [gpt_preds[message_to_idx[message]] for message in batch],
+                [bert_preds[message_to_idx[message]] for message in batch],
+                [bert_scores[message_to_idx[message]] for message in batch])),
+            "end_to_end": (messages, end_to_end),
+        }
+
+        results = {}
+        for stage_name, (stage_messages, stage_fn) in stages.items():
+            results[stage_name] = [time_stage(stage_fn, stage_messages, batch_size, repeats) for batch_size in batch_sizes]
+            for result in results[stage_name]:
+                print(f"{stage_name} (batch size {result['batch_size']}): p50 {result['p50_ms']:.2f} ms, p95 {result['p95_ms']:.2f} ms, " \
+                      f"p99 {result['p99_ms']:.2f} ms, {result['messages_per_second']:.1f} messages/s")
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "torch_num_threads": torch.get_num_threads(),
+            "bert_backend": automated.BERT_BACKEND,
+        },
+        "settings": {
+            "num_messages": len(messages),
+            "batch_sizes": list(batch_sizes),
+            "repeats": repeats,
+            "gpt_latency_ms": gpt_latency_ms,
+            "translation_latency_ms": translation_latency_ms,
+            "seed": seed,
+            "cascade_enabled": automated.CASCADE_ENABLED,
+            "gpt_early_exit_enabled": automated.GPT_EARLY_EXIT_ENABLED,
+        },
+        "initialize_seconds": initialize_seconds,
+        "stage_timings": automated.stage_timings,
+        "stages": results,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def discord_message_factory(content_length):
+    # returns a function building real discord Messages (posted by guild Members, as in the bot's channels) without a connection
+    import discord
+    from discord.http import HTTPClient
+    from discord.state import ConnectionState
+
+    state = ConnectionState(dispatch = lambda *args, **kwargs: None, handlers = {}, hooks = {}, http = HTTPClient(None), intents = discord.Intents.default())
+    guild = discord.Guild(data = {"id": "1000", "name": "guild", "channels": [], "roles": [], "members": [], "emojis": [], "stickers": [], "features": []}, state = state)
+    channel = discord.TextChannel(state = state, guild = guild, data = {"id": "2000", "type": 0, "name": "group-33", "position": 0, "guild_id": "1000", "permission_overwrites": []})
+
+    def discord_message(idx):
+        return discord.Message(state = state, channel = channel, data = {
+            "id": str(4000 + idx), "channel_id": "2000", "type": 0, "content": (f"message {idx} " + "x" * content_length)[:content_length],
+            "tts": False, "mention_everyone": False, "timestamp": "2024-01-01T00:00:00+00:00", "edited_timestamp": None, "pinned": False,
+            "attachments": [], "embeds": [], "mentions": [], "mention_roles": [],
+            "author": {"id": str(3000 + idx), "username": f"user{idx}", "discriminator": "0", "avatar": None, "global_name": None},
+            "member": {"roles": [], "joined_at": "2024-01-01T00:00:00+00:00", "deaf": False, "mute": False, "flags": 0},
+        })
+    return discord_message
+
+
+def report_memory_benchmark(num_reports = DEFAULT_NUM_REPORTS, content_length = DEFAULT_REPORT_CONTENT_LENGTH):
+    # the memory kept per filed report as an AutomatedReport, which keeps its discord Message alive, and as the ReportRecord
+    # the ReportStore keeps instead, after which the message can be freed
+    from reactions import ModeratorAction
+    from report import AutomatedReport
+
+    discord_message = discord_message_factory(content_length)
+
+    def automated_report(idx):
+        report = AutomatedReport(None, discord_message(idx), disinfo_prob = 0.95, report_id = idx, very_high_disinfo_prob = False)
+        report.set_of_actions_taken.add(ModeratorAction.REMOVE_POST)
+        return report
+
+    def bytes_per_report(build_report):
+        tracemalloc.start()
+        start_bytes = tracemalloc.get_traced_memory()[0]
+        reports = [build_report(idx) for idx in range(num_reports)]
+        used_bytes = tracemalloc.get_traced_memory()[0] - start_bytes
+        tracemalloc.stop()
+        del reports
+        return used_bytes / num_reports
+
+    results = {
+        "num_reports": num_reports,
+        "content_length": content_length,
+        "report_with_message_bytes_per_report": bytes_per_report(automated_report),
+        "report_record_bytes_per_report": bytes_per_report(lambda idx: automated_report(idx).to_record()),
+    }
+    print(f"{results['report_with_message_bytes_per_report']:.0f} bytes per report with its message, " \
+          f"{results['report_record_bytes_per_report']:.0f} bytes per report record")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmark each stage of the moderation pipeline on messages sampled from full_test.csv.")
+    parser.add_argument("--num-messages", type = int, default = DEFAULT_NUM_MESSAGES)
+    parser.add_argument("--batch-sizes", nargs = "+", type = int, default = DEFAULT_BATCH_SIZES)
+    parser.add_argument("--repeats", type = int, default = DEFAULT_REPEATS)
+    parser.add_argument("--gpt-latency-ms", type = float, default = DEFAULT_GPT_LATENCY_MS)
+    parser.add_argument("--translation-latency-ms", type = float, default = DEFAULT_TRANSLATION_LATENCY_MS)
+    parser.add_argument("--seed", type = int, default = DEFAULT_SEED)
+    parser.add_argument("--output", default = "benchmark_results.json")
+    parser.add_argument("--report-memory", action = "store_true", help = "measure the memory kept per filed report instead of benchmarking the pipeline")
+    parser.add_argument("--num-reports", type = int, default = DEFAULT_NUM_REPORTS)
+    parser.add_argument("--report-content-length", type = int, default = DEFAULT_REPORT_CONTENT_LENGTH)
+    args = parser.parse_args()
+
+    if args.report_memory:
+        results = report_memory_benchmark(args.num_reports, args.report_content_length)
+    else:
+        results = run_benchmarks(args.num_messages, args.batch_sizes, args.repeats, args.gpt_latency_ms, args.translation_latency_ms, args.seed)
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok = True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent = 2)
+    print(f"Wrote results to {args.output}")
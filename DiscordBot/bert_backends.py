@@ -0,0 +1,151 @@
+# file for the interchangeable CPU backends that run the fine-tuned BERT classifier's forward pass
+# run this file to compare the backends' scores against the committed bert_scores.csv, along with their latency and memory use
+import argparse
+import json
+import multiprocessing
+import numpy as np
+import os
+import resource
+import time
+import torch
+
+BERT_BACKEND_TORCH = "torch" # the fp32 model as it was fine-tuned
+BERT_BACKEND_QUANTIZED = "quantized" # dynamic INT8 quantization of the linear layers
+BERT_BACKEND_ONNX = "onnx" # an exported graph run by ONNX Runtime
+BERT_BACKENDS = [BERT_BACKEND_TORCH, BERT_BACKEND_QUANTIZED, BERT_BACKEND_ONNX]
+
+DEFAULT_ONNX_FILE = "../Data_And_Models/BERT_base_uncased_best_model.onnx"
+ONNX_OPSET_VERSION = 14
+
+TEST_FILE = "../Data_And_Models/full_test.csv"
+BERT_PREDS_FILE = "../Data_And_Models/bert_preds.csv"
+BERT_SCORES_FILE = "../Data_And_Models/bert_scores.csv"
+
+
+class TorchBertBackend:
+    def __init__(self, bert_model):
+        self.bert_model = bert_model
+
+    def __call__(self, input_ids, attention_mask):
+        output = self.bert_model(input_ids, token_type_ids=None, attention_mask=attention_mask)
+        return output[0].cpu().numpy()
+
+
+class QuantizedBertBackend(TorchBertBackend):
+    def __init__(self, bert_model):
+        super().__init__(torch.quantization.quantize_dynamic(bert_model, {torch.nn.Linear}, dtype=torch.qint8))
+
+
+class BertLogits(torch.nn.Module):
+    # exporting a module that returns only the logits keeps the ONNX graph's outputs simple
+    def __init__(self, bert_model):
+        super().__init__()
+        self.bert_model = bert_model
+
+    def forward(self, input_ids, attention_mask):
+        return self.bert_model(input_ids, attention_mask=attention_mask)[0]
+
+
+class OnnxBertBackend:
+    def __init__(self, bert_model, onnx_file: str = DEFAULT_ONNX_FILE, num_threads: int = None):
+        try:
+            import onnxruntime
+        except ImportError:
+            raise Exception("The onnx BERT backend needs onnxruntime, install it with `pip install onnxruntime`.")
+
+        if not os.path.isfile(onnx_file):
+            export_onnx(bert_model, onnx_file)
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads if num_threads else torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(onnx_file, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        return self.session.run(None, {"input_ids": input_ids.numpy(), "attention_mask": attention_mask.numpy()})[0]
+
+
+def export_onnx(bert_model, onnx_file):
+    dummy_input_ids = torch.ones((1, 8), dtype=torch.long)
+    dummy_attention_mask = torch.ones((1, 8), dtype=torch.long)
+    # inference workers starting together may each export it; each writes its own file, and the rename is atomic
+    tmp_onnx_file = f"{onnx_file}.{os.getpid()}.tmp"
+    torch.onnx.export(BertLogits(bert_model).eval(), (dummy_input_ids, dummy_attention_mask), tmp_onnx_file,
+                      input_names=["input_ids", "attention_mask"], output_names=["logits"],
+                      dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"}, "logits": {0: "batch"}},
+                      opset_version=ONNX_OPSET_VERSION)
+    os.replace(tmp_onnx_file, onnx_file)
+
+
+def create_bert_backend(backend_name, bert_model, onnx_file = DEFAULT_ONNX_FILE):
+    if backend_name == BERT_BACKEND_TORCH:
+        return TorchBertBackend(bert_model)
+    elif backend_name == BERT_BACKEND_QUANTIZED:
+        return QuantizedBertBackend(bert_model)
+    elif backend_name == BERT_BACKEND_ONNX:
+        return OnnxBertBackend(bert_model, onnx_file)
+    raise Exception(f"Unknown BERT backend {backend_name}, expected one of {', '.join(BERT_BACKENDS)}.")
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def current_rss_mb():
+    # the peak includes the fp32 model the quantized backend is built from; this is what the worker keeps using
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+def check_backend_parity(backend_name, limit = None):
+    # runs in a fresh process per backend so that the peak RSS only reflects that backend
+    import csv
+    import automated
+
+    automated.BERT_BACKEND = backend_name
+    automated.initialize()
+    with open(TEST_FILE, newline='') as f:
+        rows = list(csv.DictReader(f))[:limit]
+    texts = [row['text'] for row in rows]
+    labels = np.array([0 if row['label'] == automated.ZERO_LABEL_KEYWORD else 1 for row in rows])
+    committed_preds = np.loadtxt(BERT_PREDS_FILE, delimiter=",")[:len(texts)]
+    committed_scores = np.loadtxt(BERT_SCORES_FILE, delimiter=",")[:len(texts)]
+
+    start_time = time.perf_counter()
+    preds, scores = automated.generate_bert_predictions(texts)
+    elapsed = time.perf_counter() - start_time
+
+    return {
+        "backend": backend_name,
+        "num_texts": len(texts),
+        "pred_agreement": float(np.mean(preds == committed_preds)),
+        "max_abs_score_diff": float(np.max(np.abs(scores - committed_scores))),
+        "mean_abs_score_diff": float(np.mean(np.abs(scores - committed_scores))),
+        "accuracy": float(np.mean(preds == labels)),
+        "committed_accuracy": float(np.mean(committed_preds == labels)),
+        "ms_per_text": 1000 * elapsed / len(texts),
+        "texts_per_second": len(texts) / elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "rss_mb": current_rss_mb(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Compare the BERT backends against the committed bert_scores.csv on full_test.csv.")
+    parser.add_argument("--backends", nargs = "+", default = BERT_BACKENDS, choices = BERT_BACKENDS)
+    parser.add_argument("--limit", type = int, default = None, help = "only score the first LIMIT test rows")
+    parser.add_argument("--output", default = None, help = "also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for backend_name in args.backends:
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            result = pool.apply(check_backend_parity, (backend_name, args.limit))
+        results.append(result)
+        print(f"{backend_name}: {result['pred_agreement']:.2%} pred agreement, max score diff {result['max_abs_score_diff']:.2e}, " \
+              f"accuracy {result['accuracy']:.4f} (committed {result['committed_accuracy']:.4f}), " \
+              f"{result['ms_per_text']:.2f} ms/text, RSS {result['rss_mb']:.0f} MB (peak {result['peak_rss_mb']:.0f} MB)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
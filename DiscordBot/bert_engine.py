@@ -0,0 +1,95 @@
+# file for scoring any number of texts with the fine-tuned BERT classifier in length-bucketed mini-batches
+# e.g. to rebuild the committed BERT predictions: python bert_engine.py ../Data_And_Models/full_test.csv
+import argparse
+import numpy as np
+import torch
+
+DEFAULT_BATCH_SIZE = 32 # texts per forward pass
+DEFAULT_WINDOW_SIZE = 1024 # texts sorted by length together; bounds memory when streaming a large corpus
+DEFAULT_MAX_LEN = 128
+
+
+class BertScoringEngine:
+    '''
+    Scores texts with a BERT backend from bert_backends.py. Each window of texts is tokenized straight into tensors
+    in one call and sorted by token length, so that every mini-batch is a slice only padded to its own longest text,
+    and results are put back in input order.
+    '''
+
+    def __init__(self, backend, tokenizer, preprocess_fn = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 window_size: int = DEFAULT_WINDOW_SIZE, max_len: int = DEFAULT_MAX_LEN):
+        self.backend = backend # called with input ids and an attention mask, returns a numpy array of logits
+        self.tokenizer = tokenizer
+        self.preprocess_fn = preprocess_fn
+        self.batch_size = batch_size
+        self.window_size = window_size
+        self.max_len = max_len
+
+    def tokenize(self, texts):
+        # returns the (input ids, attention mask) tensors of already preprocessed texts, padded on the right to the longest one
+        encoded = self.tokenizer(list(texts), add_special_tokens=True, max_length=self.max_len, truncation=True, padding='longest', return_attention_mask=True, return_tensors='pt')
+        return encoded['input_ids'], encoded['attention_mask']
+
+    def score_window(self, texts):
+        if self.preprocess_fn:
+            texts = [self.preprocess_fn(text) for text in texts]
+
+        input_ids, attention_mask = self.tokenize(texts)
+        lengths = attention_mask.sum(dim=1)
+        order = torch.sort(lengths, stable=True).indices
+
+        logits = np.zeros((len(texts), 2), dtype=np.float32)
+        with torch.inference_mode():
+            for start in range(0, len(order), self.batch_size):
+                batch_idxs = order[start:start + self.batch_size]
+                # padding is on the right, so trimming the columns past the batch's longest text only drops padding
+                batch_len = int(lengths[batch_idxs].max())
+                logits[batch_idxs.numpy()] = self.backend(input_ids[batch_idxs, :batch_len].contiguous(), attention_mask[batch_idxs, :batch_len].contiguous())
+
+        preds = np.argmax(logits, axis=1).flatten()
+        scores = torch.sigmoid(torch.from_numpy(logits)).numpy()[:,1]
+        return preds, scores
+
+    def score_stream(self, texts):
+        # yields (preds, scores) for each window of texts, in input order, so callers can write results as they go
+        window = []
+        for text in texts:
+            window.append(text)
+            if len(window) == self.window_size:
+                yield self.score_window(window)
+                window = []
+        if window:
+            yield self.score_window(window)
+
+    def score(self, texts):
+        preds, scores = [], []
+        for window_preds, window_scores in self.score_stream(texts):
+            preds.append(window_preds)
+            scores.append(window_scores)
+        if not preds:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        return np.concatenate(preds), np.concatenate(scores)
+
+
+if __name__ == "__main__":
+    import csv
+    import automated
+
+    parser = argparse.ArgumentParser(description = "Write BERT predictions and scores for the text column of a CSV file.")
+    parser.add_argument("input_file")
+    parser.add_argument("--preds-output", default = "bert_preds.csv")
+    parser.add_argument("--scores-output", default = "bert_scores.csv")
+    parser.add_argument("--batch-size", type = int, default = DEFAULT_BATCH_SIZE)
+    parser.add_argument("--backend", default = automated.BERT_BACKEND)
+    args = parser.parse_args()
+
+    automated.BERT_BACKEND = args.backend
+    automated.initialize()
+    automated.bert_scoring_engine.batch_size = args.batch_size
+    with open(args.input_file, newline='') as f:
+        texts = [row['text'] for row in csv.DictReader(f)]
+
+    preds, scores = automated.bert_scoring_engine.score(texts)
+    # same one-column format as the notebooks in Classifier/
+    np.savetxt(args.preds_output, preds.astype(float), delimiter=",")
+    np.savetxt(args.scores_output, scores, delimiter=",")
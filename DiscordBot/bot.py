@@ -7,21 +7,29 @@ import json
 import logging
 import re
 import requests
+import time
 from report import Report, AutomatedReport
+from report_record import StoredMessage, CONTENT_SNIPPET_MAX_CHARS
 from response import Response
+from batcher import InferenceBatcher
+from inference_executor import InferenceExecutor, INFERENCE_EXECUTOR_MODE_PROCESS
+from inference_client import InferenceClient
+from near_duplicates import MinHashLSHIndex
+from metrics import MetricsRegistry
+from report_store import ReportStore
+from moderator_queue import ModeratorQueue
+from outbound import OutboundDispatcher
+from timer_scheduler import TimerScheduler
+from session_wheel import TimerWheel
 import pdb
-from collections import defaultdict
-
-import automated
-from automated import *
+from collections import OrderedDict
 
 
 # Set up logging to the console
 logger = logging.getLogger('discord')
 logger.setLevel(logging.DEBUG)
-handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
-handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
-logger.addHandler(handler)
+
+BOT_START_TIME = time.perf_counter()
 
 # There should be a file called 'tokens.json' inside the same folder as this file
 token_path = 'tokens.json'
@@ -38,6 +46,31 @@ PERSONAL_GROUP_NUMBER_STR = "33"
 DEFAULT_MODIFY_POST_DISCLAIMER = "WARNING! This message may contain disinformation."
 DEFAULT_NOTFIY_USER_OF_TRANSGESSION = "Dear user, we regret to inform you that your message has been flagged for disinformation. We will investigate your post and take actions accordingly."
 MUTE_TIME_IN_SECONDS = 5
+INFERENCE_MAX_BATCH_SIZE = 16 # maximum number of channel messages scored together by the classifier
+INFERENCE_MAX_WAIT_SECONDS = 0.05 # how long a message waits for others to join its classifier batch
+INFERENCE_EXECUTOR_MODE = INFERENCE_EXECUTOR_MODE_PROCESS # "process" for a worker process pool, "thread" to keep the models in the bot process
+INFERENCE_NUM_WORKERS = 2 # number of inference worker processes, each with its own copy of the models
+INFERENCE_TORCH_NUM_THREADS = None # torch intra-op threads per worker; None splits the CPU cores evenly between workers
+INFERENCE_SERVER_HOST = "127.0.0.1"
+INFERENCE_SERVER_PORT = None # e.g. 9109 to score with a shared inference_server.py rather than loading the models in this process
+INFERENCE_SERVER_TIMEOUT_SECONDS = None # a batch the server hasn't scored by then fails, or goes to the fallback; None for the server's worst case, texts queued ahead included
+INFERENCE_SERVER_MAX_CONCURRENT_REQUESTS = 4
+INFERENCE_SERVER_FALLBACK_TO_LOCAL = False # score locally (loading the models on first use) when the server fails; otherwise the messages go unflagged
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108 # serves the metrics at http://METRICS_HOST:METRICS_PORT/metrics; None to disable
+METRICS_SNAPSHOT_FILE = "metrics.prom" # rewritten every METRICS_SNAPSHOT_INTERVAL_SECONDS; None to disable
+METRICS_SNAPSHOT_INTERVAL_SECONDS = 15
+REPORT_STORE_DB_FILE = "reports.db" # reports, moderator responses and channel flags persist here across restarts
+REPORT_STORE_HOT_MAX_ENTRIES = 256 # most recently used reports kept in memory
+NEAR_DUPLICATE_REBUILD_PAGE_SIZE = 500 # open reports read from the ReportStore at a time when the near-duplicate index is refilled
+TIMER_SCHEDULER_DB_FILE = "timers.db" # pending unmutes persist here, so they still happen after a restart
+UNMUTE_USER_TIMER = "unmute_user"
+UNMUTE_POSTER_TO_REPORTER_TIMER = "unmute_poster_to_reporter"
+SESSION_TTL_SECONDS = 15 * 60 # report and moderator response flows idle for this long are expired
+SESSION_SWEEP_INTERVAL_SECONDS = 30 # how often idle flows are looked for, and so how late past the TTL they may be expired
+MAX_REPORT_SESSIONS = 1000 # at most this many report flows at once; starting another expires the longest idle one
+MAX_MODERATOR_RESPONSE_SESSIONS = 100
+USER_CACHE_MAX_ENTRIES = 1024 # users who reacted to a prompt most recently, so their reactions needn't fetch them
 
 
 class ModBot(discord.Client):
@@ -60,17 +93,83 @@ class ModBot(discord.Client):
         self.mod_channels = {} # Map from guild to the mod channel id for that guild
         self.reports = {} # Map from user IDs to the state of their report
         self.moderator_responses = {} # Map from moderator ID to the state of their moderator report response
-        self.report_id_to_report = {} # Map from report IDs to the Report or AutomatedReport class instance
-        self.next_report_id = 0
+        # when each report and response flow could next be idle for SESSION_TTL_SECONDS, so abandoned ones are expired
+        self.report_session_wheel = TimerWheel(SESSION_TTL_SECONDS, SESSION_SWEEP_INTERVAL_SECONDS)
+        self.moderator_response_session_wheel = TimerWheel(SESSION_TTL_SECONDS, SESSION_SWEEP_INTERVAL_SECONDS)
+        self.session_sweeper_task = None
+        # id of each prompt the bot sent for an open flow -> {id of the user the flow belongs to: the Report or Response}, so
+        # reactions to anything else are dropped without fetching their message or user
+        self.prompt_sessions = {}
+        self.user_cache = OrderedDict() # user id -> User, least recently used first
         self.next_moderator_response_id = 0
-        self.user_id_to_number_of_reported_posts = defaultdict(int) # Map from user IDs to the number of the user's report that the ModBot has removed (default 0)
-        self.channel_id_to_moderator_flag_count = defaultdict(int)
 
-        self.user_id_to_report_id_to_actions = defaultdict(dict)  # nested dictionary, stores all actions taken on the reports associated with a given user
-        self.channel_id_to_report_id_to_actions = defaultdict(dict)  # nested dictionary, stores all actions taken on the reports associated with a given channel (group)
+        # every report (by report ID), the actions moderators took on them and the channel transgression counts, kept in SQLite
+        # so that they survive restarts and the bot's memory doesn't grow with them; it also hands out the report IDs
+        self.report_store = ReportStore(self, db_file = REPORT_STORE_DB_FILE, hot_max_entries = REPORT_STORE_HOT_MAX_ENTRIES)
+
+        # reports no moderator has responded to yet, most urgent first; moderators claim them with `next`
+        self.moderator_queue = ModeratorQueue()
+        for report_id, high_severity, disinfo_prob, created_at in self.report_store.open_report_priorities():
+            self.moderator_queue.add(report_id, high_severity, disinfo_prob, created_at)
 
         self.personal_mod_channel = None
 
+        # every message the bot sends goes through here, so replies to the same channel or DM are merged and rate limited
+        self.outbound = OutboundDispatcher()
+
+        # timed reversals of moderator actions (e.g. unmuting), so that no flow waits for them; started in on_ready
+        self.timer_scheduler = TimerScheduler(db_file = TIMER_SCHEDULER_DB_FILE)
+        self.timer_scheduler.register(UNMUTE_USER_TIMER, self.unmute_user)
+        self.timer_scheduler.register(UNMUTE_POSTER_TO_REPORTER_TIMER, self.unmute_poster_to_reporter)
+
+        self.auto_flagging_enabled = False  # set once the classifier models have been loaded and warmed up
+        self.inference_initialization_task = None
+
+        self.metrics = MetricsRegistry()
+        self.metrics_tasks = []
+        self.stage_latency_histogram = self.metrics.histogram("modbot_pipeline_stage_seconds", "Time spent in each classifier pipeline stage per batch.", "stage")
+        self.message_scoring_latency_histogram = self.metrics.histogram("modbot_message_scoring_seconds", "Time from a channel message being queued for scoring to its score arriving.")
+        self.verdict_cache_hit_counter = self.metrics.counter("modbot_verdict_cache_hits_total", "Messages whose verdict the classifier workers found in their verdict cache.")
+        self.verdict_cache_miss_counter = self.metrics.counter("modbot_verdict_cache_misses_total", "Messages the classifier workers had to score for lack of a cached verdict.")
+        self.metrics.gauge("modbot_verdict_cache_hit_rate", "Share of verdict cache lookups that were hits, since start-up.",
+                           lambda: self.verdict_cache_hit_counter.value / max(1, self.verdict_cache_hit_counter.value + self.verdict_cache_miss_counter.value))
+        self.messages_scored_counter = self.metrics.counter("modbot_messages_scored_total", "Channel messages scored by the classifier.")
+        self.messages_unscored_counter = self.metrics.counter("modbot_messages_unscored_total", "Channel messages left unflagged because scoring them failed.")
+        self.messages_auto_flagged_counter = self.metrics.counter("modbot_messages_auto_flagged_total", "Channel messages that opened an automated report.")
+        self.messages_auto_actioned_counter = self.metrics.counter("modbot_messages_auto_actioned_total", "Channel messages acted on automatically for a very high disinformation probability.")
+        self.metrics.gauge("modbot_open_report_sessions", "User report flows in progress.", lambda: len(self.reports))
+        self.metrics.gauge("modbot_open_moderator_response_sessions", "Moderator response flows in progress.", lambda: len(self.moderator_responses))
+        self.metrics.gauge("modbot_reports", "Reports known to the bot.", lambda: len(self.report_store))
+        self.metrics.gauge("modbot_open_reports_queued", "Open reports waiting for a moderator.", lambda: len(self.moderator_queue))
+        self.metrics.gauge("modbot_open_reports_claimed", "Open reports claimed by a moderator.", lambda: len(self.moderator_queue.claimed))
+        self.reactions_ignored_counter = self.metrics.counter("modbot_reactions_ignored_total", "Reactions dropped for not being on a prompt of the reacting user's open flow.")
+        self.sessions_expired_counter = self.metrics.counter("modbot_sessions_expired_total", "Report and moderator response flows expired for being idle or over the session cap.")
+        self.metrics.gauge("modbot_pending_timers", "Scheduled action reversals (e.g. unmutes) not yet due.", lambda: len(self.timer_scheduler))
+
+        # the classifier runs in its own workers so that the event loop stays free for report and response flows,
+        # or in an inference server shared with other bot processes (which then needn't load the models themselves)
+        if INFERENCE_SERVER_PORT is None:
+            self.inference_executor = self.local_inference_executor()
+        else:
+            self.inference_executor = InferenceClient(INFERENCE_SERVER_HOST, INFERENCE_SERVER_PORT,
+                                                      timeout_seconds = INFERENCE_SERVER_TIMEOUT_SECONDS,
+                                                      max_concurrent_requests = INFERENCE_SERVER_MAX_CONCURRENT_REQUESTS,
+                                                      fallback_executor = self.local_inference_executor() if INFERENCE_SERVER_FALLBACK_TO_LOCAL else None)
+
+        # messages from the group channel are scored together in micro-batches rather than one at a time
+        self.inference_batcher = InferenceBatcher(self.inference_executor.generate_ensemble_preds_and_scores,
+                                                  max_batch_size = INFERENCE_MAX_BATCH_SIZE,
+                                                  max_wait_seconds = INFERENCE_MAX_WAIT_SECONDS,
+                                                  max_concurrent_batches = self.inference_executor.num_workers)
+        self.metrics.gauge("modbot_inference_queue_depth", "Messages waiting to join a classifier batch.",
+                           lambda: self.inference_batcher.queue.qsize() if self.inference_batcher.queue else 0)
+        self.metrics.gauge("modbot_inference_batches_in_flight", "Classifier batches being scored.", lambda: len(self.inference_batcher.batch_tasks))
+
+        # the messages of open reports, so that edited reposts are attached to the earlier report; refilled from the
+        # ReportStore once connected, since the index itself isn't persisted
+        self.near_duplicate_index = MinHashLSHIndex()
+        self.near_duplicate_index_task = None
+
     async def on_ready(self):
         print(f'{self.user.name} has connected to Discord! It is these guilds:')
         for guild in self.guilds:
@@ -93,23 +192,116 @@ class ModBot(discord.Client):
                     if self.group_num == PERSONAL_GROUP_NUMBER_STR:
                         self.personal_mod_channel = channel   
 
+        logger.info(f"Connected to discord {time.perf_counter() - BOT_START_TIME:.2f}s after start-up")
+
+        # load the classifier in the background (on_ready may fire again after a reconnect)
+        if self.inference_initialization_task is None:
+            self.inference_initialization_task = asyncio.create_task(self.initialize_inference())
+
+        if not self.metrics_tasks:
+            self.start_metrics_exporters()
+
+        # timers that came due while the bot was down fire now
+        self.timer_scheduler.start()
+
+        if self.session_sweeper_task is None:
+            self.session_sweeper_task = asyncio.create_task(self.sweep_idle_sessions())
+
+        if self.near_duplicate_index_task is None:
+            self.near_duplicate_index_task = asyncio.create_task(self.rebuild_near_duplicate_index())
+
+    async def rebuild_near_duplicate_index(self):
+        # indexes the messages of the reports filed before a restart that are still open, a page of reports at a time;
+        # a stored snippet may be cut short, so those messages are fetched in full, and hashing happens off the event loop
+        num_indexed = 0
+        after_report_id = -1
+        while True:
+            rows = self.report_store.open_report_messages(after_report_id, NEAR_DUPLICATE_REBUILD_PAGE_SIZE)
+            if not rows:
+                break
+            for report_id, disinfo_prob, channel_id, message_id, content in rows:
+                if len(content) >= CONTENT_SNIPPET_MAX_CHARS:
+                    content = await self.full_content(StoredMessage(self, channel_id, None, message_id, None, None, content))
+                signature = await asyncio.to_thread(self.near_duplicate_index.signature, content)
+                if self.near_duplicate_index.add(signature, report_id = report_id, disinfo_prob = disinfo_prob) is not None:
+                    num_indexed += 1
+            after_report_id = rows[-1][0]
+        logger.info(f"Indexed the messages of {num_indexed} open reports for near-duplicate detection")
+
+    def local_inference_executor(self):
+        return InferenceExecutor(mode = INFERENCE_EXECUTOR_MODE,
+                                 num_workers = INFERENCE_NUM_WORKERS,
+                                 torch_num_threads = INFERENCE_TORCH_NUM_THREADS,
+                                 stage_histogram = self.stage_latency_histogram,
+                                 verdict_cache_hit_counter = self.verdict_cache_hit_counter,
+                                 verdict_cache_miss_counter = self.verdict_cache_miss_counter)
+
+    def start_metrics_exporters(self):
+        if METRICS_PORT is not None:
+            self.metrics_tasks.append(asyncio.create_task(self.metrics.serve(METRICS_HOST, METRICS_PORT)))
+        if METRICS_SNAPSHOT_FILE is not None:
+            self.metrics_tasks.append(asyncio.create_task(self.metrics.write_snapshots(METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL_SECONDS)))
+
+    async def initialize_inference(self):
+        start_time = time.perf_counter()
+        try:
+            stage_timings = await self.inference_executor.initialize()
+        except Exception:
+            logger.exception("Failed to load the classifier; automated flagging stays disabled")
+            return
+
+        for stage_name, seconds in stage_timings.items():
+            logger.info(f"Classifier stage '{stage_name}' took {seconds:.2f}s")
+        logger.info(f"Classifier ready {time.perf_counter() - start_time:.2f}s after connecting; automated flagging enabled")
+        self.auto_flagging_enabled = True
+
     async def on_raw_reaction_add(self, payload):
         # extract the contents of the reaction and metadata; see https://stackoverflow.com/questions/59854340/how-do-i-use-on-raw-reaction-add-in-discord-py 
-        channel = self.get_channel(payload.channel_id)
-        message = await channel.fetch_message(payload.message_id)
-        user = self.get_user(payload.user_id)
-        if not user:
-            user = await self.fetch_user(payload.user_id)
+        # only reactions by a flow's user to one of its prompts matter, which the payload alone is enough to tell
+        session = self.prompt_sessions.get(payload.message_id, {}).get(payload.user_id)
+        if session is None:
+            self.reactions_ignored_counter.inc()
+            return
+
+        # the flows don't read the message, so a partial one (made without a request) will do
+        message = session.channel.get_partial_message(payload.message_id)
+        user = payload.member or await self.cached_user(payload.user_id)
 
         emoji = str(payload.emoji)
 
         # Check if this message was sent in a server ("guild") or if it's a DM
-        if message.guild:
+        if payload.guild_id is not None:
             await self.handle_channel_reaction(message, emoji, user)
         else:
             await self.handle_dm_reaction(message, emoji, user)  
 
 
+    async def cached_user(self, user_id):
+        user = self.user_cache.get(user_id)
+        if user is None:
+            user = self.get_user(user_id) or await self.fetch_user(user_id)
+        self.user_cache[user_id] = user
+        self.user_cache.move_to_end(user_id)
+        while len(self.user_cache) > USER_CACHE_MAX_ENTRIES:
+            self.user_cache.popitem(last = False)
+        return user
+
+    def prompt_indexer(self, sessions, key, session):
+        # returns the outbound on_sent callback that indexes the prompts sent for a flow, unless it closed in the meantime
+        def index_prompt(sent_message):
+            if sessions.get(key) is session:
+                self.prompt_sessions.setdefault(sent_message.id, {})[key] = session
+                session.prompt_message_ids.append(sent_message.id)
+        return index_prompt
+
+    def unindex_prompts(self, key, session):
+        for message_id in session.prompt_message_ids:
+            message_sessions = self.prompt_sessions.get(message_id)
+            if message_sessions is not None:
+                message_sessions.pop(key, None)
+                if not message_sessions:
+                    del self.prompt_sessions[message_id]
+
     async def handle_channel_reaction(self, message, emoji, user):
         moderator_id = user.id
 
@@ -119,8 +311,7 @@ class ModBot(discord.Client):
 
         # Let the moderator Response class handle this message; forward all the reactions to the responses
         responses = await self.moderator_responses[moderator_id].handle_reaction(message, emoji, user)
-        for r in responses:
-            await message.channel.send(r)
+        self.outbound.send(message.channel, *responses)
 
 
     async def handle_dm_reaction(self, message, emoji, user):
@@ -134,8 +325,7 @@ class ModBot(discord.Client):
 
         # Let the report class handle this message; forward all the reactions to the report
         responses = await self.reports[report_author_id].handle_reaction(message, emoji, user)
-        for r in responses:
-            await message.channel.send(r)
+        self.outbound.send(message.channel, *responses)
 
 
     async def on_message(self, message):
@@ -158,7 +348,7 @@ class ModBot(discord.Client):
         if message.content == Report.HELP_KEYWORD:
             reply =  "Use the `report` command to begin the reporting process.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
-            await message.channel.send(reply)
+            self.outbound.send(message.channel, reply)
             return
 
         author_id = message.author.id
@@ -170,35 +360,43 @@ class ModBot(discord.Client):
 
         # If we don't currently have an active report for this user, add one
         if author_id not in self.reports:
-            self.reports[author_id] = Report(self, message.author.name)
+            self.open_session(self.reports, self.report_session_wheel, author_id, Report(self, message.author.name), MAX_REPORT_SESSIONS)
 
         # Let the report class handle this message; forward all the messages it returns to uss
         responses = await self.reports[author_id].handle_message(message)
-        for r in responses:
-            await message.channel.send(r)
+        self.outbound.send(message.channel, *responses, on_sent = self.prompt_indexer(self.reports, author_id, self.reports[author_id]))
 
         # If the report is cancelled, remove it from our map
         if self.reports[author_id].report_cancelled():
-            self.reports.pop(author_id)
+            self.close_report_session(author_id)
             return
         
         # If the report is finished, initiate the moderator reporting flow
         if self.reports[author_id].report_finished():
             # associate this report with a report id
-            self.report_id_to_report[self.next_report_id] = self.reports[author_id]
+            report = self.reports[author_id]
+            report_id = self.report_store.allocate_report_id()
+            self.moderator_queue.push(self.report_store.add(report_id, report))
 
             # Send the report summary to the moderator channel
-            report_summary = self.reports[author_id].generate_summary(report_id = self.next_report_id)
+            report_summary = report.generate_summary(report_id = report_id)
 
-            # move to the next report id
-            self.next_report_id += 1
+            self.outbound.send(self.personal_mod_channel, report_summary)
+            self.close_report_session(author_id)
 
-            await self.personal_mod_channel.send(report_summary)
+            # later near-duplicates of the reported message are attached to this report
+            signature = await asyncio.to_thread(self.near_duplicate_index.signature, report.message.content)
+            self.near_duplicate_index.add(signature, report_id = report_id)
             
 
     async def handle_channel_message(self, message):  
         # Only handle messages sent in the "group-#" channel
         if message.channel.name == f'group-{self.group_num}':
+            # messages posted while the classifier is still loading are not auto-flagged
+            if not self.auto_flagging_enabled:
+                print("Classifier is still loading, skipping automated flagging")
+                return
+
             # pass along to the automated flagging logics
             print("HANDLING AUTOMATED MESSAGE")
             await self.automated_message_flagging(message)
@@ -212,7 +410,23 @@ class ModBot(discord.Client):
     async def automated_message_flagging(self, message):
         # check to see if the message fits our placeholder template for messages to be auto-flagged from the regular channel
 
-        ex_preds, ex_scores = generate_ensemble_preds_and_scores([message.content])
+        # edited reposts of a message that's already been reported are attached to its report rather than scored again.
+        # the signature is pure-Python hashing, so it's computed once, off the event loop, and reused if the message is reported
+        signature = await asyncio.to_thread(self.near_duplicate_index.signature, message.content)
+        near_duplicate = self.near_duplicate_index.query(signature)
+        if near_duplicate and await self.handle_near_duplicate_message(message, near_duplicate):
+            return
+
+        # wait for the batch this message lands in to be scored
+        start_time = time.perf_counter()
+        try:
+            ex_pred, ex_score = await self.inference_batcher.score(message.content)
+        except Exception:
+            logger.exception("Failed to score a channel message; it won't be auto-flagged")
+            self.messages_unscored_counter.inc()
+            return
+        self.message_scoring_latency_histogram.observe(time.perf_counter() - start_time)
+        self.messages_scored_counter.inc()
         # m = re.search(self.AUTO_FLAG_REGEX, message.content)
         
         # # does not match the placeholder autoflagging template
@@ -220,7 +434,7 @@ class ModBot(discord.Client):
         #     # don't do anything with the message
         #     return
 
-        disinfo_prob = ex_scores[0] #float(message.content[message.content.rindex(self.DISINFO_PROB_PREFIX_CHAR)+1:])
+        disinfo_prob = ex_score #float(message.content[message.content.rindex(self.DISINFO_PROB_PREFIX_CHAR)+1:])
         print(f"The disinfo prob is {disinfo_prob}")
         print(disinfo_prob > self.VERY_HIGH_DISINFO_PROB_THRESHOLD)
 
@@ -230,53 +444,79 @@ class ModBot(discord.Client):
             return
         
         # create an automated report for this post
+        report_id = self.report_store.allocate_report_id()
         new_automated_report = AutomatedReport(client=self, disinfo_prob = disinfo_prob, 
                                                 message = message,
-                                                report_id = self.next_report_id,
+                                                report_id = report_id,
                                                 very_high_disinfo_prob = disinfo_prob > self.VERY_HIGH_DISINFO_PROB_THRESHOLD)
-        self.report_id_to_report[self.next_report_id] = new_automated_report
-
-        # increment the report id
-        self.next_report_id += 1
+        self.moderator_queue.push(self.report_store.add(report_id, new_automated_report))
+        self.near_duplicate_index.add(signature, report_id = report_id, disinfo_prob = disinfo_prob)
+        self.messages_auto_flagged_counter.inc()
 
         # if the automated report has a very high disinfo probability, take the relevant actions
         if new_automated_report.very_high_disinfo_prob:
             print("Acting on very high disinfo probability message!")
+            self.messages_auto_actioned_counter.inc()
             await new_automated_report.act_on_very_high_disinfo_message()
+            self.report_store.save(report_id, new_automated_report)
 
         # send the summary of the automatically generated report to the moderator channel
         automated_report_summary = new_automated_report.generate_summary()
 
-        await self.personal_mod_channel.send(automated_report_summary)
+        self.outbound.send(self.personal_mod_channel, automated_report_summary)
+
+    async def handle_near_duplicate_message(self, message, near_duplicate):
+        # returns whether the message was attached to the report; if not, it's scored like any other message.
+        # a report a moderator has already responded to is closed, so its entry is dropped and the message can open a new report
+        if self.report_store.is_closed(near_duplicate.report_id):
+            self.near_duplicate_index.discard(near_duplicate.key)
+            return False
+
+        # attach the message to the existing report rather than opening a new one for moderators
+        report = self.report_store.get(near_duplicate.report_id)
+        if report is None:
+            self.near_duplicate_index.discard(near_duplicate.key)
+            return False
+        report.add_duplicate_message(message)
+        self.report_store.save(near_duplicate.report_id, report)
+        print(f"Attached a near-duplicate message to report {near_duplicate.report_id}")
+
+        # apply the same automatic actions that were taken on the original message
+        if isinstance(report, AutomatedReport) and report.very_high_disinfo_prob:
+            self.messages_auto_actioned_counter.inc()
+            await report.act_on_duplicate_message(message)
+        return True
 
     
     async def handle_moderator_channel_message(self, message):
         # Handle a help message
         if message.content == Response.HELP_KEYWORD:
             reply =  "Use the `start` command to begin the reporting process.\n"
+            reply += "Use the `next` command to respond to the most urgent open report.\n"
             reply += "Use the `cancel` command to cancel the report process.\n"
-            await message.channel.send(reply)
+            self.outbound.send(message.channel, reply)
             return
 
         moderator_id = message.author.id
         responses = []
 
         # Only respond to non-start messages if the moderator already has an existing response flow
-        if moderator_id not in self.moderator_responses and not message.content.startswith(Response.START_KEYWORD):
+        if moderator_id not in self.moderator_responses and not message.content.startswith(Response.START_KEYWORD) and message.content != Response.NEXT_KEYWORD:
             return
         
         # If we don't currently have an active report response for this moderator, add one
         if moderator_id not in self.moderator_responses:
-            self.moderator_responses[moderator_id] = Response(self)  # our bot is the client
+            self.open_session(self.moderator_responses, self.moderator_response_session_wheel, moderator_id,
+                              Response(self, moderator_id), MAX_MODERATOR_RESPONSE_SESSIONS)  # our bot is the client
 
         # Let the report class handle this message; forward all the messages it returns to uss
         responses = await self.moderator_responses[moderator_id].handle_message(message)
-        for r in responses:
-            await message.channel.send(r)
+        self.outbound.send(message.channel, *responses,
+                           on_sent = self.prompt_indexer(self.moderator_responses, moderator_id, self.moderator_responses[moderator_id]))
 
-        # If the report is cancelled, remove it from our map
+        # If the report is cancelled, remove it from our map and put the report it claimed back in the queue
         if self.moderator_responses[moderator_id].response_cancelled():
-            self.moderator_responses.pop(moderator_id)
+            self.close_moderator_response_session(moderator_id)
             return
         
         # If the report is finished, update the count of the poster's reported messages
@@ -284,73 +524,144 @@ class ModBot(discord.Client):
             poster_id = self.moderator_responses[moderator_id].reported_message.author.id
             report_id = self.moderator_responses[moderator_id].report_id
 
-            set_of_mod_actions_taken = set()
-            for state, emoji_options in self.moderator_responses[moderator_id].moderator_state_to_selected_emoji.items():
-                for emoji_option in emoji_options:
-                    set_of_mod_actions_taken.add(emoji_option.action)
+            set_of_mod_actions_taken = self.moderator_responses[moderator_id].actions_taken()
             set_of_all_actions_taken = set_of_mod_actions_taken.union(self.moderator_responses[moderator_id].set_of_previous_actions_taken)
 
             # log the actions associated with the user and channel (group)
-            self.user_id_to_number_of_reported_posts[poster_id] += 1
-            self.user_id_to_report_id_to_actions[poster_id][report_id] = set_of_all_actions_taken
-            self.channel_id_to_report_id_to_actions[self.moderator_responses[moderator_id].reported_message.channel.id][report_id] = set_of_all_actions_taken
+            self.report_store.record_moderator_response(report_id, poster_id, self.moderator_responses[moderator_id].reported_message.channel.id, set_of_all_actions_taken)
+            self.moderator_queue.complete(report_id)
             
-            self.moderator_responses.pop(moderator_id)
+            self.close_moderator_response_session(moderator_id)
             return
 
+    def open_session(self, sessions, session_wheel, key, session, max_sessions):
+        # under spam or many abandoned flows, the longest idle one makes room for the new one
+        if len(sessions) >= max_sessions:
+            idlest_key = min(sessions, key = lambda session_key: sessions[session_key].last_activity)
+            self.expire_session(sessions, idlest_key, "too many flows were open at once")
+        sessions[key] = session
+        session_wheel.schedule(key, session.last_activity + SESSION_TTL_SECONDS)
+
+    def close_report_session(self, author_id):
+        report = self.reports.pop(author_id, None)
+        self.report_session_wheel.discard(author_id)
+        if report is not None:
+            self.unindex_prompts(author_id, report)
+
+    def close_moderator_response_session(self, moderator_id):
+        # the report the response had claimed goes back in the queue
+        response = self.moderator_responses.pop(moderator_id, None)
+        self.moderator_response_session_wheel.discard(moderator_id)
+        if response is not None:
+            self.unindex_prompts(moderator_id, response)
+            if response.report_id is not None:
+                self.moderator_queue.release(response.report_id)
+
+    def expire_session(self, sessions, key, reason):
+        session = sessions[key]
+        if sessions is self.reports:
+            self.close_report_session(key)
+            notice = f"Your report has been cancelled because {reason}. Use the `{Report.START_KEYWORD}` command to start again."
+        else:
+            self.close_moderator_response_session(key)
+            notice = f"<@{key}>, your report response has been cancelled because {reason}. The report is back in the queue."
+        self.sessions_expired_counter.inc()
+        if session.channel is not None:
+            self.outbound.send(session.channel, notice)
+
+    async def sweep_idle_sessions(self):
+        while True:
+            await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
+            now = time.monotonic()
+            for sessions, session_wheel in ((self.reports, self.report_session_wheel), (self.moderator_responses, self.moderator_response_session_wheel)):
+                for key in session_wheel.advance(now):
+                    session = sessions.get(key)
+                    if session is None:
+                        continue
+                    # sessions only record their activity, so one that was active since it was scheduled is rescheduled here
+                    deadline = session.last_activity + SESSION_TTL_SECONDS
+                    if deadline > now:
+                        session_wheel.schedule(key, deadline)
+                    else:
+                        self.expire_session(sessions, key, f"it was idle for over {SESSION_TTL_SECONDS // 60} minutes")
+
+    async def run_actions(self, *actions):
+        # independent actions run concurrently; one failing is logged and doesn't stop the others
+        results = await asyncio.gather(*actions, return_exceptions = True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error("A moderator action failed", exc_info = result)
+
     async def remove_reported_post(self, message):
         # use the discord py Message object stored in self.reported_message to get the info necessary to remove the reported message
         await message.delete()
 
+    async def full_content(self, message):
+        # a report rebuilt from the store only keeps a snippet of its message, so the whole message is fetched to quote it
+        if not isinstance(message, StoredMessage):
+            return message.content
+        try:
+            return (await message.fetch()).content
+        except discord.HTTPException:
+            return message.content
+
     async def modify_post_with_disclaimer_and_reliable_resources(self, message):
         responses = [DEFAULT_MODIFY_POST_DISCLAIMER,\
-            "Message sent by:"+ "```" + message.author.name + ": " + message.content + "```",\
+            "Message sent by:"+ "```" + message.author.name + ": " + await self.full_content(message) + "```",\
             "Please visit " + "https://www.cdc.gov/ " + "for reliable information."]
-        for r in responses:
-            await message.channel.send(r)
+        self.outbound.send(message.channel, *responses)
 
     async def notify_poster_of_transgression(self, message):
         # notify user of transgression
         # state which post in which channel was the reason
         responses = [DEFAULT_NOTFIY_USER_OF_TRANSGESSION , \
                             "The following post: " ,\
-                            message.content ,\
+                            await self.full_content(message) ,\
                             "Was reported in the following channel: {}\n".format(message.channel.name)]
-        for r in responses:
-            await message.author.send(content=r)
+        self.outbound.send(message.author, *responses)
 
     async def temporarily_mute_user(self, message):
         # see https://stackoverflow.com/questions/62436615/how-do-i-temp-mute-someone-using-discord-py#:~:text=mute%20command%20so%20it's%20possible,and%20y%20is%20for%20years.
         # make sure to message the user when they have been muted/unmuted
-         await message.channel.send("{} has been muted!\n" .format(message.author.mention))
-         await asyncio.sleep(MUTE_TIME_IN_SECONDS)
-         await message.channel.send("{} has been unmuted!\n" .format(message.author.mention))
+         self.outbound.send(message.channel, "{} has been muted!\n" .format(message.author.mention))
+         self.timer_scheduler.schedule(MUTE_TIME_IN_SECONDS, UNMUTE_USER_TIMER, {"channel_id": message.channel.id, "user_mention": message.author.mention})
+
+    async def unmute_user(self, timer_payload):
+        channel = await self.channel_for_timer(timer_payload)
+        self.outbound.send(channel, "{} has been unmuted!\n" .format(timer_payload["user_mention"]))
 
     async def note_in_channel_mute_poster_to_reporter(self, message, poster, reporter):
-        await message.channel.send("{} has {}'s messages muted!\n" .format(reporter, poster))
-        await asyncio.sleep(MUTE_TIME_IN_SECONDS)
-        await message.channel.send("{} has {}'s messages unmuted!\n" .format(reporter, poster))
+        self.outbound.send(message.channel, "{} has {}'s messages muted!\n" .format(reporter, poster))
+        self.timer_scheduler.schedule(MUTE_TIME_IN_SECONDS, UNMUTE_POSTER_TO_REPORTER_TIMER, {"channel_id": message.channel.id, "poster": poster, "reporter": reporter})
+
+    async def unmute_poster_to_reporter(self, timer_payload):
+        channel = await self.channel_for_timer(timer_payload)
+        self.outbound.send(channel, "{} has {}'s messages unmuted!\n" .format(timer_payload["reporter"], timer_payload["poster"]))
+
+    async def channel_for_timer(self, timer_payload):
+        # after a restart the channel may not be cached yet
+        return self.get_channel(timer_payload["channel_id"]) or await self.fetch_channel(timer_payload["channel_id"])
 
     async def permanently_remove_user(self, message):
         # since we don't actually want to remove any users, send a message to the channel saying "user {user_name} has been removed from this channel!"
         # make sure to message the user when they have been removed
-        await message.channel.send("User {} has been removed from this channel!\n" .format(message.author.mention))
-        await message.author.send(content="We regret to inform you that you've been removed from our social network!")
+        self.outbound.send(message.channel, "User {} has been removed from this channel!\n" .format(message.author.mention))
+        self.outbound.send(message.author, "We regret to inform you that you've been removed from our social network!")
     
     async def notify_group_of_transgressions(self, message):
         # Notify users in group or joining group about the high volume of misinformation
-        await message.channel.send("Dear users of group-{}, we regret to inform you that this group has been found to have high volume of misinformation content, please be advised!\n".format(self.group_num))
+        self.outbound.send(message.channel, "Dear users of group-{}, we regret to inform you that this group has been found to have high volume of misinformation content, please be advised!\n".format(self.group_num))
 
     async def increment_group_transgression_counter(self, message):
-        self.channel_id_to_moderator_flag_count[message.channel.id] += 1
+        self.report_store.add_channel_flag(message.channel.id)
 
     def generate_message_metadata_summary(self, message):
         reply = "\nPOST METADATA:\n" +\
             f"The following message: {message.content}\n" + \
             f"Was created by: {message.author.name}\n" + \
-            f"{message.author.name}'s previous reports' count is: {self.user_id_to_number_of_reported_posts[message.author.id]}\n" +\
+            f"{message.author.name}'s previous reports' count is: {self.report_store.count_reported_posts(message.author.id)}\n" +\
             f"It was posted in the following channel: {message.channel.name}\n" +\
-            f"The channel {message.channel.name} had a total of {self.channel_id_to_moderator_flag_count[message.channel.id]} flagged transgressions."
+            f"The channel {message.channel.name} had a total of {self.report_store.count_channel_flags(message.channel.id)} flagged transgressions."
         return reply
 
 
@@ -372,5 +683,16 @@ class ModBot(discord.Client):
         return "Evaluated: '" + text+ "'"
 
 
-client = ModBot()
-client.run(discord_token)
\ No newline at end of file
+# the guard keeps spawned inference worker processes, which re-import this module, from starting their own bot
+if __name__ == "__main__":
+    handler = logging.FileHandler(filename='discord.log', encoding='utf-8', mode='w')
+    handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s:%(name)s: %(message)s'))
+    logger.addHandler(handler)
+
+    client = ModBot()
+    try:
+        client.run(discord_token)
+    finally:
+        client.inference_executor.shutdown()
+        client.report_store.close()
+        client.timer_scheduler.close()
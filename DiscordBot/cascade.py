@@ -0,0 +1,135 @@
+# file for the cheap first-stage classifier that decides which messages need the full translation + BERT + Chat-GPT ensemble
+# run this file to see how much traffic each stage would handle, and the resulting accuracy, at several cutoffs on full_test.csv
+import argparse
+import csv
+import json
+import numpy as np
+import os
+import threading
+
+FIRST_STAGE_MODEL_FILE = "../Data_And_Models/first_stage_model.joblib" # trained from TRAIN_FILE the first time it's needed
+TRAIN_FILE = "../Data_And_Models/full_train.csv"
+TEST_FILE = "../Data_And_Models/full_test.csv"
+ENSEMBLE_PREDS_FILE = "../Data_And_Models/ensemble_preds.csv"
+
+# messages whose first-stage score is at or above the escalation threshold go on to the ensemble; the first stage alone
+# only ever answers that a message is harmless, so confidently fake messages are still confirmed by the ensemble
+DEFAULT_ESCALATION_THRESHOLD = 0.1
+
+NUM_HASHED_FEATURES = 2 ** 18
+
+FIRST_STAGE = "first_stage"
+ENSEMBLE_STAGE = "ensemble"
+
+
+def read_labelled_texts(csv_file):
+    with open(csv_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+    return [row['text'] for row in rows], np.array([1 if row['label'] == "fake" else 0 for row in rows])
+
+
+def train_first_stage_model(train_file = TRAIN_FILE):
+    # hashed word uni- and bi-gram tf-idf features keep the model small and need no fitted vocabulary
+    from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import make_pipeline
+
+    texts, labels = read_labelled_texts(train_file)
+    model = make_pipeline(HashingVectorizer(n_features = NUM_HASHED_FEATURES, ngram_range = (1, 2), alternate_sign = False),
+                          TfidfTransformer(),
+                          LogisticRegression(max_iter = 1000))
+    model.fit(texts, labels)
+    return model
+
+
+def load_first_stage_model(model_file = FIRST_STAGE_MODEL_FILE):
+    from joblib import dump, load
+    if os.path.isfile(model_file):
+        return load(model_file)
+    model = train_first_stage_model()
+    # inference workers starting together may each train it; each dumps to its own file, and the rename is atomic
+    tmp_model_file = f"{model_file}.{os.getpid()}.tmp"
+    dump(model, tmp_model_file)
+    os.replace(tmp_model_file, model_file)
+    return model
+
+
+class CascadeStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stage_to_count = {FIRST_STAGE: 0, ENSEMBLE_STAGE: 0}
+
+    def record(self, num_first_stage, num_escalated):
+        with self.lock:
+            self.stage_to_count[FIRST_STAGE] += num_first_stage
+            self.stage_to_count[ENSEMBLE_STAGE] += num_escalated
+
+    def total(self):
+        return sum(self.stage_to_count.values())
+
+    def fractions(self):
+        total = self.total()
+        return {stage: (count / total if total else 0.0) for stage, count in self.stage_to_count.items()}
+
+
+class FirstStageClassifier:
+    def __init__(self, model, escalation_threshold: float = DEFAULT_ESCALATION_THRESHOLD):
+        self.model = model
+        self.escalation_threshold = escalation_threshold
+        self.stats = CascadeStats()
+
+    def scores(self, text_inputs):
+        return self.model.predict_proba(list(text_inputs))[:, 1]
+
+    def escalation_mask(self, scores):
+        return np.asarray(scores) >= self.escalation_threshold
+
+    def split(self, text_inputs):
+        # returns the first-stage scores and a boolean mask of the messages that need the ensemble
+        scores = self.scores(text_inputs)
+        escalate = self.escalation_mask(scores)
+        self.stats.record(int(np.sum(~escalate)), int(np.sum(escalate)))
+        return scores, escalate
+
+
+def cascade_report(escalation_thresholds):
+    # offline: the escalated rows use the committed ensemble predictions, so no model other than the first stage is run
+    texts, labels = read_labelled_texts(TEST_FILE)
+    ensemble_preds = np.loadtxt(ENSEMBLE_PREDS_FILE, delimiter=",")[:len(texts)]
+    first_stage_scores = load_first_stage_model().predict_proba(texts)[:, 1]
+    first_stage_preds = (first_stage_scores >= 0.5).astype(int)
+
+    results = []
+    for escalation_threshold in escalation_thresholds:
+        classifier = FirstStageClassifier(None, escalation_threshold)
+        escalate = classifier.escalation_mask(first_stage_scores)
+        cascade_preds = np.where(escalate, ensemble_preds, first_stage_preds)
+        handled_by_first_stage = ~escalate
+        results.append({
+            "escalation_threshold": escalation_threshold,
+            "first_stage_fraction": float(np.mean(handled_by_first_stage)),
+            "ensemble_fraction": float(np.mean(escalate)),
+            "first_stage_accuracy": float(np.mean(first_stage_preds[handled_by_first_stage] == labels[handled_by_first_stage])) if np.any(handled_by_first_stage) else None,
+            "cascade_accuracy": float(np.mean(cascade_preds == labels)),
+            "ensemble_accuracy": float(np.mean(ensemble_preds == labels)),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Report the traffic split and accuracy of the classifier cascade on full_test.csv.")
+    parser.add_argument("--thresholds", nargs = "+", type = float, default = [0.01, 0.05, 0.1, 0.2, 0.3])
+    parser.add_argument("--output", default = None, help = "also write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = cascade_report(args.thresholds)
+    for result in results:
+        first_stage_accuracy = "n/a" if result["first_stage_accuracy"] is None else f"{result['first_stage_accuracy']:.4f}"
+        print(f"escalating from {result['escalation_threshold']}: " \
+              f"first stage handles {result['first_stage_fraction']:.2%} (accuracy {first_stage_accuracy}), " \
+              f"ensemble handles {result['ensemble_fraction']:.2%}; cascade accuracy {result['cascade_accuracy']:.4f} " \
+              f"vs ensemble only {result['ensemble_accuracy']:.4f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -0,0 +1,161 @@
+# file for the policy that skips the Chat-GPT request when BERT's score is already decisive
+# run this file to see how many Chat-GPT calls each band would have avoided on full_test.csv, what it costs in accuracy,
+# and how it changes the number of messages crossing the bot's report and auto-removal thresholds
+import argparse
+import csv
+import json
+import numpy as np
+import threading
+from ensemble_combiner import GPT_PRED_VALUES
+
+# Chat-GPT is only asked about messages whose BERT score falls inside this band. By default only the low side exits early:
+# the expected score given to BERT-confident fakes (about 0.95) falls short of the auto-removal threshold, which the
+# ensemble's score for them usually crosses, so every band with a high side fails the report's gate
+DEFAULT_UNCERTAIN_LOW = 0.01
+DEFAULT_UNCERTAIN_HIGH = 1.0
+
+# the bot's thresholds (ModBot in bot.py) for filing an automated report and for removing the message outright
+MODERATE_DISINFO_PROB_THRESHOLD = 0.9
+VERY_HIGH_DISINFO_PROB_THRESHOLD = 0.97
+# a band passes the report's gate if, at each threshold, the number of messages crossing it is within this fraction of the full ensemble's
+DEFAULT_MAX_CROSSINGS_CHANGE = 0.1
+
+TEST_FILE = "../Data_And_Models/full_test.csv"
+BERT_PREDS_FILE = "../Data_And_Models/bert_preds.csv"
+BERT_SCORES_FILE = "../Data_And_Models/bert_scores.csv"
+GPT_PREDS_FILE = "../Data_And_Models/gpt_preds.csv"
+ENSEMBLE_PREDS_FILE = "../Data_And_Models/ensemble_preds.csv"
+ENSEMBLE_SCORES_FILE = "../Data_And_Models/ensemble_scores.csv"
+ENSEMBLE_MODEL_FILE = "../Data_And_Models/ensemble_model.joblib"
+
+
+def gpt_label_frequencies(gpt_preds):
+    # how often Chat-GPT gave each label (in GPT_PRED_VALUES order), ignoring failed requests; uniform if there are none
+    counts = np.array([np.sum(np.asarray(gpt_preds) == value) for value in GPT_PRED_VALUES], dtype=float)
+    return counts / counts.sum() if counts.sum() else np.full(len(GPT_PRED_VALUES), 1 / len(GPT_PRED_VALUES))
+
+
+def load_gpt_label_frequencies(uncertain_low: float, uncertain_high: float):
+    # Chat-GPT's labels on full_test.csv for the messages BERT scores below and above the band
+    bert_scores = np.loadtxt(BERT_SCORES_FILE, delimiter=",")
+    gpt_preds = np.loadtxt(GPT_PREDS_FILE, delimiter=",")[:len(bert_scores)]
+    return gpt_label_frequencies(gpt_preds[bert_scores < uncertain_low]), gpt_label_frequencies(gpt_preds[bert_scores > uncertain_high])
+
+
+class EarlyExitPolicy:
+    '''
+    Decides which messages BERT is decisive about, so their Chat-GPT request is skipped. Those messages can't be scored
+    with BERT's raw score, which is far more confident than the ensemble's; instead they're given the ensemble's
+    expected score over the Chat-GPT labels that messages on the same side of the band get (see gpt_label_probs).
+    '''
+
+    def __init__(self, uncertain_low: float = DEFAULT_UNCERTAIN_LOW, uncertain_high: float = DEFAULT_UNCERTAIN_HIGH,
+                 low_gpt_label_freqs = None, high_gpt_label_freqs = None):
+        self.uncertain_low = uncertain_low
+        self.uncertain_high = uncertain_high
+        if low_gpt_label_freqs is None or high_gpt_label_freqs is None:
+            low_gpt_label_freqs, high_gpt_label_freqs = load_gpt_label_frequencies(uncertain_low, uncertain_high)
+        self.low_gpt_label_freqs = np.asarray(low_gpt_label_freqs, dtype=float)
+        self.high_gpt_label_freqs = np.asarray(high_gpt_label_freqs, dtype=float)
+        self.lock = threading.Lock()
+        self.num_gpt_requests = 0
+        self.num_gpt_requests_avoided = 0
+
+    def needs_gpt(self, bert_scores):
+        # boolean mask of the messages BERT isn't sure enough about on its own
+        bert_scores = np.asarray(bert_scores)
+        needs_gpt = (bert_scores >= self.uncertain_low) & (bert_scores <= self.uncertain_high)
+        with self.lock:
+            self.num_gpt_requests += int(np.sum(needs_gpt))
+            self.num_gpt_requests_avoided += int(np.sum(~needs_gpt))
+        return needs_gpt
+
+    def gpt_label_probs(self, bert_scores):
+        # one row of Chat-GPT label probabilities per message, for messages outside the band
+        above_band = np.asarray(bert_scores)[:, None] > self.uncertain_high
+        return np.where(above_band, self.high_gpt_label_freqs, self.low_gpt_label_freqs)
+
+    def avoided_fraction(self):
+        total = self.num_gpt_requests + self.num_gpt_requests_avoided
+        return self.num_gpt_requests_avoided / total if total else 0.0
+
+
+def threshold_crossings(scores):
+    scores = np.asarray(scores)
+    return {"moderate": int(np.sum(scores >= MODERATE_DISINFO_PROB_THRESHOLD)), "very_high": int(np.sum(scores > VERY_HIGH_DISINFO_PROB_THRESHOLD))}
+
+
+def passes_gate(early_exit_crossings, ensemble_crossings, max_crossings_change = DEFAULT_MAX_CROSSINGS_CHANGE):
+    # fewer crossings matter as much as more: fewer auto-removals let disinformation stay up
+    return all(abs(early_exit_crossings[name] - ensemble_crossings[name]) <= max_crossings_change * ensemble_crossings[name] for name in ensemble_crossings)
+
+
+def early_exit_report(bands, max_crossings_change = DEFAULT_MAX_CROSSINGS_CHANGE):
+    # offline: decisive rows get the policy's expected ensemble score, exactly as the pipeline does when Chat-GPT is skipped.
+    # Chat-GPT's label frequencies are measured on the same file, so the report is somewhat optimistic about them
+    from joblib import load
+    from ensemble_combiner import EnsembleCombiner
+    combiner = EnsembleCombiner(load(ENSEMBLE_MODEL_FILE))
+
+    with open(TEST_FILE, newline='') as f:
+        labels = np.array([1 if row['label'] == "fake" else 0 for row in csv.DictReader(f)])
+    bert_preds = np.loadtxt(BERT_PREDS_FILE, delimiter=",")
+    bert_scores = np.loadtxt(BERT_SCORES_FILE, delimiter=",")
+    gpt_preds = np.loadtxt(GPT_PREDS_FILE, delimiter=",")[:len(bert_scores)]
+    ensemble_preds = np.loadtxt(ENSEMBLE_PREDS_FILE, delimiter=",")
+    ensemble_scores = np.loadtxt(ENSEMBLE_SCORES_FILE, delimiter=",")
+    labels = labels[:len(ensemble_preds)]
+    ensemble_crossings = threshold_crossings(ensemble_scores)
+
+    results = []
+    for uncertain_low, uncertain_high in bands:
+        policy = EarlyExitPolicy(uncertain_low, uncertain_high,
+                                 gpt_label_frequencies(gpt_preds[bert_scores < uncertain_low]), gpt_label_frequencies(gpt_preds[bert_scores > uncertain_high]))
+        needs_gpt = policy.needs_gpt(bert_scores)
+        early_exit_preds, early_exit_scores = ensemble_preds.copy(), ensemble_scores.copy()
+        early_exit_preds[~needs_gpt], early_exit_scores[~needs_gpt] = combiner.expected_preds_and_scores(policy.gpt_label_probs(bert_scores[~needs_gpt]), bert_preds[~needs_gpt])
+        early_exit_crossings = threshold_crossings(early_exit_scores)
+        results.append({
+            "uncertain_low": uncertain_low,
+            "uncertain_high": uncertain_high,
+            "gpt_calls_avoided": int(np.sum(~needs_gpt)),
+            "gpt_calls_avoided_fraction": float(np.mean(~needs_gpt)),
+            "early_exit_accuracy": float(np.mean(early_exit_preds == labels)),
+            "ensemble_accuracy": float(np.mean(ensemble_preds == labels)),
+            "agreement_with_ensemble": float(np.mean(early_exit_preds == ensemble_preds)),
+            "early_exit_threshold_crossings": early_exit_crossings,
+            "ensemble_threshold_crossings": ensemble_crossings,
+            "passes_gate": passes_gate(early_exit_crossings, ensemble_crossings, max_crossings_change),
+        })
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Report the Chat-GPT calls avoided by early exit, and the accuracy change, on full_test.csv.")
+    parser.add_argument("--lows", nargs = "+", type = float, default = [0.0001, 0.001, 0.01, 0.05, 0.1])
+    parser.add_argument("--max-crossings-change", type = float, default = DEFAULT_MAX_CROSSINGS_CHANGE,
+                        help = "a band passes if, at each threshold, its number of crossings is within this fraction of the full ensemble's")
+    parser.add_argument("--output", default = None, help = "also write the results to this JSON file")
+    args = parser.parse_args()
+
+    # symmetric bands around 0.5, and the same lows with no early exit on the high side
+    results = early_exit_report([(low, 1 - low) for low in args.lows] + [(low, 1.0) for low in args.lows], args.max_crossings_change)
+    for result in results:
+        early_exit_crossings, ensemble_crossings = result["early_exit_threshold_crossings"], result["ensemble_threshold_crossings"]
+        print(f"band [{result['uncertain_low']}, {result['uncertain_high']}]: avoided {result['gpt_calls_avoided']} Chat-GPT calls " \
+              f"({result['gpt_calls_avoided_fraction']:.2%}); accuracy {result['early_exit_accuracy']:.4f} " \
+              f"vs ensemble {result['ensemble_accuracy']:.4f}, agreement with ensemble_preds.csv {result['agreement_with_ensemble']:.2%}; " \
+              f"scores >= {MODERATE_DISINFO_PROB_THRESHOLD} {early_exit_crossings['moderate']} vs {ensemble_crossings['moderate']}, " \
+              f"> {VERY_HIGH_DISINFO_PROB_THRESHOLD} {early_exit_crossings['very_high']} vs {ensemble_crossings['very_high']}; " \
+              f"{'passes' if result['passes_gate'] else 'fails'} the gate")
+
+    passing = [result for result in results if result["passes_gate"]]
+    if passing:
+        best = max(passing, key = lambda result: result["gpt_calls_avoided"])
+        print(f"widest band that passes the gate: [{best['uncertain_low']}, {best['uncertain_high']}]")
+    else:
+        print("no band passes the gate; consider GPT_EARLY_EXIT_ENABLED = False")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent = 2)
@@ -0,0 +1,63 @@
+# file for combining the Chat-GPT and BERT predictions with the ensemble model in a single vectorized step
+import numpy as np
+import warnings
+
+# the ensemble model's inputs (in the order it was trained on) only ever take these values,
+# apart from the no-prediction label for Chat-GPT, which falls back to BERT's prediction and score
+GPT_PRED_VALUES = np.array([0, 0.5, 1])
+BERT_PRED_VALUES = np.array([0, 1])
+DEFAULT_NO_GPT_PRED_NUM_LABEL = -1
+
+
+class EnsembleCombiner:
+    '''
+    Compiles the ensemble model into a lookup table over every (gpt_pred, bert_pred) pair when it's created,
+    so combining a batch is a handful of array operations. Inputs outside the table go through the model itself.
+    '''
+
+    def __init__(self, ensemble_model, no_gpt_pred_num_label = DEFAULT_NO_GPT_PRED_NUM_LABEL):
+        self.ensemble_model = ensemble_model
+        self.no_gpt_pred_num_label = no_gpt_pred_num_label
+
+        grid = np.array([[gpt_pred, bert_pred] for gpt_pred in GPT_PRED_VALUES for bert_pred in BERT_PRED_VALUES])
+        grid_preds, grid_scores = self.model_preds_and_scores(grid)
+        self.lookup_preds = grid_preds.reshape(len(GPT_PRED_VALUES), len(BERT_PRED_VALUES))
+        self.lookup_scores = grid_scores.reshape(len(GPT_PRED_VALUES), len(BERT_PRED_VALUES))
+
+    def model_preds_and_scores(self, ensemble_inputs):
+        with warnings.catch_warnings():
+            # the model was fit on a DataFrame, so sklearn warns that these arrays have no feature names
+            warnings.simplefilter("ignore", UserWarning)
+            return self.ensemble_model.predict(ensemble_inputs), self.ensemble_model.predict_proba(ensemble_inputs)[:, 1]
+
+    def combine(self, gpt_preds, bert_preds, bert_scores):
+        gpt_preds = np.asarray(gpt_preds, dtype=float)
+        bert_preds = np.asarray(bert_preds, dtype=float)
+        bert_scores = np.asarray(bert_scores, dtype=float)
+
+        # messages without a Chat-GPT prediction keep BERT's prediction and score
+        preds = bert_preds.copy()
+        scores = bert_scores.copy()
+
+        has_gpt_pred = gpt_preds != self.no_gpt_pred_num_label
+        gpt_idxs = np.searchsorted(GPT_PRED_VALUES, gpt_preds).clip(0, len(GPT_PRED_VALUES) - 1)
+        bert_idxs = np.searchsorted(BERT_PRED_VALUES, bert_preds).clip(0, len(BERT_PRED_VALUES) - 1)
+        in_table = has_gpt_pred & (GPT_PRED_VALUES[gpt_idxs] == gpt_preds) & (BERT_PRED_VALUES[bert_idxs] == bert_preds)
+
+        preds[in_table] = self.lookup_preds[gpt_idxs[in_table], bert_idxs[in_table]]
+        scores[in_table] = self.lookup_scores[gpt_idxs[in_table], bert_idxs[in_table]]
+
+        # anything else (e.g. continuous features) goes through the model, still as a single batch
+        off_table = has_gpt_pred & ~in_table
+        if np.any(off_table):
+            preds[off_table], scores[off_table] = self.model_preds_and_scores(np.column_stack([gpt_preds[off_table], bert_preds[off_table]]))
+
+        return preds.astype(int), scores
+
+    def expected_preds_and_scores(self, gpt_label_probs, bert_preds):
+        # for messages Chat-GPT was never asked about: the table's score averaged over how likely each Chat-GPT label is,
+        # given as one row of probabilities (in GPT_PRED_VALUES order) per message
+        gpt_label_probs = np.asarray(gpt_label_probs, dtype=float).reshape(-1, len(GPT_PRED_VALUES))
+        bert_idxs = np.searchsorted(BERT_PRED_VALUES, np.asarray(bert_preds, dtype=float)).clip(0, len(BERT_PRED_VALUES) - 1)
+        scores = np.sum(gpt_label_probs * self.lookup_scores[:, bert_idxs].T, axis=1)
+        return (scores >= 0.5).astype(int), scores
@@ -0,0 +1,82 @@
+# file for a local fake of the chat-completions API, used by benchmark.py and the tests of the Chat-GPT requests in automated.py
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import time
+
+
+def reply_real(text, attempt):
+    return 200, "real"
+
+
+class FakeChatCompletionsHandler(BaseHTTPRequestHandler):
+    # answers each chat completion with the server's reply_fn(text, attempt) after its injected latency
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        text = request["messages"][-1]["content"]
+        server = self.server
+        with server.lock:
+            attempt = server.attempts.get(text, 0)
+            server.attempts[text] = attempt + 1
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+        try:
+            time.sleep(server.latency_seconds)
+            status, content = server.reply_fn(text, attempt)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+
+        if status == 200:
+            body = {
+                "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()), "model": request.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 1, "total_tokens": 1},
+            }
+        else:
+            body = {"error": {"message": content, "type": "fake_error", "param": None, "code": None}}
+        body = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeChatCompletionsServer:
+    '''
+    A local stand-in for the chat-completions API; point openai.api_base at api_base while it runs. reply_fn(text, attempt)
+    returns the (HTTP status, content) to answer the attempt-th request about text with (an error message unless the
+    status is 200). It also counts the attempts per text and the most requests it has had in flight at once.
+    '''
+
+    def __init__(self, latency_seconds: float, reply_fn = reply_real):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeChatCompletionsHandler)
+        self.server.daemon_threads = True
+        self.server.latency_seconds = latency_seconds
+        self.server.reply_fn = reply_fn
+        self.server.lock = threading.Lock()
+        self.server.attempts = {} # text -> number of requests about it
+        self.server.in_flight = 0
+        self.server.max_in_flight = 0
+        self.api_base = f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+        self.thread = threading.Thread(target = self.server.serve_forever, daemon = True)
+
+    @property
+    def attempts(self):
+        return self.server.attempts
+
+    @property
+    def max_in_flight(self):
+        return self.server.max_in_flight
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
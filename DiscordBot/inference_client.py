@@ -0,0 +1,110 @@
+# file for scoring messages with a classifier served by inference_server.py instead of one loaded in the bot process
+import asyncio
+import json
+import logging
+import math
+import time
+
+logger = logging.getLogger('discord')
+
+DEFAULT_READY_TIMEOUT_SECONDS = 600.0 # how long initialize waits for the server to load its models
+DEFAULT_MAX_CONCURRENT_REQUESTS = 4
+READY_POLL_INTERVAL_SECONDS = 2.0
+READY_REQUEST_TIMEOUT_SECONDS = 5.0
+
+
+class InferenceClient:
+    '''
+    A drop-in for InferenceExecutor that sends each batch to an inference server on this machine, so several bot
+    processes or shards can share one pool of models. A request that fails or times out is scored by
+    fallback_executor (e.g. an InferenceExecutor in this process) if one is given, and raises otherwise.
+    Unless timeout_seconds is given, each request may take as long as its texts could take on the server in the worst case:
+    waiting behind the texts already pending there, in rounds of the server's concurrent batches, each round allowing for
+    the batch to fill and for every Chat-GPT request being throttled and retried (see score_timeout_seconds).
+    '''
+
+    def __init__(self, host: str, port: int, timeout_seconds: float = None, ready_timeout_seconds: float = DEFAULT_READY_TIMEOUT_SECONDS,
+                 max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS, fallback_executor = None):
+        self.host = host
+        self.port = port
+        self.timeout_seconds = timeout_seconds
+        self.server_limits = None # the server's batching limits and worst-case batch time, from /ready
+        self.server_pending_texts = 0 # texts pending on the server as of its last reply
+        self.texts_in_flight = 0 # texts this client has sent that the server hasn't answered yet
+        self.ready_timeout_seconds = ready_timeout_seconds
+        self.num_workers = max_concurrent_requests # how many batches the bot's InferenceBatcher keeps in flight
+        self.fallback_executor = fallback_executor
+
+    async def request(self, method, path, body = None):
+        # one request per connection, which on localhost costs far less than scoring the batch
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            payload = json.dumps(body).encode("utf-8") if body is not None else b""
+            writer.write(f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode("ascii") + payload)
+            await writer.drain()
+
+            status = int((await reader.readline()).split()[1])
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            return status, json.loads(await reader.read())
+        finally:
+            writer.close()
+
+    async def initialize(self):
+        # waits for the server to have loaded its models and returns their per-stage loading timings, like InferenceExecutor.initialize
+        deadline = time.monotonic() + self.ready_timeout_seconds
+        while True:
+            try:
+                status, body = await asyncio.wait_for(self.request("GET", "/ready"), READY_REQUEST_TIMEOUT_SECONDS)
+                if status == 200:
+                    self.server_limits = body
+                    self.server_pending_texts = body["pending_texts"]
+                    logger.info(f"Inference server at {self.host}:{self.port} is ready, a single text times out after {self.score_timeout_seconds(1):.0f}s while it's idle")
+                    return body["stage_seconds"]
+            except (OSError, ValueError, asyncio.TimeoutError):
+                pass
+
+            if time.monotonic() >= deadline:
+                if self.fallback_executor is not None:
+                    logger.warning(f"Inference server at {self.host}:{self.port} isn't ready after {self.ready_timeout_seconds:.0f}s, loading the classifier locally")
+                    return await self.fallback_executor.initialize()
+                raise Exception(f"Inference server at {self.host}:{self.port} isn't ready after {self.ready_timeout_seconds:.0f}s")
+            await asyncio.sleep(READY_POLL_INTERVAL_SECONDS)
+
+    def score_timeout_seconds(self, num_texts):
+        if self.timeout_seconds is not None:
+            return self.timeout_seconds
+        if self.server_limits is None:
+            # the server never became ready, so requests are expected to fail fast and fall back
+            return self.ready_timeout_seconds
+        texts_per_round = self.server_limits["max_batch_size"] * self.server_limits["max_concurrent_batches"]
+        texts_ahead = max(self.server_pending_texts, self.texts_in_flight)
+        num_rounds = math.ceil(texts_ahead / texts_per_round) + math.ceil(num_texts / texts_per_round)
+        return num_rounds * (self.server_limits["max_wait_seconds"] + self.server_limits["worst_case_batch_seconds"])
+
+    async def score_on_server(self, text_inputs):
+        timeout_seconds = self.score_timeout_seconds(len(text_inputs))
+        self.texts_in_flight += len(text_inputs)
+        try:
+            status, body = await asyncio.wait_for(self.request("POST", "/score", {"texts": text_inputs}), timeout_seconds)
+        finally:
+            self.texts_in_flight -= len(text_inputs)
+        if status != 200:
+            raise Exception(f"Inference server answered {status}: {body.get('error')}")
+        self.server_pending_texts = body["pending_texts"]
+        return body["preds"], body["scores"]
+
+    async def generate_ensemble_preds_and_scores(self, text_inputs):
+        text_inputs = list(text_inputs)
+        try:
+            return await self.score_on_server(text_inputs)
+        except Exception:
+            if self.fallback_executor is None:
+                raise
+            logger.warning(f"Inference server request failed, scoring {len(text_inputs)} messages locally", exc_info = True)
+            return await self.fallback_executor.generate_ensemble_preds_and_scores(text_inputs)
+
+    def shutdown(self):
+        if self.fallback_executor is not None:
+            self.fallback_executor.shutdown()
@@ -0,0 +1,104 @@
+# file for running the classifier pipeline in automated.py off of the discord event loop
+import asyncio
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import logging
+import multiprocessing
+import os
+
+logger = logging.getLogger('discord')
+
+# "process" loads the models once in each worker of a process pool, "thread" loads them once in the bot process
+# and runs the pipeline on a single background thread
+INFERENCE_EXECUTOR_MODE_PROCESS = "process"
+INFERENCE_EXECUTOR_MODE_THREAD = "thread"
+
+DEFAULT_NUM_WORKERS = 1
+
+
+def default_torch_num_threads(num_workers):
+    # split the machine's cores evenly between the workers so they don't oversubscribe the CPU
+    return max(1, (os.cpu_count() or 1) // max(1, num_workers))
+
+
+def init_inference_worker(torch_num_threads):
+    # runs once per worker before it takes any jobs, so no message is ever scored by a cold worker
+    import torch
+    torch.set_num_threads(torch_num_threads)
+    import automated
+    automated.initialize()
+
+
+def initialize_inference_worker():
+    import automated
+    return automated.initialize()
+
+
+def run_ensemble_preds_and_scores(text_inputs):
+    import automated
+    preds, scores = automated.generate_ensemble_preds_and_scores(text_inputs)
+    # hand back plain python values so the results are cheap to send between processes,
+    # along with how long each pipeline stage took in this worker and its verdict cache hits and misses
+    return [int(pred) for pred in preds], [float(score) for score in scores], automated.drain_stage_seconds(), automated.verdict_cache.drain_counts()
+
+
+class InferenceExecutor:
+    '''
+    Runs generate_ensemble_preds_and_scores in worker processes (or a worker thread) so that the blocking
+    BERT forward pass, Chat-GPT requests and translation calls never run on the discord event loop.
+    '''
+
+    def __init__(self, mode: str = INFERENCE_EXECUTOR_MODE_PROCESS, num_workers: int = DEFAULT_NUM_WORKERS, torch_num_threads: int = None,
+                 stage_histogram = None, verdict_cache_hit_counter = None, verdict_cache_miss_counter = None):
+        if mode not in (INFERENCE_EXECUTOR_MODE_PROCESS, INFERENCE_EXECUTOR_MODE_THREAD):
+            raise Exception(f"Unknown inference executor mode {mode}, expected \"{INFERENCE_EXECUTOR_MODE_PROCESS}\" or \"{INFERENCE_EXECUTOR_MODE_THREAD}\".")
+        self.mode = mode
+        self.num_workers = num_workers if mode == INFERENCE_EXECUTOR_MODE_PROCESS else 1
+        self.torch_num_threads = torch_num_threads if torch_num_threads else default_torch_num_threads(self.num_workers)
+        self.stage_histogram = stage_histogram # optional metrics.Histogram labelled by pipeline stage
+        self.verdict_cache_hit_counter = verdict_cache_hit_counter # optional metrics.Counters, summed over the workers' verdict caches
+        self.verdict_cache_miss_counter = verdict_cache_miss_counter
+        self.executor = None
+
+    def start(self):
+        if self.executor is not None:
+            return
+
+        if self.mode == INFERENCE_EXECUTOR_MODE_PROCESS:
+            # spawn rather than fork, since forking a process that already runs the discord client's threads is unsafe
+            self.executor = ProcessPoolExecutor(max_workers = self.num_workers,
+                                                mp_context = multiprocessing.get_context("spawn"),
+                                                initializer = init_inference_worker,
+                                                initargs = (self.torch_num_threads,))
+        else:
+            self.executor = ThreadPoolExecutor(max_workers = 1,
+                                               thread_name_prefix = "inference",
+                                               initializer = init_inference_worker,
+                                               initargs = (self.torch_num_threads,))
+        logger.info(f"Started {self.mode} inference executor with {self.num_workers} worker(s) and {self.torch_num_threads} torch thread(s) each")
+
+    async def initialize(self):
+        # starts the workers, which load and warm up the models, and returns the per-stage timings of the first one.
+        # Workers are spawned as jobs arrive, so the first one builds any missing model files (e.g. the first-stage
+        # model, or the ONNX export) on its own before the others start and load them
+        self.start()
+        loop = asyncio.get_running_loop()
+        stage_timings = await loop.run_in_executor(self.executor, initialize_inference_worker)
+        await asyncio.gather(*[loop.run_in_executor(self.executor, initialize_inference_worker) for _ in range(self.num_workers - 1)])
+        return stage_timings
+
+    async def generate_ensemble_preds_and_scores(self, text_inputs):
+        self.start()
+        loop = asyncio.get_running_loop()
+        preds, scores, stage_seconds, (cache_hits, cache_misses) = await loop.run_in_executor(self.executor, run_ensemble_preds_and_scores, list(text_inputs))
+        if self.stage_histogram is not None:
+            for stage_name, seconds in stage_seconds:
+                self.stage_histogram.observe(seconds, stage_name)
+        if self.verdict_cache_hit_counter is not None:
+            self.verdict_cache_hit_counter.inc(cache_hits)
+            self.verdict_cache_miss_counter.inc(cache_misses)
+        return preds, scores
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait = False, cancel_futures = True)
+            self.executor = None
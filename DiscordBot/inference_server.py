@@ -0,0 +1,176 @@
+# file for serving the classifier pipeline in automated.py over localhost HTTP, so that any number of bot processes
+# or shards share one pool of models instead of each loading its own, e.g.
+# python inference_server.py --port 9109 --num-workers 2
+#
+# POST /score   {"texts": [...]} -> {"preds": [...], "scores": [...], "pending_texts": n}, aligned with texts
+# GET  /health  200 while the server is up
+# GET  /ready   200 with the model loading stage timings and what clients need to time out /score requests (the worst-case time
+#               to score a batch, how batches are formed and how many texts are pending) once the models are loaded, 503 until then
+# GET  /metrics Prometheus text metrics
+import argparse
+import asyncio
+import json
+import logging
+import time
+from batcher import InferenceBatcher
+from inference_executor import InferenceExecutor, INFERENCE_EXECUTOR_MODE_PROCESS, INFERENCE_EXECUTOR_MODE_THREAD, DEFAULT_NUM_WORKERS
+from metrics import MetricsRegistry
+
+logger = logging.getLogger('discord')
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 9109
+DEFAULT_MAX_BATCH_SIZE = 32 # texts from every client are batched together, so batches can be larger than a single bot's
+DEFAULT_MAX_WAIT_SECONDS = 0.02
+MAX_REQUEST_BODY_BYTES = 1 << 20
+MAX_TEXTS_PER_REQUEST = 256
+
+HTTP_STATUS_LINES = {200: "200 OK", 400: "400 Bad Request", 404: "404 Not Found", 413: "413 Payload Too Large",
+                     500: "500 Internal Server Error", 503: "503 Service Unavailable"}
+
+
+class InferenceServer:
+    '''
+    Scores the texts posted to /score with an InferenceExecutor. Every text is queued on one InferenceBatcher, so texts
+    from concurrent requests (e.g. from different shards) are scored in the same pipeline pass. /ready only answers 200
+    once every worker has loaded and warmed up the models, and /score is refused with a 503 until then.
+    '''
+
+    def __init__(self, mode: str = INFERENCE_EXECUTOR_MODE_PROCESS, num_workers: int = DEFAULT_NUM_WORKERS, torch_num_threads: int = None,
+                 max_batch_size: int = DEFAULT_MAX_BATCH_SIZE, max_wait_seconds: float = DEFAULT_MAX_WAIT_SECONDS):
+        self.metrics = MetricsRegistry()
+        self.request_latency_histogram = self.metrics.histogram("inference_server_score_request_seconds", "Time from a /score request arriving to its reply.")
+        self.texts_scored_counter = self.metrics.counter("inference_server_texts_scored_total", "Texts scored for clients.")
+        verdict_cache_hit_counter = self.metrics.counter("inference_server_verdict_cache_hits_total", "Texts whose verdict the workers found in their verdict cache.")
+        verdict_cache_miss_counter = self.metrics.counter("inference_server_verdict_cache_misses_total", "Texts the workers had to score for lack of a cached verdict.")
+        self.metrics.gauge("inference_server_verdict_cache_hit_rate", "Share of verdict cache lookups that were hits, since start-up.",
+                           lambda: verdict_cache_hit_counter.value / max(1, verdict_cache_hit_counter.value + verdict_cache_miss_counter.value))
+        self.executor = InferenceExecutor(mode = mode, num_workers = num_workers, torch_num_threads = torch_num_threads,
+                                          stage_histogram = self.metrics.histogram("inference_server_pipeline_stage_seconds", "Time spent in each classifier pipeline stage per batch.", "stage"),
+                                          verdict_cache_hit_counter = verdict_cache_hit_counter, verdict_cache_miss_counter = verdict_cache_miss_counter)
+        self.batcher = InferenceBatcher(self.executor.generate_ensemble_preds_and_scores,
+                                        max_batch_size = max_batch_size,
+                                        max_wait_seconds = max_wait_seconds,
+                                        max_concurrent_batches = self.executor.num_workers)
+        self.metrics.gauge("inference_server_queue_depth", "Texts waiting to join a batch.", lambda: self.batcher.queue.qsize() if self.batcher.queue else 0)
+        self.metrics.gauge("inference_server_batches_in_flight", "Batches being scored.", lambda: len(self.batcher.batch_tasks))
+        self.max_batch_size = max_batch_size
+        self.max_wait_seconds = max_wait_seconds
+        self.stage_timings = None # set once the models are loaded
+        self.initialization_error = None
+
+    async def initialize(self):
+        start_time = time.perf_counter()
+        try:
+            self.stage_timings = await self.executor.initialize()
+        except Exception as e:
+            logger.exception("Failed to load the classifier")
+            self.initialization_error = repr(e)
+            return
+        logger.info(f"Classifier ready {time.perf_counter() - start_time:.2f}s after start-up")
+
+    async def score(self, body):
+        if self.stage_timings is None:
+            return 503, {"error": "the classifier isn't loaded yet"}
+        texts = body.get("texts") if isinstance(body, dict) else None
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            return 400, {"error": "expected {\"texts\": [...]} with a list of strings"}
+        if len(texts) > MAX_TEXTS_PER_REQUEST:
+            return 413, {"error": f"at most {MAX_TEXTS_PER_REQUEST} texts per request"}
+
+        start_time = time.perf_counter()
+        try:
+            results = await asyncio.gather(*[self.batcher.score(text) for text in texts])
+        except Exception as e:
+            logger.exception(f"Failed to score a batch of {len(texts)} texts")
+            return 500, {"error": repr(e)}
+        self.request_latency_histogram.observe(time.perf_counter() - start_time)
+        self.texts_scored_counter.inc(len(texts))
+        return 200, {"preds": [int(pred) for pred, _ in results], "scores": [float(score) for _, score in results], "pending_texts": self.batcher.num_pending}
+
+    async def route(self, method, path, body):
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+        if method == "GET" and path == "/ready":
+            if self.stage_timings is None:
+                return 503, {"ready": False, "error": self.initialization_error}
+            # what clients need to work out how long a /score request may take: its texts may wait behind the pending ones,
+            # in rounds of max_concurrent_batches full batches that each take up to max_wait_seconds to fill and the worst case to score
+            import automated
+            return 200, {"ready": True, "stage_seconds": self.stage_timings, "worst_case_batch_seconds": automated.worst_case_batch_seconds(self.max_batch_size),
+                         "max_batch_size": self.max_batch_size, "max_wait_seconds": self.max_wait_seconds,
+                         "max_concurrent_batches": self.batcher.max_concurrent_batches, "pending_texts": self.batcher.num_pending}
+        if method == "POST" and path == "/score":
+            return await self.score(body)
+        return 404, {"error": "try POST /score, GET /health, GET /ready or GET /metrics"}
+
+    async def handle_http_request(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            content_length = "0"
+            while True:
+                header = await reader.readline()
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    content_length = value.strip()
+            if len(request_line) < 2:
+                return
+            method, path = request_line[0], request_line[1]
+
+            if path == "/metrics":
+                status, body, content_type = 200, self.metrics.render().encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8"
+            else:
+                try:
+                    content_length = int(content_length)
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    status, reply = 400, {"error": "the Content-Length header isn't a valid length"}
+                elif content_length > MAX_REQUEST_BODY_BYTES:
+                    status, reply = 413, {"error": f"request bodies are limited to {MAX_REQUEST_BODY_BYTES} bytes"}
+                else:
+                    try:
+                        request_body = json.loads(await reader.readexactly(content_length)) if content_length else None
+                        status, reply = await self.route(method, path, request_body)
+                    except ValueError:
+                        status, reply = 400, {"error": "the request body isn't valid JSON"}
+                body, content_type = json.dumps(reply).encode("utf-8"), "application/json"
+
+            writer.write(f"HTTP/1.1 {HTTP_STATUS_LINES[status]}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        # bound to localhost by default; the models load in the background, while /health already answers
+        server = await asyncio.start_server(self.handle_http_request, host, port)
+        logger.info(f"Serving the classifier on http://{host}:{port}")
+        initialization_task = asyncio.create_task(self.initialize())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            initialization_task.cancel()
+            self.executor.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Serve the classifier pipeline to the bot processes on this machine.")
+    parser.add_argument("--host", default = DEFAULT_HOST)
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT)
+    parser.add_argument("--mode", choices = [INFERENCE_EXECUTOR_MODE_PROCESS, INFERENCE_EXECUTOR_MODE_THREAD], default = INFERENCE_EXECUTOR_MODE_PROCESS)
+    parser.add_argument("--num-workers", type = int, default = DEFAULT_NUM_WORKERS, help = "inference worker processes, each with its own copy of the models")
+    parser.add_argument("--torch-num-threads", type = int, default = None, help = "torch threads per worker; by default the CPU cores are split evenly between workers")
+    parser.add_argument("--max-batch-size", type = int, default = DEFAULT_MAX_BATCH_SIZE)
+    parser.add_argument("--max-wait-seconds", type = float, default = DEFAULT_MAX_WAIT_SECONDS)
+    args = parser.parse_args()
+
+    logging.basicConfig(level = logging.INFO, format = '%(asctime)s:%(levelname)s:%(name)s: %(message)s')
+    server = InferenceServer(mode = args.mode, num_workers = args.num_workers, torch_num_threads = args.torch_num_threads,
+                             max_batch_size = args.max_batch_size, max_wait_seconds = args.max_wait_seconds)
+    asyncio.run(server.serve(args.host, args.port))
@@ -0,0 +1,149 @@
+# file for the bot's counters, gauges and latency histograms, exposed in the Prometheus text format
+# either over a local HTTP endpoint (e.g. curl localhost:9108/metrics) or as a snapshot file that is rewritten periodically
+import asyncio
+import logging
+import os
+import threading
+
+logger = logging.getLogger('discord')
+
+# upper bounds (in seconds) of the latency histogram buckets; the last bucket is always +Inf
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def format_labels(label_name, label_value, extra_labels = ""):
+    labels = [f'{label_name}="{label_value}"'] if label_name is not None else []
+    if extra_labels:
+        labels.append(extra_labels)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self.lock:
+            self.value += amount
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter", f"{self.name} {self.value}"]
+
+
+class Gauge:
+    '''
+    A gauge whose value is read from value_fn whenever the metrics are rendered, so it never goes stale.
+    '''
+
+    def __init__(self, name: str, help_text: str, value_fn):
+        self.name = name
+        self.help_text = help_text
+        self.value_fn = value_fn
+
+    def render(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {self.value_fn()}"]
+
+
+class Histogram:
+    '''
+    Fixed-bucket histogram, optionally split by the value of a single label (e.g. one series per pipeline stage).
+    Observing is a bucket search and a few additions, so it's cheap enough for the hot path.
+    '''
+
+    def __init__(self, name: str, help_text: str, label_name: str = None, buckets = DEFAULT_LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.buckets = tuple(sorted(buckets))
+        self.series = {} # label value -> [per-bucket counts (the last one is +Inf), sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, label_value: str = None):
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            bucket_idx = next((idx for idx, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            series[0][bucket_idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for label_value, (bucket_counts, total, count) in sorted(self.series.items(), key = lambda item: str(item[0])):
+                # Prometheus buckets are cumulative
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), bucket_counts):
+                    cumulative += bucket_count
+                    le_label = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                    lines.append(f"{self.name}_bucket{format_labels(self.label_name, label_value, le_label)} {cumulative}")
+                lines.append(f"{self.name}_sum{format_labels(self.label_name, label_value)} {total}")
+                lines.append(f"{self.name}_count{format_labels(self.label_name, label_value)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str):
+        return self.register(Counter(name, help_text))
+
+    def gauge(self, name: str, help_text: str, value_fn):
+        return self.register(Gauge(name, help_text, value_fn))
+
+    def histogram(self, name: str, help_text: str, label_name: str = None, buckets = DEFAULT_LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, label_name, buckets))
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write_snapshot(self, snapshot_file: str):
+        # write then rename, so a reader never sees a half-written snapshot
+        tmp_file = snapshot_file + ".tmp"
+        with open(tmp_file, "w") as f:
+            f.write(self.render())
+        os.replace(tmp_file, snapshot_file)
+
+    async def write_snapshots(self, snapshot_file: str, interval_seconds: float):
+        while True:
+            try:
+                self.write_snapshot(snapshot_file)
+            except OSError:
+                logger.exception(f"Failed to write the metrics snapshot to {snapshot_file}")
+            await asyncio.sleep(interval_seconds)
+
+    async def handle_http_request(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # the headers aren't needed, but have to be read before replying
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+
+            if request_line.split()[1:2] == [b"/metrics"]:
+                status, body = "200 OK", self.render().encode("utf-8")
+            else:
+                status, body = "404 Not Found", b"Not found, try /metrics\n"
+            writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        # a minimal HTTP endpoint for a Prometheus scraper, bound to localhost by default
+        server = await asyncio.start_server(self.handle_http_request, host, port)
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        async with server:
+            await server.serve_forever()
@@ -0,0 +1,100 @@
+# file for the queue of open reports that moderators pull from with the `next` command
+import heapq
+import itertools
+
+DEFAULT_USER_REPORT_DISINFO_PROB = 0.5 # user reports have no classifier score, so they're ranked as if they had this one
+DEFAULT_AGING_PRIORITY_PER_HOUR = 0.5 # every hour a report waits adds this much within its severity tier, so low-scored reports aren't starved
+
+REMOVED = None # marks a heap entry whose report has been claimed or closed
+MIN_REMOVED_ENTRIES_TO_COMPACT = 1024
+
+
+class ModeratorQueue:
+    '''
+    Priority queue of open reports: every high severity report (tagged HIGH_PRIORITY_TAG) comes before every other one,
+    and within each of the two tiers reports are ranked by disinfo probability, with an aging boost that grows with the
+    time a report has waited. Aging never lifts a report out of its tier. Every report ages at the same rate, so a
+    report's place relative to the others in its tier only depends on (disinfo probability - aging rate * creation time),
+    and the heap never has to be re-sorted.
+    Claiming runs without awaiting, so on the bot's event loop two moderators can never claim the same report.
+    Pushing and claiming are O(log n); closed reports are dropped lazily when they reach the top of the heap.
+    '''
+
+    def __init__(self, user_report_disinfo_prob: float = DEFAULT_USER_REPORT_DISINFO_PROB, aging_priority_per_hour: float = DEFAULT_AGING_PRIORITY_PER_HOUR):
+        self.user_report_disinfo_prob = user_report_disinfo_prob
+        self.aging_priority_per_second = aging_priority_per_hour / 3600
+        self.heap = [] # [negated severity tier, negated priority key within the tier, creation time, tie breaker, report id or REMOVED]
+        self.entries = {} # report id -> its heap entry, for the reports waiting in the queue
+        self.claimed = {} # report id -> (moderator id, heap entry to restore if the claim is released)
+        self.counter = itertools.count()
+        self.num_removed = 0 # heap entries marked REMOVED but not yet popped
+
+    def __len__(self):
+        return len(self.entries)
+
+    def priority_key(self, disinfo_prob: float, created_at: float):
+        base_priority = self.user_report_disinfo_prob if disinfo_prob is None else disinfo_prob
+        return base_priority - self.aging_priority_per_second * created_at
+
+    def push(self, record):
+        # record is a ReportRecord (or anything with report_id, high_severity, disinfo_prob and created_at)
+        self.add(record.report_id, record.high_severity, record.disinfo_prob, record.created_at)
+
+    def add(self, report_id: int, high_severity: bool, disinfo_prob: float, created_at: float):
+        # only the report's id and what it's ranked by are kept
+        if report_id in self.entries or report_id in self.claimed:
+            return
+        entry = [-int(bool(high_severity)), -self.priority_key(disinfo_prob, created_at), created_at, next(self.counter), report_id]
+        self.entries[report_id] = entry
+        heapq.heappush(self.heap, entry)
+
+    def claim(self, moderator_id):
+        # returns the id of the most urgent open report, now claimed by moderator_id, or None if there are none
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            report_id = entry[-1]
+            if report_id is REMOVED:
+                self.num_removed -= 1
+            else:
+                del self.entries[report_id]
+                self.claimed[report_id] = (moderator_id, entry[:-1] + [report_id])
+                return report_id
+        return None
+
+    def claim_report(self, report_id, moderator_id):
+        # claims a report by its id; False if another moderator has already claimed it
+        if report_id in self.claimed:
+            return self.claimed[report_id][0] == moderator_id
+        entry = self.entries.pop(report_id, None)
+        if entry is not None:
+            self.claimed[report_id] = (moderator_id, entry[:-1] + [report_id])
+            self.mark_removed(entry)
+        return True
+
+    def release(self, report_id):
+        # puts a claimed report back in the queue (e.g. the moderator cancelled their response), in its original place
+        claim = self.claimed.pop(report_id, None)
+        if claim is not None:
+            entry = claim[1]
+            self.entries[report_id] = entry
+            heapq.heappush(self.heap, entry)
+
+    def complete(self, report_id):
+        # the report has been responded to and leaves the queue for good
+        self.claimed.pop(report_id, None)
+        entry = self.entries.pop(report_id, None)
+        if entry is not None:
+            self.mark_removed(entry)
+
+    def mark_removed(self, entry):
+        entry[-1] = REMOVED
+        self.num_removed += 1
+        # rebuild the heap once most of it is dead entries, so it stays proportional to the open reports
+        if self.num_removed > MIN_REMOVED_ENTRIES_TO_COMPACT and self.num_removed > len(self.entries):
+            self.heap = [entry for entry in self.heap if entry[-1] is not REMOVED]
+            heapq.heapify(self.heap)
+            self.num_removed = 0
+
+    def claimed_by(self, report_id):
+        claim = self.claimed.get(report_id)
+        return claim[0] if claim else None
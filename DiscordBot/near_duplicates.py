@@ -0,0 +1,125 @@
+# file for finding near-duplicates (e.g. reposts with an edited link, emoji or hashtag) of messages that have already been reported
+from collections import OrderedDict, defaultdict
+import hashlib
+import random
+import re
+
+DEFAULT_NUM_PERMUTATIONS = 64 # length of each MinHash signature
+DEFAULT_NUM_BANDS = 16 # LSH bands; with 4 rows per band, pairs above ~0.5 similarity usually become candidates
+DEFAULT_SIMILARITY_THRESHOLD = 0.8 # minimum estimated Jaccard similarity for a candidate to count as a near-duplicate
+DEFAULT_MAX_ENTRIES = 100000 # oldest messages are dropped from the index past this size
+SHINGLE_SIZE = 5 # characters per shingle
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 32) - 1
+
+URL_REGEX = re.compile(r"https?://\S+|www\.\S+")
+NON_WORD_REGEX = re.compile(r"[^\w\s]+")
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    # links, emoji, hashtag symbols and punctuation are exactly what reposts tend to change
+    text = URL_REGEX.sub(" ", text.lower())
+    text = NON_WORD_REGEX.sub(" ", text)
+    return WHITESPACE_REGEX.sub(" ", text).strip()
+
+
+def shingle_hashes(text):
+    text = normalize_text(text)
+    if not text:
+        return set()
+    shingles = [text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))]
+    return set(int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size = 8).digest(), "big") for shingle in shingles)
+
+
+class NearDuplicateEntry:
+    __slots__ = ("key", "report_id", "disinfo_prob")
+
+    def __init__(self, key: int, report_id: int, disinfo_prob: float = None):
+        self.key = key
+        self.report_id = report_id
+        self.disinfo_prob = disinfo_prob # None if the message was reported by a user rather than scored
+
+
+class MinHashLSHIndex:
+    '''
+    Incremental MinHash-LSH index over messages. Each message's character shingles are summarized by a MinHash
+    signature, and the signature is split into bands that are hashed into buckets; messages sharing any bucket
+    are compared on their full signatures. Signatures are computed separately with signature(), which is the costly
+    part, so a message's signature can be computed once (e.g. off the event loop) to both query and add it.
+    '''
+
+    def __init__(self, num_permutations: int = DEFAULT_NUM_PERMUTATIONS, num_bands: int = DEFAULT_NUM_BANDS,
+                 similarity_threshold: float = DEFAULT_SIMILARITY_THRESHOLD, max_entries: int = DEFAULT_MAX_ENTRIES, seed: int = 1):
+        if num_permutations % num_bands:
+            raise Exception("The number of permutations must be divisible by the number of bands.")
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_permutations)]
+        self.num_bands = num_bands
+        self.rows_per_band = num_permutations // num_bands
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+
+        self.band_buckets = [defaultdict(set) for _ in range(num_bands)] # per band: band values -> keys of the messages in that bucket
+        self.signatures = OrderedDict() # key -> signature, oldest first
+        self.entries = {} # key -> NearDuplicateEntry
+        self.next_key = 0
+
+    def signature(self, text):
+        hashes = shingle_hashes(text)
+        if not hashes:
+            return None
+        return tuple(min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes) for a, b in self.permutations)
+
+    def bands(self, signature):
+        for band in range(self.num_bands):
+            yield band, signature[band * self.rows_per_band:(band + 1) * self.rows_per_band]
+
+    def add(self, signature, report_id: int, disinfo_prob: float = None):
+        if signature is None:
+            return None
+
+        key = self.next_key
+        self.next_key += 1
+        self.signatures[key] = signature
+        self.entries[key] = NearDuplicateEntry(key, report_id, disinfo_prob)
+        for band, band_values in self.bands(signature):
+            self.band_buckets[band][band_values].add(key)
+
+        while len(self.signatures) > self.max_entries:
+            self.remove(next(iter(self.signatures)))
+        return self.entries[key]
+
+    def discard(self, key):
+        if key in self.signatures:
+            self.remove(key)
+
+    def remove(self, key):
+        signature = self.signatures.pop(key)
+        self.entries.pop(key)
+        for band, band_values in self.bands(signature):
+            bucket = self.band_buckets[band][band_values]
+            bucket.discard(key)
+            if not bucket:
+                del self.band_buckets[band][band_values]
+
+    def query(self, signature):
+        # returns the most similar indexed entry at or above the similarity threshold, or None
+        if signature is None:
+            return None
+
+        candidates = set()
+        for band, band_values in self.bands(signature):
+            candidates.update(self.band_buckets[band].get(band_values, ()))
+
+        best_entry, best_similarity = None, self.similarity_threshold
+        for key in candidates:
+            other = self.signatures[key]
+            similarity = sum(1 for x, y in zip(signature, other) if x == y) / len(signature)
+            if similarity > best_similarity or (similarity == best_similarity and best_entry is None):
+                best_entry, best_similarity = self.entries[key], similarity
+        return best_entry
+
+    def __len__(self):
+        return len(self.entries)
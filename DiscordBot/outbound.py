@@ -0,0 +1,155 @@
+# file for sending the bot's messages: replies queued for the same channel or DM are merged into as few discord messages
+# as fit in the length limit, and each destination is sent to at its own rate so a slow channel doesn't hold up the others
+import asyncio
+from collections import OrderedDict, deque
+import logging
+import time
+
+logger = logging.getLogger('discord')
+
+DISCORD_MAX_MESSAGE_LENGTH = 2000
+DEFAULT_MESSAGES_PER_SECOND = 1.0 # discord allows about 5 messages every 5 seconds in a channel
+DEFAULT_BURST = 5
+DEFAULT_MAX_DESTINATIONS = 10000 # idle destinations beyond this are forgotten, oldest first
+
+
+def split_message(content: str, max_length: int = DISCORD_MAX_MESSAGE_LENGTH):
+    # splits at the last newline (or else space) that fits, and only mid-word if there is neither
+    chunks = []
+    while len(content) > max_length:
+        split_idx = content.rfind("\n", 0, max_length + 1)
+        if split_idx <= 0:
+            split_idx = content.rfind(" ", 0, max_length + 1)
+        if split_idx <= 0:
+            split_idx = max_length
+        chunks.append(content[:split_idx])
+        content = content[split_idx:].lstrip("\n ")
+    if content:
+        chunks.append(content)
+    return chunks
+
+
+def destination_key(target):
+    # a Member, a User and a StoredAuthor for the same person, and the DM channel with them, all share that person's DM
+    # rate limit, so they're keyed by the user id alone; channels (which have a type, unlike users) by the channel id
+    recipient = getattr(target, "recipient", None)
+    if recipient is not None:
+        return ("user", recipient.id)
+    if hasattr(target, "type"):
+        return ("channel", target.id)
+    return ("user", target.id)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class Destination:
+    __slots__ = ("target", "pending", "bucket", "worker_task")
+
+    def __init__(self, target, bucket: TokenBucket):
+        self.target = target # anything with an async send(content), e.g. a channel or a user
+        self.pending = deque() # (chunk, future resolved once the chunk is sent or None, on_sent callback or None)
+        self.bucket = bucket
+        self.worker_task = None
+
+
+class OutboundDispatcher:
+    '''
+    Queues messages per destination and sends them from one worker task per busy destination. Whenever a worker
+    gets a send token, it merges as many queued chunks as fit in one discord message, so consecutive replies to the
+    same channel or DM cost one request rather than one each.
+    '''
+
+    def __init__(self, max_length: int = DISCORD_MAX_MESSAGE_LENGTH, messages_per_second: float = DEFAULT_MESSAGES_PER_SECOND,
+                 burst: int = DEFAULT_BURST, max_destinations: int = DEFAULT_MAX_DESTINATIONS):
+        self.max_length = max_length
+        self.messages_per_second = messages_per_second
+        self.burst = burst
+        self.max_destinations = max_destinations
+        self.destinations = OrderedDict() # destination_key(target) -> Destination, least recently used first
+
+    def send(self, target, *contents, on_sent = None):
+        '''
+        Queues contents (in order) for target and returns immediately. The returned future resolves to True once
+        they've all been sent, or False if sending failed; the failure itself is logged, so it needn't be awaited.
+        on_sent, if given, is called with each discord message that carries any of the contents.
+        '''
+        chunks = [chunk for content in contents if content for chunk in split_message(str(content), self.max_length)]
+        future = asyncio.get_running_loop().create_future()
+        if not chunks:
+            future.set_result(True)
+            return future
+
+        destination = self.destination(target)
+        for chunk in chunks[:-1]:
+            destination.pending.append((chunk, None, on_sent))
+        destination.pending.append((chunks[-1], future, on_sent))
+
+        if destination.worker_task is None or destination.worker_task.done():
+            destination.worker_task = asyncio.get_running_loop().create_task(self.run(destination))
+        return future
+
+    def destination(self, target):
+        key = destination_key(target)
+        destination = self.destinations.get(key)
+        if destination is None:
+            # make room first, so the new destination itself can't be forgotten before its worker starts
+            self.forget_idle_destinations()
+            destination = self.destinations[key] = Destination(target, TokenBucket(self.messages_per_second, self.burst))
+        self.destinations.move_to_end(key)
+        return destination
+
+    def forget_idle_destinations(self):
+        for key in list(self.destinations):
+            if len(self.destinations) < self.max_destinations:
+                return
+            # a destination whose worker is still sending keeps its bucket, or a second worker could send past its rate limit
+            destination = self.destinations[key]
+            if not destination.pending and (destination.worker_task is None or destination.worker_task.done()):
+                del self.destinations[key]
+
+    async def run(self, destination: Destination):
+        while destination.pending:
+            await destination.bucket.acquire()
+
+            # merge the queued chunks that fit in a single message
+            content, future, on_sent = destination.pending.popleft()
+            futures = [future]
+            on_sent_callbacks = [on_sent]
+            while destination.pending and len(content) + 1 + len(destination.pending[0][0]) <= self.max_length:
+                chunk, future, on_sent = destination.pending.popleft()
+                content += "\n" + chunk
+                futures.append(future)
+                if on_sent not in on_sent_callbacks:
+                    on_sent_callbacks.append(on_sent)
+
+            try:
+                sent_message = await destination.target.send(content)
+                sent = True
+            except Exception:
+                logger.exception(f"Failed to send a message to {destination.target}")
+                sent = False
+
+            if sent:
+                for on_sent in on_sent_callbacks:
+                    if on_sent is not None:
+                        on_sent(sent_message)
+
+            for future in futures:
+                if future is not None and not future.done():
+                    future.set_result(sent)
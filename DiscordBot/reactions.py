@@ -30,4 +30,15 @@ class EmojiOption:
     def __init__(self, emoji: str, option_str: str = None, action: ModeratorAction = None):
         self.emoji = emoji
         self.option_str = option_str
-        self.action = action
\ No newline at end of file
+        self.action = action
+
+def actions_to_bitmask(actions):
+    # packs a set of ModeratorActions into one int, one bit per action; options without an action (None) are skipped
+    bitmask = 0
+    for action in actions:
+        if action is not None:
+            bitmask |= 1 << action.value
+    return bitmask
+
+def bitmask_to_actions(bitmask: int):
+    return set(action for action in ModeratorAction if bitmask & (1 << action.value))
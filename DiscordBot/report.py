@@ -1,7 +1,9 @@
 from enum import Enum, auto
 import discord
 import re
-from reactions import EmojiOption, ModeratorAction, ACTION_TO_POST_ACTION_MESSAGE
+import time
+from reactions import EmojiOption, ModeratorAction, ACTION_TO_POST_ACTION_MESSAGE, actions_to_bitmask, bitmask_to_actions
+from report_record import ReportRecord, StoredMessage, REPORT_KIND_USER, REPORT_KIND_AUTOMATED, content_snippet, message_ref
 from collections import defaultdict
 
 
@@ -120,6 +122,7 @@ MODERATE_PRIORITY_TAG = "[⚠️ MODERATE PRIORITY ⚠️]"
 
 HIGH_PRIORITY_TAG = "[🚨 HIGH PRIORITY 🚨]"
 
+
 class Report:
     START_KEYWORD = "report"
     CANCEL_KEYWORD = "cancel"
@@ -138,12 +141,22 @@ class Report:
 
         self.high_severity = False  # moderate otherwise
 
+        self.duplicate_messages = []  # near-duplicates of the reported message that were attached to this report
+        self.created_at = None  # when the report was filed, set by the ReportStore
+
+        # when the reporter last messaged or reacted, and their DM channel, so an abandoned report can be expired
+        self.last_activity = time.monotonic()
+        self.channel = None
+        self.prompt_message_ids = [] # the messages the bot sent for this report, which the reporter reacts to
+
     async def handle_message(self, message):
         '''
         This function makes up the meat of the user-side reporting flow. It defines how we transition between states and what 
         prompts to offer at each of those states. You're welcome to change anything you want; this skeleton is just here to
         get you started and give you a model for working with Discord. 
         '''
+        self.last_activity = time.monotonic()
+        self.channel = message.channel
 
         if message.content == self.CANCEL_KEYWORD:
             self.state = State.REPORT_CANCELLED
@@ -291,6 +304,7 @@ class Report:
         return ""
 
     async def handle_reaction(self, message, emoji, user):
+        self.last_activity = time.monotonic()
 
         # check this is a state with valid emoji reaction options
         if self.state in STATE_TO_EMOJI_OPTIONS:
@@ -305,6 +319,35 @@ class Report:
         # we don't need to print a message to the user immediately upon reacting
         return []
 
+    def add_duplicate_message(self, message):
+        self.duplicate_messages.append(message)
+
+    def to_record(self, report_id):
+        # the compact form a finished report is kept in by the ReportStore
+        return ReportRecord(report_id = report_id, kind = REPORT_KIND_USER,
+                            guild_id = self.message.guild.id if self.message.guild else None,
+                            channel_id = self.message.channel.id, channel_name = self.message.channel.name, message_id = self.message.id,
+                            poster_user_id = self.message.author.id, poster_name = self.message.author.name,
+                            content_snippet = content_snippet(self.message.content), created_at = self.created_at, high_severity = self.high_severity,
+                            reporter_name = self.reporter_name,
+                            selected_emojis = tuple((state.name, emoji_option.emoji) for state, emoji_options in self.state_to_selected_emoji_options.items()
+                                                    for emoji_option in emoji_options),
+                            duplicate_refs = tuple(message_ref(message) for message in self.duplicate_messages))
+
+    @classmethod
+    def from_record(cls, client, record):
+        report = cls(client, record.reporter_name)
+        report.state = State.REPORT_FINISHED
+        report.message = StoredMessage(client, record.channel_id, record.channel_name, record.message_id,
+                                       record.poster_user_id, record.poster_name, record.content_snippet)
+        for state_name, emoji in record.selected_emojis:
+            state = State[state_name]
+            report.state_to_selected_emoji_options[state].add(STATE_TO_EMOJI_OPTIONS[state][emoji])
+        report.high_severity = record.high_severity
+        report.created_at = record.created_at
+        report.duplicate_messages = [StoredMessage.from_ref(client, ref) for ref in record.duplicate_refs]
+        return report
+
     def report_cancelled(self):
         return self.state == State.REPORT_CANCELLED 
 
@@ -328,6 +371,8 @@ class Report:
         for state in self.state_to_selected_emoji_options:
             text = " AND ".join([f"{emoji_option.emoji}: {emoji_option.option_str}" for emoji_option in self.state_to_selected_emoji_options[state]])
             reply.append(f"{STATE_TO_MESSAGE_PREFIX[state]} -> {text}")
+        if len(self.duplicate_messages):
+            reply.append(f"{len(self.duplicate_messages)} near-duplicate post(s) have been attached to this report.")
         return "\n".join(reply)
 
     
@@ -345,25 +390,62 @@ class AutomatedReport:
         
         self.set_of_actions_taken = set()  # this will contain ModeratorActions
 
+        self.duplicate_messages = []  # near-duplicates of the flagged message that were attached to this report
+        self.created_at = None  # when the report was filed, set by the ReportStore
+
     async def act_on_very_high_disinfo_message(self):
+        # the actions don't depend on each other, so they're all dispatched at once
         print(f"Removing the message {self.message.content} from the general channel.")
-        await self.client.remove_reported_post(self.message)
+        actions = [self.client.remove_reported_post(self.message)]
         self.set_of_actions_taken.add(ModeratorAction.REMOVE_POST)
 
         print(f"Notifying the poster of the message, {self.message.author.name} to their transgression.")
-        await self.client.notify_poster_of_transgression(self.message)
+        actions.append(self.client.notify_poster_of_transgression(self.message))
         self.set_of_actions_taken.add(ModeratorAction.NOTIFY_POSTER_OF_TRANSGRESSION)
 
         # does the poster have a high count of existing reported posts?
-        if self.client.user_id_to_number_of_reported_posts[self.message.author.id] > self.client.USER_HIGH_REPORT_AMOUNT_THRESHOLD:
+        if self.client.report_store.count_reported_posts(self.message.author.id) > self.client.USER_HIGH_REPORT_AMOUNT_THRESHOLD:
 
             # this flag is utilized in generate_summary
             self.alert_moderator_to_high_report_user = True
 
             print(f"Temporarily muting the poster {self.message.author.name}.")
-            await self.client.temporarily_mute_user(self.message)
+            actions.append(self.client.temporarily_mute_user(self.message))
             self.set_of_actions_taken.add(ModeratorAction.TEMPORARILY_MUTE_USER)
 
+        await self.client.run_actions(*actions)
+
+    def add_duplicate_message(self, message):
+        self.duplicate_messages.append(message)
+
+    def to_record(self, report_id = None):
+        # the compact form the report is kept in by the ReportStore
+        return ReportRecord(report_id = self.report_id if report_id is None else report_id, kind = REPORT_KIND_AUTOMATED,
+                            guild_id = self.message.guild.id if self.message.guild else None,
+                            channel_id = self.message.channel.id, channel_name = self.message.channel.name, message_id = self.message.id,
+                            poster_user_id = self.message.author.id, poster_name = self.message.author.name,
+                            content_snippet = content_snippet(self.message.content), created_at = self.created_at, disinfo_prob = self.disinfo_prob,
+                            very_high_disinfo_prob = self.very_high_disinfo_prob, high_severity = self.high_severity,
+                            action_bits = actions_to_bitmask(self.set_of_actions_taken),
+                            duplicate_refs = tuple(message_ref(message) for message in self.duplicate_messages))
+
+    @classmethod
+    def from_record(cls, client, record):
+        message = StoredMessage(client, record.channel_id, record.channel_name, record.message_id,
+                                record.poster_user_id, record.poster_name, record.content_snippet)
+        report = cls(client, message, record.disinfo_prob, record.report_id, record.very_high_disinfo_prob)
+        report.set_of_actions_taken = bitmask_to_actions(record.action_bits)
+        report.created_at = record.created_at
+        report.duplicate_messages = [StoredMessage.from_ref(client, ref) for ref in record.duplicate_refs]
+        return report
+
+    async def act_on_duplicate_message(self, message):
+        # the post-level actions that were taken on the original message also apply to its near-duplicates
+        if ModeratorAction.REMOVE_POST in self.set_of_actions_taken:
+            await self.client.remove_reported_post(message)
+        if ModeratorAction.NOTIFY_POSTER_OF_TRANSGRESSION in self.set_of_actions_taken:
+            await self.client.notify_poster_of_transgression(message)
+
     def generate_summary(self):
         # based on the contents of self.state_to_selected_emoji_options (the options selected at each state by the user)
         # format a string that will be sent to the moderator channel to describe the report
@@ -387,9 +469,11 @@ class AutomatedReport:
 
 
         if self.alert_alert_moderator_to_high_report_user:
-            reply.append(f"User {self.message.author.name} is also known to have a high number of reported posts, with {self.client.user_id_to_number_of_removed_posts[self.message.author.id]} of their posts being reported.")
+            reply.append(f"User {self.message.author.name} is also known to have a high number of reported posts, with {self.client.report_store.count_reported_posts(self.message.author.id)} of their posts being reported.")
         if self.very_high_disinfo_prob:
             reply.append(f"Since this post has a very high disinformation probability, we took the actions indicated in our moderator reporting flow (shown above).")
+        if len(self.duplicate_messages):
+            reply.append(f"{len(self.duplicate_messages)} near-duplicate post(s) have been attached to this report.")
         return "\n".join(reply)
 
 
@@ -0,0 +1,126 @@
+# file for the compact form a report is kept in once it has been filed, and for the handles that stand in for its messages
+import discord
+import time
+
+CONTENT_SNIPPET_MAX_CHARS = 280 # characters of a reported message's content kept with its report
+
+REPORT_KIND_USER = "user"
+REPORT_KIND_AUTOMATED = "automated"
+
+
+class ReportRecord:
+    '''
+    Everything the bot keeps about a filed report: the IDs of the reported message, its poster and channel, a bounded
+    snippet of its content, the classifier's score and the actions taken as a ModeratorAction bitmask (see reactions.py).
+    Full discord Message objects are never kept; StoredMessage fetches what an action needs when it runs.
+    '''
+    __slots__ = ("report_id", "kind", "guild_id", "channel_id", "channel_name", "message_id", "poster_user_id", "poster_name",
+                 "content_snippet", "created_at", "disinfo_prob", "very_high_disinfo_prob", "high_severity", "action_bits",
+                 "reporter_name", "selected_emojis", "duplicate_refs")
+
+    def __init__(self, report_id: int, kind: str, guild_id: int, channel_id: int, channel_name: str, message_id: int,
+                 poster_user_id: int, poster_name: str, content_snippet: str, created_at: float = None, disinfo_prob: float = None,
+                 very_high_disinfo_prob: bool = False, high_severity: bool = False, action_bits: int = 0, reporter_name: str = None,
+                 selected_emojis: tuple = (), duplicate_refs: tuple = ()):
+        self.report_id = report_id
+        self.kind = kind
+        self.guild_id = guild_id
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.message_id = message_id
+        self.poster_user_id = poster_user_id
+        self.poster_name = poster_name
+        self.content_snippet = content_snippet
+        self.created_at = created_at if created_at is not None else time.time()
+        self.disinfo_prob = disinfo_prob
+        self.very_high_disinfo_prob = very_high_disinfo_prob
+        self.high_severity = high_severity
+        self.action_bits = action_bits
+        self.reporter_name = reporter_name
+        self.selected_emojis = selected_emojis # (state name, emoji) pairs chosen during a user report
+        self.duplicate_refs = duplicate_refs # message_ref() tuples of the near-duplicates attached to the report
+
+
+def content_snippet(content: str):
+    return content[:CONTENT_SNIPPET_MAX_CHARS]
+
+
+def message_ref(message):
+    # (channel id, message id, author id, author name, content snippet), enough to act on the message later
+    return (message.channel.id, message.id, message.author.id, message.author.name, content_snippet(message.content))
+
+
+class StoredAuthor:
+    '''
+    Stands in for the poster of a stored message; the user is only fetched from discord when they're sent a DM.
+    '''
+    __slots__ = ("client", "id", "name", "mention")
+
+    def __init__(self, client, author_id: int, name: str):
+        self.client = client
+        self.id = author_id
+        self.name = name
+        self.mention = f"<@{author_id}>"
+
+    async def send(self, content = None):
+        user = self.client.get_user(self.id) or await self.client.fetch_user(self.id)
+        return await user.send(content = content)
+
+
+class StoredChannel:
+    '''
+    Stands in for a channel the bot can no longer see; there's nowhere to send to.
+    '''
+    __slots__ = ("id", "name")
+
+    def __init__(self, channel_id: int, name: str):
+        self.id = channel_id
+        self.name = name
+
+    async def send(self, content = None):
+        return None
+
+
+class StoredMessage:
+    '''
+    Stands in for a reported message when a report is rebuilt from its ReportRecord, with the same attributes the
+    report and response flows use. Deleting it only needs the channel and message IDs, and fetch() gets the full
+    discord Message for anything else, so discord is only called when a moderator action needs the message.
+    '''
+    __slots__ = ("client", "id", "content", "channel_id", "channel_name", "author")
+
+    def __init__(self, client, channel_id: int, channel_name: str, message_id: int, author_id: int, author_name: str, content: str):
+        self.client = client
+        self.id = message_id
+        self.content = content
+        self.channel_id = channel_id
+        self.channel_name = channel_name
+        self.author = StoredAuthor(client, author_id, author_name)
+
+    @classmethod
+    def from_ref(cls, client, ref, channel_name: str = None):
+        channel_id, message_id, author_id, author_name, content = ref
+        return cls(client, channel_id, channel_name, message_id, author_id, author_name, content)
+
+    @property
+    def channel(self):
+        return self.client.get_channel(self.channel_id) or StoredChannel(self.channel_id, self.channel_name)
+
+    @property
+    def guild(self):
+        return getattr(self.channel, "guild", None)
+
+    async def fetch(self):
+        # raises discord.HTTPException (e.g. NotFound) if the message or its channel is gone
+        channel = self.client.get_channel(self.channel_id) or await self.client.fetch_channel(self.channel_id)
+        return await channel.fetch_message(self.id)
+
+    async def delete(self):
+        channel = self.client.get_channel(self.channel_id)
+        if channel is None:
+            return
+        try:
+            await channel.get_partial_message(self.id).delete()
+        except discord.NotFound:
+            # the message is already gone
+            pass
@@ -0,0 +1,160 @@
+# file for storing reports, moderator responses and channel flags in SQLite, with the most recently used report records kept in memory
+from collections import OrderedDict
+import json
+import sqlite3
+import time
+from reactions import actions_to_bitmask, bitmask_to_actions
+from report import Report, AutomatedReport
+from report_record import ReportRecord, REPORT_KIND_AUTOMATED
+
+DEFAULT_DB_FILE = "reports.db"
+DEFAULT_HOT_MAX_ENTRIES = 4096 # report records kept in memory; the rest are read from the database when they're needed
+
+# the columns of the reports table, in the order of ReportRecord's constructor arguments
+REPORT_COLUMNS = ReportRecord.__slots__
+
+
+class ReportStore:
+    '''
+    Keeps every report in SQLite (in WAL mode), along with the actions moderators took on them and the channel
+    transgression flags, so that none of it is lost on a restart and the bot's memory stays flat however long it runs.
+    Reports are kept as compact ReportRecords, and the hot_max_entries most recently used ones are cached in an LRU.
+    '''
+
+    def __init__(self, client, db_file: str = DEFAULT_DB_FILE, hot_max_entries: int = DEFAULT_HOT_MAX_ENTRIES):
+        self.client = client
+        self.hot_max_entries = hot_max_entries
+        self.hot_records = OrderedDict() # report id -> ReportRecord, least recently used first
+
+        self.db = sqlite3.connect(db_file)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS reports (report_id INTEGER PRIMARY KEY, kind TEXT, guild_id INTEGER, channel_id INTEGER, "
+                        "channel_name TEXT, message_id INTEGER, poster_user_id INTEGER, poster_name TEXT, content_snippet TEXT, created_at REAL, "
+                        "disinfo_prob REAL, very_high_disinfo_prob INTEGER, high_severity INTEGER, action_bits INTEGER, reporter_name TEXT, "
+                        "selected_emojis TEXT, duplicate_refs TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS reports_poster_user_id ON reports (poster_user_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS reports_channel_id ON reports (channel_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS reports_created_at ON reports (created_at)")
+        # one row per finished moderator response; a poster's number of reported posts is the number of their rows
+        self.db.execute("CREATE TABLE IF NOT EXISTS moderator_responses (response_id INTEGER PRIMARY KEY, report_id INTEGER, poster_user_id INTEGER, channel_id INTEGER, action_bits INTEGER, created_at REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS moderator_responses_report_id ON moderator_responses (report_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS moderator_responses_poster_user_id ON moderator_responses (poster_user_id)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS moderator_responses_channel_id ON moderator_responses (channel_id)")
+        # one row per time a moderator incremented a channel's transgression count
+        self.db.execute("CREATE TABLE IF NOT EXISTS channel_flags (channel_id INTEGER, report_id INTEGER, created_at REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS channel_flags_channel_id ON channel_flags (channel_id)")
+        self.db.commit()
+
+        # report ids carry on from where the previous run stopped
+        max_report_id, self.num_reports = self.db.execute("SELECT MAX(report_id), COUNT(*) FROM reports").fetchone()
+        self.next_report_id = 0 if max_report_id is None else max_report_id + 1
+
+    def __len__(self):
+        return self.num_reports
+
+    def allocate_report_id(self):
+        report_id = self.next_report_id
+        self.next_report_id += 1
+        return report_id
+
+    def record_to_row(self, record: ReportRecord):
+        row = [getattr(record, column) for column in REPORT_COLUMNS]
+        row[REPORT_COLUMNS.index("selected_emojis")] = json.dumps(record.selected_emojis)
+        row[REPORT_COLUMNS.index("duplicate_refs")] = json.dumps(record.duplicate_refs)
+        return row
+
+    def row_to_record(self, row):
+        record = ReportRecord(*row)
+        record.very_high_disinfo_prob = bool(record.very_high_disinfo_prob)
+        record.high_severity = bool(record.high_severity)
+        record.selected_emojis = tuple(tuple(pair) for pair in json.loads(record.selected_emojis))
+        record.duplicate_refs = tuple(tuple(ref) for ref in json.loads(record.duplicate_refs))
+        return record
+
+    def write(self, record: ReportRecord):
+        self.db.execute(f"INSERT OR REPLACE INTO reports VALUES ({', '.join('?' * len(REPORT_COLUMNS))})", self.record_to_row(record))
+        self.db.commit()
+        self.cache(record)
+
+    def add(self, report_id: int, report):
+        record = report.to_record(report_id)
+        # later saves of the report keep the time it was filed
+        report.created_at = record.created_at
+        self.write(record)
+        self.num_reports += 1
+        return record
+
+    def save(self, report_id: int, report):
+        # called whenever a stored report changes (e.g. a near-duplicate is attached or an automatic action is taken)
+        self.write(report.to_record(report_id))
+
+    def cache(self, record: ReportRecord):
+        self.hot_records[record.report_id] = record
+        self.hot_records.move_to_end(record.report_id)
+        while len(self.hot_records) > self.hot_max_entries:
+            self.hot_records.popitem(last = False)
+
+    def get_record(self, report_id: int):
+        # returns None if there is no report with this id
+        record = self.hot_records.get(report_id)
+        if record is not None:
+            self.hot_records.move_to_end(report_id)
+            return record
+
+        row = self.db.execute(f"SELECT {', '.join(REPORT_COLUMNS)} FROM reports WHERE report_id = ?", (report_id,)).fetchone()
+        if row is None:
+            return None
+        record = self.row_to_record(row)
+        self.cache(record)
+        return record
+
+    def get(self, report_id: int):
+        # rebuilds the Report or AutomatedReport, e.g. for a moderator response; its messages are only fetched when an action needs them
+        record = self.get_record(report_id)
+        if record is None:
+            return None
+        report_class = AutomatedReport if record.kind == REPORT_KIND_AUTOMATED else Report
+        return report_class.from_record(self.client, record)
+
+    def open_report_priorities(self):
+        # (report id, high severity, disinfo prob, created at) for each report no moderator has responded to yet, to refill
+        # the moderator queue after a restart; rows are read one at a time, so the backlog's full records are never all in memory
+        rows = self.db.execute("SELECT report_id, high_severity, disinfo_prob, created_at FROM reports WHERE report_id NOT IN (SELECT report_id FROM moderator_responses)")
+        for report_id, high_severity, disinfo_prob, created_at in rows:
+            yield report_id, bool(high_severity), disinfo_prob, created_at
+
+    def open_report_messages(self, after_report_id: int, limit: int):
+        # (report id, disinfo prob, channel id, message id, content snippet) for up to limit open reports after after_report_id,
+        # in report id order, so the open reports can be paged through
+        return self.db.execute("SELECT report_id, disinfo_prob, channel_id, message_id, content_snippet FROM reports "
+                               "WHERE report_id > ? AND report_id NOT IN (SELECT report_id FROM moderator_responses) ORDER BY report_id LIMIT ?",
+                               (after_report_id, limit)).fetchall()
+
+    def record_moderator_response(self, report_id: int, poster_user_id: int, channel_id: int, actions):
+        self.db.execute("INSERT INTO moderator_responses (report_id, poster_user_id, channel_id, action_bits, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (report_id, poster_user_id, channel_id, actions_to_bitmask(actions), time.time()))
+        self.db.commit()
+
+    def is_closed(self, report_id: int):
+        # a report is closed once a moderator has responded to it
+        return self.db.execute("SELECT 1 FROM moderator_responses WHERE report_id = ? LIMIT 1", (report_id,)).fetchone() is not None
+
+    def actions_for_report(self, report_id: int):
+        # the actions recorded by the latest moderator response to the report
+        row = self.db.execute("SELECT action_bits FROM moderator_responses WHERE report_id = ? ORDER BY response_id DESC LIMIT 1", (report_id,)).fetchone()
+        return bitmask_to_actions(row[0]) if row else set()
+
+    def count_reported_posts(self, poster_user_id: int):
+        return self.db.execute("SELECT COUNT(*) FROM moderator_responses WHERE poster_user_id = ?", (poster_user_id,)).fetchone()[0]
+
+    def add_channel_flag(self, channel_id: int, report_id: int = None):
+        self.db.execute("INSERT INTO channel_flags VALUES (?, ?, ?)", (channel_id, report_id, time.time()))
+        self.db.commit()
+
+    def count_channel_flags(self, channel_id: int):
+        return self.db.execute("SELECT COUNT(*) FROM channel_flags WHERE channel_id = ?", (channel_id,)).fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
@@ -2,6 +2,7 @@
 from enum import Enum, auto
 import discord
 import re
+import time
 from reactions import EmojiOption, ModeratorAction, ACTION_TO_POST_ACTION_MESSAGE
 from collections import defaultdict
 from typing import Set
@@ -84,15 +85,17 @@ ACTION_TAKEN_BY_AUTOMATED_REPORT_TAG = "[Action already taken by automated repor
 
 class Response:
     START_KEYWORD = "start"
+    NEXT_KEYWORD = "next"
     REPORT_ID_REGEX = "[0-9]+"
     CANCEL_KEYWORD = "cancel"
     HELP_KEYWORD = "help"
     CONTINUE_KEYWORD = "continue"
 
 
-    def __init__(self, client):
+    def __init__(self, client, moderator_id = None):
         self.state = State.RESPONSE_START
         self.client = client
+        self.moderator_id = moderator_id
         self.report_id = None # this is set in handle_message
         self.report = None  # this is set in handle_messages
         self.reported_message = None # discord's Message object for the reported message, also set in handle_message
@@ -109,21 +112,36 @@ class Response:
 
         self.set_of_previous_actions_taken = set()  # this will contain ModeratorActions, set in handle_message
 
+        # when the moderator last messaged or reacted, and the channel they did it in, so an abandoned response can be expired
+        self.last_activity = time.monotonic()
+        self.channel = None
+        self.prompt_message_ids = [] # the messages the bot sent for this response, which the moderator reacts to
+
 
     async def handle_message(self, message):
         '''
         This function makes up the meat of the moderator reporting flow. It defines how we transition between states and what 
         prompts to offer at each of those states. 
         '''
+        self.last_activity = time.monotonic()
+        self.channel = message.channel
 
         if message.content == self.CANCEL_KEYWORD:
             self.state = State.RESPONSE_CANCELLED
             return ["Report response cancelled."]
+
+        # `next` claims the most urgent open report from the moderator queue
+        if message.content == self.NEXT_KEYWORD and self.state in (State.RESPONSE_START, State.AWAITING_MESSAGE):
+            report_id = self.client.moderator_queue.claim(self.moderator_id)
+            if report_id is None:
+                self.state = State.RESPONSE_CANCELLED
+                return ["There are no open reports right now."]
+            return self.identify_report(report_id)
         
         if self.state == State.RESPONSE_START:
             reply =  "Thank you for responding to report. "
             reply += "Say `help` at any time for more information.\n\n"
-            reply += "Please type the ID number of the report you would like to respond to.\n"
+            reply += "Please type the ID number of the report you would like to respond to, or `next` for the most urgent open report.\n"
             self.state = State.AWAITING_MESSAGE
             return [reply]
         
@@ -135,20 +153,11 @@ class Response:
 
             report_id = int(m.group())
 
-            # use the client mapping from report id to report to get discord's Message object of the reported message
-            self.report_id = report_id
-            self.report = self.client.report_id_to_report[report_id]
-
-            # store any previous actions taken by an automated report
-            if isinstance(self.report, AutomatedReport):
-                self.set_of_previous_actions_taken = self.report.set_of_actions_taken
-
-            self.reported_message = self.client.report_id_to_report[report_id].message
-            # Here we've found the message - it's up to you to decide what to do next!
-            self.state = State.REPORT_IDENTIFIED
-            return [f"Thank you for beginning a response to report number {report_id}!", \
-                    "We'll be asking you a few questions to gather your full response to the report. \n" \
-                    "Type `continue` to continue the response, and say `cancel` to cancel at any point."]
+            if self.client.report_store.get_record(report_id) is None:
+                return [f"I'm sorry, I couldn't find report number {report_id}. Please try again or say `cancel` to cancel."]
+            if not self.client.moderator_queue.claim_report(report_id, self.moderator_id):
+                return [f"Report number {report_id} is already being handled by another moderator. Please pick another report, type `next`, or say `cancel` to cancel."]
+            return self.identify_report(report_id)
 
         # START OF OUR CUSTOM REPORTING STATES
         # Next, we progress through our own states that are outlined in our user reporting flow diagram
@@ -226,6 +235,23 @@ class Response:
         return []
 
 
+    def identify_report(self, report_id):
+        # look the report up in the client's report store to get discord's Message object of the reported message
+        self.report_id = report_id
+        self.report = self.client.report_store.get(report_id)
+
+        # store any previous actions taken by an automated report
+        if isinstance(self.report, AutomatedReport):
+            self.set_of_previous_actions_taken = self.report.set_of_actions_taken
+
+        self.reported_message = self.report.message
+        # Here we've found the message - it's up to you to decide what to do next!
+        self.state = State.REPORT_IDENTIFIED
+        return [f"Thank you for beginning a response to report number {report_id}!", \
+                "We'll be asking you a few questions to gather your full response to the report. \n" \
+                "Type `continue` to continue the response, and say `cancel` to cancel at any point."]
+
+
     def handle_transitions(self):
         # process simple 1-to-1 transitions
         if self.state in STATE_TO_SINGLE_NEXT_STATE:
@@ -239,24 +265,32 @@ class Response:
 
 
     async def take_actions(self, moderator_emojis: Set[ModeratorAction]):
+        # post-level actions also apply to the near-duplicates attached to the report
+        # the actions don't depend on each other, so they're all dispatched at once
+        reported_messages = [self.reported_message] + self.report.duplicate_messages
+        actions = []
         for emoji in moderator_emojis:
             if emoji.action == ModeratorAction.REMOVE_POST:
-                await self.client.remove_reported_post(self.reported_message)
+                for reported_message in reported_messages:
+                    actions.append(self.client.remove_reported_post(reported_message))
             elif emoji.action == ModeratorAction.MODIFY_POST_WITH_DISCLAIMER_AND_RESOURCES:
-                await self.client.modify_post_with_disclaimer_and_reliable_resources(self.reported_message)
+                for reported_message in reported_messages:
+                    actions.append(self.client.modify_post_with_disclaimer_and_reliable_resources(reported_message))
             elif emoji.action == ModeratorAction.NOTIFY_POSTER_OF_TRANSGRESSION:
-                await self.client.notify_poster_of_transgression(self.reported_message)
+                actions.append(self.client.notify_poster_of_transgression(self.reported_message))
             elif emoji.action == ModeratorAction.TEMPORARILY_MUTE_USER:
-                await self.client.temporarily_mute_user(self.reported_message)
+                actions.append(self.client.temporarily_mute_user(self.reported_message))
             elif emoji.action == ModeratorAction.PERMANENTLY_REMOVE_USER:
-                await self.client.permanently_remove_user(self.reported_message)
+                actions.append(self.client.permanently_remove_user(self.reported_message))
             elif emoji.action == ModeratorAction.NOTIFY_GROUP_OF_TRANSGRESSIONS:
-                await self.client.notify_group_of_transgressions(self.reported_message)
+                actions.append(self.client.notify_group_of_transgressions(self.reported_message))
             elif emoji.action == ModeratorAction.INCREMENT_GROUP_TRANSGRESSION_COUNTER:
-                await self.client.increment_group_transgression_counter(self.reported_message)
+                actions.append(self.client.increment_group_transgression_counter(self.reported_message))
+        await self.client.run_actions(*actions)
 
     
     async def handle_reaction(self, message, emoji, user):
+        self.last_activity = time.monotonic()
 
         # check this is a state with valid emoji reaction options
         if self.state in STATE_TO_EMOJI_OPTIONS:
@@ -271,6 +305,11 @@ class Response:
         # we don't need to print a message to the user immediately upon reacting
         return []
 
+    def actions_taken(self):
+        # the ModeratorActions the moderator selected; options such as 👎 or the reasons for elevating have no action
+        return set(emoji_option.action for emoji_options in self.moderator_state_to_selected_emoji.values()
+                   for emoji_option in emoji_options if emoji_option.action is not None)
+
     def generate_summary_for_advanced_moderators(self):
         # Generate a message that summarizes the options selected during both the user and baseline moderator reporting flows
         # use the self.report object to access the self.report.state_to_selected_emoji_options or invoke self.report.generate_summary(self.report_id)
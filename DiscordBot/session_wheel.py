@@ -0,0 +1,50 @@
+# file for expiring idle report and moderator response sessions
+import math
+import time
+
+
+class TimerWheel:
+    '''
+    Hashed timer wheel: a ring of slots, each tick_seconds wide, holding the keys due in that tick. Scheduling and
+    advancing past a slot are O(1) per key, however many keys are scheduled. Deadlines further out than the ring
+    covers go in its last slot and come due early, so whoever advances the wheel should check the key's actual
+    deadline and schedule it again if it isn't due yet (which is also how activity after scheduling is handled).
+    '''
+
+    def __init__(self, horizon_seconds: float, tick_seconds: float):
+        self.tick_seconds = tick_seconds
+        self.num_slots = math.ceil(horizon_seconds / tick_seconds) + 1
+        self.slots = [{} for _ in range(self.num_slots)] # key -> None, in the order they were scheduled
+        self.slot_of = {} # key -> index of the slot it's in
+        self.current_tick = math.floor(time.monotonic() / tick_seconds)
+
+    def __len__(self):
+        return len(self.slot_of)
+
+    def schedule(self, key, deadline: float):
+        # deadline is in time.monotonic() seconds; a key is only ever in one slot
+        self.discard(key)
+        deadline_tick = min(max(math.ceil(deadline / self.tick_seconds), self.current_tick), self.current_tick + self.num_slots - 1)
+        slot_idx = deadline_tick % self.num_slots
+        self.slots[slot_idx][key] = None
+        self.slot_of[key] = slot_idx
+
+    def discard(self, key):
+        slot_idx = self.slot_of.pop(key, None)
+        if slot_idx is not None:
+            del self.slots[slot_idx][key]
+
+    def advance(self, now: float = None):
+        # returns the keys in the slots up to now, which are removed from the wheel
+        now = time.monotonic() if now is None else now
+        now_tick = math.floor(now / self.tick_seconds)
+        due_keys = []
+        # a late sweep needn't go round the ring more than once
+        for tick in range(max(self.current_tick, now_tick - self.num_slots + 1), now_tick + 1):
+            slot = self.slots[tick % self.num_slots]
+            due_keys.extend(slot)
+            for key in slot:
+                del self.slot_of[key]
+            slot.clear()
+        self.current_tick = now_tick + 1
+        return due_keys
@@ -0,0 +1,32 @@
+# tests for InferenceBatcher, which scores the texts of concurrent callers together
+import asyncio
+from batcher import InferenceBatcher
+
+
+def test_batched_texts_get_their_own_results():
+    batches = []
+
+    def score_fn(texts):
+        batches.append(list(texts))
+        return [len(text) for text in texts], [len(text) / 10 for text in texts]
+
+    async def main():
+        batcher = InferenceBatcher(score_fn, max_batch_size = 4, max_wait_seconds = 0.01)
+        return await asyncio.gather(*[batcher.score("x" * idx) for idx in range(6)])
+
+    assert asyncio.run(main()) == [(idx, idx / 10) for idx in range(6)]
+    assert [len(batch) for batch in batches] == [4, 2]
+
+
+def test_a_short_result_fails_every_caller_instead_of_hanging():
+    async def score_fn(texts):
+        return [0] * (len(texts) - 1), [0.0] * (len(texts) - 1)
+
+    async def main():
+        batcher = InferenceBatcher(score_fn, max_batch_size = 3, max_wait_seconds = 0.01)
+        return await asyncio.wait_for(asyncio.gather(*[batcher.score(str(idx)) for idx in range(3)], return_exceptions = True), 1.0)
+
+    results = asyncio.run(main())
+    assert len(results) == 3
+    for result in results:
+        assert isinstance(result, Exception) and "2 preds" in str(result)
@@ -0,0 +1,27 @@
+# tests for the first-stage classifier, which decides which messages go on to the full ensemble
+import pytest
+
+np = pytest.importorskip("numpy")
+from cascade import ENSEMBLE_STAGE, FIRST_STAGE, FirstStageClassifier
+
+
+class FakeModel:
+    # scores each text by the number it ends with, in percent
+    def predict_proba(self, texts):
+        fake_probs = np.array([int(text.split()[-1]) / 100 for text in texts])
+        return np.column_stack([1 - fake_probs, fake_probs])
+
+
+def test_messages_at_or_above_the_threshold_are_escalated():
+    classifier = FirstStageClassifier(FakeModel(), escalation_threshold = 0.1)
+    scores, escalate = classifier.split(["message 2", "message 10", "message 95", "message 9"])
+    assert scores.tolist() == pytest.approx([0.02, 0.1, 0.95, 0.09])
+    assert escalate.tolist() == [False, True, True, False]
+
+
+def test_the_traffic_split_is_counted_across_batches():
+    classifier = FirstStageClassifier(FakeModel(), escalation_threshold = 0.5)
+    classifier.split(["message 10", "message 60"])
+    classifier.split(["message 20", "message 30", "message 50"])
+    assert classifier.stats.stage_to_count == {FIRST_STAGE: 3, ENSEMBLE_STAGE: 2}
+    assert classifier.stats.fractions() == {FIRST_STAGE: 0.6, ENSEMBLE_STAGE: 0.4}
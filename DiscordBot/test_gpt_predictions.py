@@ -0,0 +1,85 @@
+# tests for the concurrent, retrying Chat-GPT requests in automated.py, against a local fake chat-completions server
+import asyncio
+import contextlib
+import json
+import os
+import time
+import pytest
+from fake_chat_completions import FakeChatCompletionsServer
+
+PREFIX_MESSAGES = [{"role": "system", "content": "Classify input as either 'real' or 'fake'."}]
+
+
+@pytest.fixture(scope = "module")
+def automated(tmp_path_factory):
+    pytest.importorskip("numpy")
+    openai = pytest.importorskip("openai")
+    if not openai.version.VERSION.startswith("0."):
+        pytest.skip("automated.py uses the openai<1 API")
+
+    # automated.py reads tokens.json from the working directory when it's imported
+    directory = tmp_path_factory.mktemp("bot")
+    (directory / "tokens.json").write_text(json.dumps({"openai_organization": "", "openai_api_key": "test"}))
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        import automated
+    finally:
+        os.chdir(cwd)
+    return automated
+
+
+@contextlib.contextmanager
+def fake_server(automated, latency_seconds = 0.0, reply_fn = None):
+    server = FakeChatCompletionsServer(latency_seconds, reply_fn) if reply_fn else FakeChatCompletionsServer(latency_seconds)
+    api_base = automated.openai.api_base
+    with server:
+        automated.openai.api_base = server.api_base
+        try:
+            yield server
+        finally:
+            automated.openai.api_base = api_base
+
+
+def test_predictions_come_back_in_input_order(automated):
+    texts = ["fake 0", "real 1", "maybe 2", "fake 3"]
+
+    def reply(text, attempt):
+        # the first texts are answered last
+        idx = int(text.split()[1])
+        time.sleep(0.05 * (len(texts) - idx))
+        return 200, text.split()[0]
+
+    with fake_server(automated, reply_fn = reply):
+        preds = asyncio.run(automated.generate_gpt_predictions_async(texts, PREFIX_MESSAGES))
+    assert preds == [1, 0, 0.5, 1]
+
+
+def test_requests_in_flight_are_bounded(automated):
+    texts = [f"message {idx}" for idx in range(12)]
+    with fake_server(automated, latency_seconds = 0.1) as server:
+        preds = asyncio.run(automated.generate_gpt_predictions_async(texts, PREFIX_MESSAGES, max_concurrency = 3))
+    assert preds == [0] * len(texts)
+    assert server.max_in_flight == 3
+
+
+def test_throttled_and_failing_requests_are_retried_with_jitter(automated, monkeypatch):
+    monkeypatch.setattr(automated, "GPT_RETRY_BASE_DELAY_SECONDS", 0.01)
+    backoffs = []
+    monkeypatch.setattr(automated.random, "uniform", lambda low, high: backoffs.append((low, high)) or 0.0)
+
+    def reply(text, attempt):
+        if text == "flaky":
+            return [(429, "rate limited"), (500, "server error"), (200, "fake")][attempt]
+        if text == "down":
+            return 500, "server error"
+        return 400, "bad request"
+
+    with fake_server(automated, reply_fn = reply) as server:
+        preds = asyncio.run(automated.generate_gpt_predictions_async(["flaky", "down", "invalid"], PREFIX_MESSAGES, max_retries = 2))
+
+    # the last retry of "down" fails too, so it falls back to no prediction; a 400 isn't worth retrying
+    assert preds == [1, automated.NO_GPT_PRED_NUM_LABEL, automated.NO_GPT_PRED_NUM_LABEL]
+    assert server.attempts == {"flaky": 3, "down": 3, "invalid": 1}
+    # each retry waits a random time up to an exponentially growing bound
+    assert sorted(backoffs) == [(0, 0.01), (0, 0.01), (0, 0.02), (0, 0.02)]
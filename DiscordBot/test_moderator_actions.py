@@ -0,0 +1,27 @@
+# tests for turning the options a moderator selected into the actions recorded for a report
+import pytest
+from reactions import ModeratorAction, actions_to_bitmask, bitmask_to_actions
+
+
+def test_actions_to_bitmask_round_trips():
+    actions = {ModeratorAction.REMOVE_POST, ModeratorAction.NOTIFY_POSTER_OF_TRANSGRESSION}
+    assert bitmask_to_actions(actions_to_bitmask(actions)) == actions
+
+
+def test_actions_to_bitmask_skips_options_without_an_action():
+    assert actions_to_bitmask({None, ModeratorAction.REMOVE_POST}) == actions_to_bitmask({ModeratorAction.REMOVE_POST})
+    assert actions_to_bitmask({None}) == 0
+
+
+def test_declining_to_elevate_records_only_real_actions():
+    pytest.importorskip("discord")
+    import response as response_module
+    response = response_module.Response(client = None, moderator_id = 1)
+    post_options = response_module.STATE_TO_EMOJI_OPTIONS[response_module.State.ASK_FOR_POST_ACTIONS]
+    elevate_options = response_module.STATE_TO_EMOJI_OPTIONS[response_module.State.ASK_IF_ELEVATE_TO_ADVANCED_MODERATORS]
+    response.moderator_state_to_selected_emoji[response_module.State.ASK_FOR_POST_ACTIONS].add(post_options["2️⃣"])
+    response.moderator_state_to_selected_emoji[response_module.State.ASK_IF_ELEVATE_TO_ADVANCED_MODERATORS].add(elevate_options["👎"])
+
+    actions = response.actions_taken()
+    assert actions == {ModeratorAction.REMOVE_POST}
+    assert bitmask_to_actions(actions_to_bitmask(actions)) == {ModeratorAction.REMOVE_POST}
@@ -0,0 +1,65 @@
+# tests for the order in which moderators are handed open reports
+import types
+from moderator_queue import ModeratorQueue, MIN_REMOVED_ENTRIES_TO_COMPACT
+
+NOW = 1_700_000_000.0
+HOUR = 3600.0
+
+
+def record(report_id, high_severity = False, disinfo_prob = None, age_hours = 0.0):
+    return types.SimpleNamespace(report_id = report_id, high_severity = high_severity, disinfo_prob = disinfo_prob, created_at = NOW - age_hours * HOUR)
+
+
+def claim_all(queue):
+    return [report_id for report_id in iter(lambda: queue.claim("moderator"), None)]
+
+
+def test_high_severity_reports_come_first_however_long_others_have_waited():
+    queue = ModeratorQueue()
+    queue.push(record(1, age_hours = 3)) # a user report, ranked as if scored 0.5
+    queue.push(record(2, disinfo_prob = 0.95, age_hours = 48))
+    queue.push(record(3, high_severity = True, disinfo_prob = 0.98))
+    assert claim_all(queue) == [3, 2, 1]
+
+
+def test_waiting_reports_overtake_higher_scored_ones_in_their_tier():
+    queue = ModeratorQueue(aging_priority_per_hour = 0.5)
+    queue.push(record(1, disinfo_prob = 0.95))
+    queue.push(record(2, disinfo_prob = 0.91, age_hours = 1))
+    queue.push(record(3, disinfo_prob = 0.99))
+    assert claim_all(queue) == [2, 3, 1]
+
+
+def test_claims_are_exclusive_and_released_reports_keep_their_place():
+    queue = ModeratorQueue()
+    queue.push(record(1, disinfo_prob = 0.99))
+    queue.push(record(2, disinfo_prob = 0.95))
+    assert queue.claim("alice") == 1
+    assert queue.claim_report(1, "bob") is False
+    assert queue.claimed_by(1) == "alice"
+
+    queue.release(1)
+    assert len(queue) == 2
+    assert queue.claim("bob") == 1
+
+
+def test_completed_and_claimed_by_id_reports_leave_the_queue():
+    queue = ModeratorQueue()
+    for report_id in range(3):
+        queue.push(record(report_id, disinfo_prob = 0.9 + report_id / 100))
+    queue.push(record(2, disinfo_prob = 0.99)) # pushing a queued report again doesn't duplicate it
+    queue.complete(2)
+    assert queue.claim_report(1, "alice") is True
+    assert claim_all(queue) == [0]
+    assert len(queue) == 0
+
+
+def test_the_heap_is_compacted_once_mostly_removed():
+    queue = ModeratorQueue()
+    num_reports = 2 * MIN_REMOVED_ENTRIES_TO_COMPACT + 2
+    for report_id in range(num_reports):
+        queue.push(record(report_id, disinfo_prob = 0.9))
+    for report_id in range(num_reports - 1):
+        queue.complete(report_id)
+    assert len(queue.heap) < num_reports
+    assert claim_all(queue) == [num_reports - 1]
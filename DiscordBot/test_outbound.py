@@ -0,0 +1,67 @@
+# tests for OutboundDispatcher, which merges queued replies and rate-limits each destination
+import asyncio
+import types
+import outbound
+from outbound import OutboundDispatcher, TokenBucket, destination_key, split_message
+
+
+class FakeChannel:
+    def __init__(self, channel_id = 1, recipient = None):
+        self.id = channel_id
+        self.type = "private" if recipient else "text"
+        self.recipient = recipient
+        self.sent = []
+
+    async def send(self, content):
+        self.sent.append(content)
+        return content
+
+
+def test_long_content_splits_at_newlines_then_spaces():
+    assert split_message("one two\nthree four", max_length = 12) == ["one two", "three four"]
+    assert split_message("one two three", max_length = 9) == ["one two", "three"]
+    assert split_message("abcdefghij", max_length = 4) == ["abcd", "efgh", "ij"]
+    assert split_message("short", max_length = 10) == ["short"]
+
+
+def test_queued_replies_are_merged_into_as_few_messages_as_fit():
+    channel = FakeChannel()
+
+    async def main():
+        dispatcher = OutboundDispatcher(max_length = 10)
+        futures = [dispatcher.send(channel, "aaa"), dispatcher.send(channel, "bbb", "ccc"), dispatcher.send(channel, "dddd")]
+        return await asyncio.gather(*futures)
+
+    assert asyncio.run(main()) == [True, True, True]
+    assert channel.sent == ["aaa\nbbb", "ccc\ndddd"]
+
+
+def test_a_person_has_one_bucket_however_they_are_addressed():
+    member = types.SimpleNamespace(id = 7, discriminator = "0")
+    dm_channel = FakeChannel(channel_id = 99, recipient = member)
+    stored_author = types.SimpleNamespace(id = 7, name = "user7", mention = "<@7>") # as report_record.StoredAuthor
+    assert destination_key(member) == destination_key(dm_channel) == destination_key(stored_author)
+    assert destination_key(FakeChannel(channel_id = 7)) != destination_key(member)
+
+
+def test_the_bucket_refills_at_its_rate_up_to_its_burst(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(outbound.time, "monotonic", lambda: now[0])
+    sleeps = []
+
+    async def fake_sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    monkeypatch.setattr(outbound.asyncio, "sleep", fake_sleep)
+
+    async def main():
+        bucket = TokenBucket(rate = 2.0, burst = 3)
+        for _ in range(4):
+            await bucket.acquire()
+        assert sleeps == [0.5] # the burst is spent, so the fourth send waits for one token
+        now[0] += 60
+        await bucket.acquire()
+        assert bucket.tokens == 2 # a long idle spell refills only up to the burst
+
+    asyncio.run(main())
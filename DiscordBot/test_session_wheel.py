@@ -0,0 +1,50 @@
+# tests for TimerWheel, which finds the report and moderator response sessions that have gone idle
+import session_wheel
+from session_wheel import TimerWheel
+
+START = 1000.0
+
+
+def wheel(monkeypatch, horizon_seconds = 60, tick_seconds = 10):
+    monkeypatch.setattr(session_wheel.time, "monotonic", lambda: START)
+    return TimerWheel(horizon_seconds, tick_seconds)
+
+
+def test_keys_come_due_in_the_tick_of_their_deadline(monkeypatch):
+    timers = wheel(monkeypatch)
+    timers.schedule("a", START + 15)
+    timers.schedule("b", START + 25)
+    timers.schedule("c", START + 20)
+    assert timers.advance(START + 19) == []
+    assert timers.advance(START + 20) == ["a", "c"]
+    assert timers.advance(START + 30) == ["b"]
+    assert len(timers) == 0
+
+
+def test_rescheduling_or_discarding_a_key_moves_it(monkeypatch):
+    timers = wheel(monkeypatch)
+    timers.schedule("active", START + 10)
+    timers.schedule("active", START + 40) # activity pushes the deadline back
+    timers.schedule("closed", START + 10)
+    timers.discard("closed")
+    assert len(timers) == 1
+    assert timers.advance(START + 30) == []
+    assert timers.advance(START + 40) == ["active"]
+
+
+def test_deadlines_past_the_horizon_come_due_early_and_overdue_ones_at_once(monkeypatch):
+    timers = wheel(monkeypatch)
+    timers.schedule("far", START + 1000)
+    timers.schedule("overdue", START - 100)
+    assert timers.advance(START) == ["overdue"]
+    # the caller checks the actual deadline and schedules "far" again
+    assert timers.advance(START + 60) == ["far"]
+
+
+def test_a_late_sweep_goes_round_the_ring_once(monkeypatch):
+    timers = wheel(monkeypatch)
+    for idx in range(7):
+        timers.schedule(idx, START + 10 * idx)
+    assert sorted(timers.advance(START + 10000)) == list(range(7))
+    timers.schedule("next", START + 10010)
+    assert timers.advance(START + 10010) == ["next"]
@@ -0,0 +1,24 @@
+# tests that normalize_text matches tweet-preprocessor's clean() with the URL and EMOJI options, which the BERT model was fine-tuned on
+import csv
+import pathlib
+import pytest
+from text_normalizer import normalize_text
+
+DATA_DIR = pathlib.Path(__file__).resolve().parent.parent / "Data_And_Models"
+
+
+@pytest.mark.parametrize("file_name", ["full_train.csv", "full_test.csv"])
+def test_normalize_text_matches_tweet_preprocessor(file_name):
+    p = pytest.importorskip("preprocessor")
+    p.set_options(p.OPT.URL, p.OPT.EMOJI)
+
+    with open(DATA_DIR / file_name, newline='') as f:
+        texts = [row['text'] for row in csv.DictReader(f)]
+
+    mismatches = [(text, p.clean(text), normalize_text(text)) for text in texts if p.clean(text) != normalize_text(text)]
+    assert not mismatches, f"{len(mismatches)}/{len(texts)} texts differ, e.g. {mismatches[:3]}"
+
+
+def test_normalize_text_drops_links_and_emoji_and_collapses_whitespace():
+    assert normalize_text("Stay safe 😷  see https://www.cdc.gov/coronavirus (now)") == "Stay safe see (now)"
+    assert normalize_text("cdc.gov/coronavirus has\tthe facts") == "has the facts"
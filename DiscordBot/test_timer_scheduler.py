@@ -0,0 +1,55 @@
+# tests for TimerScheduler, which runs timed moderator actions such as unmuting a user
+import asyncio
+from timer_scheduler import TimerScheduler
+
+
+def test_timers_fire_in_due_order_and_a_failing_handler_doesnt_stop_the_rest(tmp_path):
+    fired = []
+
+    async def unmute(payload):
+        if payload["user"] == "broken":
+            raise RuntimeError("channel is gone")
+        fired.append(payload["user"])
+
+    async def main():
+        scheduler = TimerScheduler(str(tmp_path / "timers.db"))
+        scheduler.register("unmute", unmute)
+        scheduler.start()
+        scheduler.schedule(0.06, "unmute", {"user": "late"})
+        scheduler.schedule(0.02, "unmute", {"user": "broken"})
+        scheduler.schedule(0.04, "unmute", {"user": "early"}) # scheduled after a later timer, while the runner waits
+        scheduler.schedule(0.03, "unknown", {"user": "dropped"})
+        await asyncio.sleep(0.2)
+        scheduler.runner_task.cancel()
+        remaining = scheduler.db.execute("SELECT COUNT(*) FROM timers").fetchone()[0]
+        scheduler.close()
+        return remaining
+
+    assert asyncio.run(main()) == 0
+    assert fired == ["early", "late"]
+
+
+def test_pending_timers_survive_a_restart(tmp_path):
+    db_file = str(tmp_path / "timers.db")
+    scheduler = TimerScheduler(db_file)
+    scheduler.schedule(0.0, "unmute", {"user": "overdue"})
+    scheduler.schedule(3600, "unmute", {"user": "later"})
+    scheduler.close()
+
+    fired = []
+
+    async def unmute(payload):
+        fired.append(payload["user"])
+
+    async def main():
+        restarted = TimerScheduler(db_file)
+        assert len(restarted) == 2
+        restarted.register("unmute", unmute)
+        restarted.start()
+        await asyncio.sleep(0.05)
+        restarted.runner_task.cancel()
+        restarted.close()
+        return len(restarted)
+
+    assert asyncio.run(main()) == 1
+    assert fired == ["overdue"]
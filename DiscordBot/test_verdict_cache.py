@@ -0,0 +1,58 @@
+# tests for VerdictCache, which keeps the classifier's verdicts by normalized message content
+import verdict_cache
+from verdict_cache import Verdict, VerdictCache
+
+
+def verdict(score):
+    return Verdict(bert_pred = 1, bert_score = score, gpt_pred = 1, ensemble_pred = 1, ensemble_score = score)
+
+
+def test_copies_differing_in_case_and_spacing_share_a_verdict():
+    cache = VerdictCache()
+    cache.put("Vaccines  cause\nmagnetism", verdict(0.9))
+    assert cache.get("  vaccines cause MAGNETISM ").ensemble_score == 0.9
+    assert cache.get("vaccines cause magnetism!") is None
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.drain_counts() == (1, 1)
+    assert cache.drain_counts() == (0, 0)
+
+
+def test_verdicts_expire_after_the_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(verdict_cache.time, "time", lambda: now[0])
+    cache = VerdictCache(ttl_seconds = 60)
+    cache.put("text", verdict(0.9))
+    now[0] += 60
+    assert cache.get("text") is not None
+    now[0] += 1
+    assert cache.get("text") is None
+    assert len(cache.entries) == 0
+
+
+def test_the_least_recently_used_verdict_is_evicted():
+    cache = VerdictCache(max_entries = 2)
+    cache.put("a", verdict(0.1))
+    cache.put("b", verdict(0.2))
+    cache.get("a")
+    cache.put("c", verdict(0.3))
+    assert cache.get("b") is None
+    assert cache.get("a").ensemble_score == 0.1
+    assert cache.get("c").ensemble_score == 0.3
+
+
+def test_verdicts_are_reloaded_from_sqlite_after_a_restart(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(verdict_cache.time, "time", lambda: now[0])
+    db_file = str(tmp_path / "verdicts.db")
+    cache = VerdictCache(ttl_seconds = 60, db_file = db_file)
+    cache.put("old", verdict(0.9))
+    now[0] += 30
+    cache.put("recent", verdict(0.8))
+    cache.db.close()
+
+    now[0] += 40 # "old" is now past its ttl, "recent" is not yet
+    restarted = VerdictCache(ttl_seconds = 60, db_file = db_file)
+    assert restarted.db.execute("SELECT COUNT(*) FROM verdicts").fetchone()[0] == 1
+    assert restarted.get("old") is None
+    assert restarted.get("recent").as_row() == verdict(0.8).as_row()
+    assert len(restarted.entries) == 1
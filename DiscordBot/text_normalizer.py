@@ -0,0 +1,29 @@
+# file for the text normalization applied to messages before BERT sees them
+# it matches tweet-preprocessor's clean() with the URL and EMOJI options (what the BERT model was fine-tuned on), using precompiled
+# regexes instead of tweet-preprocessor + NLTK; test_text_normalizer.py checks that equivalence on the committed datasets
+import re
+
+# country and generic top-level domains recognized in links without a scheme (e.g. "cdc.gov/coronavirus")
+URL_TLDS = "com|net|org|edu|gov|mil|aero|asia|biz|cat|coop|int|jobs|mobi|museum|name|post|pro|tel|travel|xxx|ac|ad|ae|af|ag|ai|al|am|an|ao|aq|ar|as|at|au|aw|ax|az|ba|bd|be|bf|bg|bh|bi|bj|bm|bn|bo|br|bs|bt|bv|bw|by|bz|ca|cc|cd|cf|cg|ch|ci|ck|cl|cm|cn|co|cr|cs|cu|cv|cx|cy|dd|de|dj|dk|dm|do|dz|ec|ee|eg|eh|er|es|et|eu|fi|fj|fk|fm|fo|fr|ga|gb|gd|ge|gf|gg|gh|gi|gl|gm|gn|gp|gq|gr|gt|gu|gw|gy|hk|hm|hn|hr|ht|hu|id|ie|il|im|in|io|iq|ir|is|it|je|jm|jo|jp|ke|kg|kh|ki|km|kn|kp|kr|kw|ky|kz|lb|lc|li|lk|lr|ls|lt|lu|lv|ly|ma|mc|md|me|mg|mh|mk|ml|mm|mn|mo|mp|mq|mr|ms|mt|mu|mv|mw|mx|my|mz|na|nc|ne|ng|ni|nl|no|np|nr|nu|nz|om|pa|pe|pf|pg|ph|pk|pl|pm|pn|pr|ps|pt|pw|py|qa|re|ro|rs|ru|rw|sa|sb|sc|sd|se|sg|si|sj|ja|sk|sl|sm|sn|so|sr|ss|st|su|sv|sx|sy|sz|tc|td|tf|tg|th|tj|tk|tl|tm|tn|to|tp|tr|tt|tv|tw|tz|ua|ug|us|uy|uz|va|vc|ve|vg|vi|vn|vu|wf|ws|ye|yt|yu|za|zm|zw"
+
+# a link starts with a scheme, or a domain followed by a slash, and runs until whitespace, allowing balanced
+# parentheses inside it but not trailing punctuation
+URL_REGEX = re.compile(
+    r"(?:https?:(?:/{1,3}|[a-z0-9%])|[a-z0-9.\-]+[.](?:" + URL_TLDS + r")/)"
+    r"(?:[^\s()<>{}\[\]]+|\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\))+"
+    r"(?:\([^\s()]*?\([^\s()]+\)[^\s()]*?\)|\([^\s]+?\)|[^\s`!()\[\]{};:'\".,<>?])",
+    re.IGNORECASE)
+
+
+def normalize_text(text):
+    # emoji go along with every other non-ASCII character, links are removed, and whitespace is collapsed
+    text = text.encode('ascii', 'ignore').decode('ascii')
+    # every link contains a ':' (after the scheme) or a '/' (after the domain), so most chat messages skip the regex
+    if ':' in text or '/' in text:
+        text = URL_REGEX.sub('', text)
+    return ' '.join(text.split())
+
+
+def normalize_texts(text_inputs):
+    return [normalize_text(text) for text in text_inputs]
+
@@ -0,0 +1,87 @@
+# file for running timed actions (e.g. unmuting a user) at their due time, persisted so they survive a restart
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger('discord')
+
+DEFAULT_DB_FILE = "timers.db"
+
+
+class TimerScheduler:
+    '''
+    A heap of pending timers kept by due time, and mirrored in SQLite so that timers still pending when the bot
+    stops fire after it restarts (immediately, if they're overdue by then). A single task sleeps until the earliest
+    timer is due, however many are pending, and each timer's handler runs as its own task so a slow one doesn't
+    delay the rest. Handlers are registered per kind of timer and take the timer's JSON payload.
+    '''
+
+    def __init__(self, db_file: str = DEFAULT_DB_FILE):
+        self.handlers = {} # timer kind -> async handler(payload)
+        self.heap = [] # (due time, timer id, kind, payload)
+        self.wake_up = None # set whenever a timer is scheduled, so the runner can recompute how long to sleep
+        self.runner_task = None
+        self.handler_tasks = set()
+
+        self.db = sqlite3.connect(db_file)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS timers (timer_id INTEGER PRIMARY KEY, due_at REAL, kind TEXT, payload TEXT)")
+        self.db.commit()
+        for timer_id, due_at, kind, payload in self.db.execute("SELECT timer_id, due_at, kind, payload FROM timers"):
+            self.heap.append((due_at, timer_id, kind, json.loads(payload)))
+        heapq.heapify(self.heap)
+
+    def __len__(self):
+        return len(self.heap)
+
+    def register(self, kind: str, handler):
+        self.handlers[kind] = handler
+
+    def start(self):
+        if self.runner_task is None or self.runner_task.done():
+            self.wake_up = asyncio.Event()
+            self.runner_task = asyncio.get_running_loop().create_task(self.run())
+
+    def schedule(self, delay_seconds: float, kind: str, payload: dict):
+        due_at = time.time() + delay_seconds
+        timer_id = self.db.execute("INSERT INTO timers (due_at, kind, payload) VALUES (?, ?, ?)", (due_at, kind, json.dumps(payload))).lastrowid
+        self.db.commit()
+        heapq.heappush(self.heap, (due_at, timer_id, kind, payload))
+        if self.wake_up is not None:
+            self.wake_up.set()
+        return timer_id
+
+    async def run(self):
+        while True:
+            self.wake_up.clear()
+            timeout = max(0.0, self.heap[0][0] - time.time()) if self.heap else None
+            try:
+                await asyncio.wait_for(self.wake_up.wait(), timeout)
+                # a timer was scheduled; it may be due before the one we were waiting for
+                continue
+            except asyncio.TimeoutError:
+                pass
+
+            while self.heap and self.heap[0][0] <= time.time():
+                due_at, timer_id, kind, payload = heapq.heappop(self.heap)
+                self.db.execute("DELETE FROM timers WHERE timer_id = ?", (timer_id,))
+                self.db.commit()
+                task = asyncio.get_running_loop().create_task(self.fire(kind, payload))
+                self.handler_tasks.add(task)
+                task.add_done_callback(self.handler_tasks.discard)
+
+    async def fire(self, kind, payload):
+        handler = self.handlers.get(kind)
+        if handler is None:
+            logger.error(f"No handler registered for {kind} timers, dropping {payload}")
+            return
+        try:
+            await handler(payload)
+        except Exception:
+            logger.exception(f"The {kind} timer with {payload} failed")
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,109 @@
+# file for translating messages to English before they're classified, skipping messages that are already English
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+DEFAULT_CACHE_MAX_ENTRIES = 10000 # source text -> translation pairs kept in memory
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8 # texts translated at once; Google Translate takes one text per request
+
+
+def needs_translation(text):
+    # a cheap script check: text whose letters are all ASCII is treated as English and never sent to the translator
+    # (emoji, digits and punctuation aren't letters, so they don't count either way)
+    return any(not char.isascii() and char.isalpha() for char in text)
+
+
+class GoogleTranslatorClient:
+    '''
+    Translates one text per request through Google Translate with deep_translator. Any object with the same
+    translate method (e.g. a local stub in tests) can be given to Translator instead; it's called from several threads.
+    '''
+
+    def __init__(self, source: str = 'auto', target: str = 'en'):
+        self.source = source
+        self.target = target
+        # a GoogleTranslator keeps the text being translated in its request parameters, so each thread gets its own
+        self.thread_local = threading.local()
+
+    def translate(self, text):
+        translator = getattr(self.thread_local, "translator", None)
+        if translator is None:
+            from deep_translator import GoogleTranslator
+            translator = self.thread_local.translator = GoogleTranslator(source=self.source, target=self.target)
+        return translator.translate(text)
+
+
+class Translator:
+    '''
+    Translates the non-English texts of a batch concurrently, one request each, and caches every translation.
+    A text whose translation fails keeps its original text, without affecting the rest of the batch.
+    '''
+
+    def __init__(self, client, cache_max_entries: int = DEFAULT_CACHE_MAX_ENTRIES, max_concurrent_requests: int = DEFAULT_MAX_CONCURRENT_REQUESTS):
+        self.client = client
+        self.cache_max_entries = cache_max_entries
+        self.cache = OrderedDict() # source text -> translation, least recently used first
+        self.lock = threading.Lock()
+        self.max_concurrent_requests = max_concurrent_requests
+        self.executor = None # created on the first text that needs translating
+
+    def cached_translation(self, text):
+        with self.lock:
+            translation = self.cache.get(text)
+            if translation is not None:
+                self.cache.move_to_end(text)
+            return translation
+
+    def cache_translation(self, text, translation):
+        with self.lock:
+            self.cache[text] = translation
+            self.cache.move_to_end(text)
+            while len(self.cache) > self.cache_max_entries:
+                self.cache.popitem(last = False)
+
+    def translate(self, text_inputs):
+        translated_inputs = list(text_inputs)
+
+        # only non-English texts that haven't been translated before go to the translator
+        uncached_texts = []
+        uncached_text_set = set()
+        for idx, text in enumerate(text_inputs):
+            if not needs_translation(text):
+                continue
+            translation = self.cached_translation(text)
+            if translation is not None:
+                translated_inputs[idx] = translation
+            elif text not in uncached_text_set:
+                uncached_texts.append(text)
+                uncached_text_set.add(text)
+
+        if not len(uncached_texts):
+            return translated_inputs
+
+        if len(uncached_texts) == 1:
+            translations = [self.translate_one(uncached_texts[0])]
+        else:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(max_workers = self.max_concurrent_requests, thread_name_prefix = "translation")
+            translations = list(self.executor.map(self.translate_one, uncached_texts))
+
+        text_to_translation = {text: translation for text, translation in zip(uncached_texts, translations) if translation}
+
+        for idx, text in enumerate(text_inputs):
+            if text in text_to_translation:
+                translated_inputs[idx] = text_to_translation[text]
+        return translated_inputs
+
+    def translate_one(self, text):
+        # returns None if the translation failed; untranslated text is still classified, just less accurately
+        try:
+            translation = self.client.translate(text)
+        except Exception as e:
+            print(e)
+            return None
+        # an empty translation is treated as a failure, and the original text is kept
+        if not translation:
+            return None
+        self.cache_translation(text, translation)
+        return translation
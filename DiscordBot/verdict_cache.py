@@ -0,0 +1,118 @@
+# file for caching the classifier's verdicts by message content, so reposted text isn't translated and classified again
+from collections import OrderedDict
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+
+DEFAULT_MAX_ENTRIES = 10000 # number of verdicts kept in memory
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60 # verdicts older than this are classified again
+
+WHITESPACE_REGEX = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    # copies of a post often only differ in case and spacing
+    return WHITESPACE_REGEX.sub(" ", text).strip().lower()
+
+
+def text_hash(text):
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class Verdict:
+    '''
+    Every model's output for a single message, as produced by the pipeline in automated.py.
+    '''
+    __slots__ = ("bert_pred", "bert_score", "gpt_pred", "ensemble_pred", "ensemble_score")
+
+    def __init__(self, bert_pred: int, bert_score: float, gpt_pred: float, ensemble_pred: int, ensemble_score: float):
+        self.bert_pred = bert_pred
+        self.bert_score = bert_score
+        self.gpt_pred = gpt_pred
+        self.ensemble_pred = ensemble_pred
+        self.ensemble_score = ensemble_score
+
+    def as_row(self):
+        return (self.bert_pred, self.bert_score, self.gpt_pred, self.ensemble_pred, self.ensemble_score)
+
+
+class VerdictCache:
+    '''
+    LRU cache from a hash of the normalized message text to its Verdict. Entries expire after ttl_seconds.
+    If db_file is given, verdicts are also written to SQLite so that warm entries survive a restart
+    and are shared between inference workers.
+    '''
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS, db_file: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict() # hash -> (expiry time, Verdict), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.drained_hits = 0 # hits and misses already handed out by drain_counts()
+        self.drained_misses = 0
+
+        self.db = None
+        if db_file:
+            self.db = sqlite3.connect(db_file, check_same_thread = False)
+            # WAL lets several worker processes read the cache while one of them writes
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("CREATE TABLE IF NOT EXISTS verdicts (key TEXT PRIMARY KEY, expires_at REAL, bert_pred INTEGER, bert_score REAL, gpt_pred REAL, ensemble_pred INTEGER, ensemble_score REAL)")
+            self.db.execute("DELETE FROM verdicts WHERE expires_at < ?", (time.time(),))
+            self.db.commit()
+
+    def get(self, text):
+        key = text_hash(text)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] < now:
+                del self.entries[key]
+                entry = None
+
+            if entry is None and self.db:
+                row = self.db.execute("SELECT expires_at, bert_pred, bert_score, gpt_pred, ensemble_pred, ensemble_score FROM verdicts WHERE key = ? AND expires_at >= ?", (key, now)).fetchone()
+                if row:
+                    entry = (row[0], Verdict(*row[1:]))
+                    self.store(key, entry)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, text, verdict: Verdict):
+        key = text_hash(text)
+        expires_at = time.time() + self.ttl_seconds
+        with self.lock:
+            self.store(key, (expires_at, verdict))
+            if self.db:
+                self.db.execute("INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?)", (key, expires_at) + verdict.as_row())
+                self.db.commit()
+
+    def store(self, key, entry):
+        # callers hold self.lock
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last = False)
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate()}
+
+    def drain_counts(self):
+        # the (hits, misses) since the last call, for the bot's metrics counters (the cache lives in the inference workers)
+        with self.lock:
+            counts = (self.hits - self.drained_hits, self.misses - self.drained_misses)
+            self.drained_hits, self.drained_misses = self.hits, self.misses
+        return counts